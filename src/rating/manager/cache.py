@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+import threading
+import time
+
+
+class TTLCache:
+    """
+    In-process cache whose entries expire after a given time.
+
+    The cache holds at most maxsize entries, the least recently used
+    entry being evicted first. It can be shared between threads.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 128):
+        """
+        Create an empty cache.
+
+        :ttl (float) The lifetime of an entry, in seconds.
+        :maxsize (int) The maximum number of entries.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the value of an entry, if it did not expire.
+
+        :key (Hashable) The key of the entry.
+        :default (Any) The value to return for a missing or expired entry.
+
+        Return the cached value, or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expiry, value = entry
+            if expiry <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Store a value in the cache.
+
+        :key (Hashable) The key of the entry.
+        :value (Any) The value to store.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable = None):
+        """
+        Remove an entry from the cache, or every entry if no key is given.
+
+        :key (Hashable) The key of the entry.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -0,0 +1,135 @@
+from datetime import datetime as dt
+from typing import AnyStr, Dict, Tuple
+import os
+import threading
+
+from rating.manager import utils
+
+
+class CheckpointStore:
+    """
+    Progress of the windows being sent to the rating-api, by report, metric and window begin.
+
+    Each checkpoint holds the end of its window and the key of the last
+    committed frame, frames being sent in the order of their keys, so that
+    a retried rating rebuilds the same window and skips the frames up to that
+    key. Checkpoints are saved after every batch to a file, if one is given,
+    so that a restarted operator resumes after the last committed batch.
+    Window begins are compared to the second, the precision the rating-api
+    keeps the last rated time of a report with.
+    """
+
+    def __init__(self, path: AnyStr = None):
+        """
+        Create the store, loading the checkpoints saved in path if any.
+
+        :path (AnyStr) The file the checkpoints are saved to, None to keep them in memory only.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._checkpoints = {}
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        """Return the number of windows in progress."""
+        return len(self._checkpoints)
+
+    @staticmethod
+    def key(report_name: AnyStr, metric: AnyStr, begin: dt) -> AnyStr:
+        """
+        Get the key of the checkpoint of a window.
+
+        :report_name (AnyStr) The name of the rated report.
+        :metric (AnyStr) The name of the rated metric.
+        :begin (datetime) The begin of the window.
+
+        Return the key, as a string.
+        """
+        return f'{report_name}/{metric}/{begin.replace(microsecond=0).isoformat()}'
+
+    def load(self):
+        """Load the checkpoints saved in the file of the store, if any."""
+        checkpoints = utils.load_json_file(self.path, 'checkpoints')
+        if checkpoints is None:
+            return
+        with self._lock:
+            self._checkpoints = {key: dict(checkpoint,
+                                           end=dt.fromisoformat(checkpoint['end']),
+                                           last_row=checkpoint.get('last_row') and tuple(checkpoint['last_row']))
+                                 for key, checkpoint in checkpoints.items()}
+
+    def _save(self):
+        """Save the checkpoints to the file of the store, atomically. The lock must be held."""
+        if self.path:
+            utils.save_json_file(self.path,
+                                 {key: dict(checkpoint, end=checkpoint['end'].isoformat())
+                                  for key, checkpoint in self._checkpoints.items()},
+                                 'checkpoints')
+
+    def get(self, key: AnyStr) -> Dict or None:
+        """
+        Get the checkpoint of a window.
+
+        :key (AnyStr) The key of the window.
+
+        Return a copy of the checkpoint, or None.
+        """
+        with self._lock:
+            checkpoint = self._checkpoints.get(key)
+            return dict(checkpoint) if checkpoint else None
+
+    def start(self, key: AnyStr, report_name: AnyStr, end: dt) -> Dict:
+        """
+        Get the checkpoint of a window, creating it if the window was never started.
+
+        :key (AnyStr) The key of the window.
+        :report_name (AnyStr) The name of the rated report.
+        :end (datetime) The end of the window.
+
+        Return a copy of the checkpoint.
+        """
+        with self._lock:
+            checkpoint = self._checkpoints.get(key)
+            if checkpoint is None:
+                checkpoint = self._checkpoints[key] = {'report': report_name,
+                                                       'end': end,
+                                                       'last_row': None}
+                self._save()
+            return dict(checkpoint)
+
+    def commit(self, key: AnyStr, last_row: Tuple[AnyStr, ...]):
+        """
+        Record the last frame of a window committed by the rating-api.
+
+        :key (AnyStr) The key of the window.
+        :last_row (Tuple[AnyStr, ...]) The key of the last committed frame.
+        """
+        with self._lock:
+            self._checkpoints[key]['last_row'] = tuple(last_row)
+            self._save()
+
+    def finish(self, key: AnyStr):
+        """
+        Forget the checkpoint of a window entirely sent.
+
+        :key (AnyStr) The key of the window.
+        """
+        with self._lock:
+            if self._checkpoints.pop(key, None) is not None:
+                self._save()
+
+    def discard(self, report_name: AnyStr = None):
+        """
+        Forget the checkpoints of a report, or every checkpoint if no report is given.
+
+        :report_name (AnyStr) The name of the report.
+        """
+        with self._lock:
+            self._checkpoints = {key: checkpoint for key, checkpoint in self._checkpoints.items()
+                                 if report_name is not None and checkpoint['report'] != report_name}
+            self._save()
+
+
+# Windows partially sent to the rating-api, saved to $RATING_CHECKPOINTS_FILE if set
+CHECKPOINTS = CheckpointStore(os.environ.get('RATING_CHECKPOINTS_FILE') or None)
@@ -0,0 +1,202 @@
+from typing import Callable, Dict, Iterable, List
+import bisect
+
+from rating.manager import metrics
+from rating.manager import rules
+from rating.manager import utils
+from rating.manager.cache import TTLCache
+
+# Rating configurations from /ratingrules/list/local, kept for $RATING_CONFIGURATIONS_TTL
+CONFIGURATIONS = TTLCache(ttl=utils.envvar_int('RATING_CONFIGURATIONS_TTL', 300), maxsize=1)
+
+# Validation results by (validator, configuration valid_from), None meaning valid
+VALIDATIONS = {}
+
+
+class ConfigurationTimeline:
+    """
+    Rating configurations sorted by the epoch they are valid from.
+
+    Selecting the configuration active at a given time, or the configurations
+    overlapping a period, is a bisection over the integer epochs.
+    """
+
+    def __init__(self, configurations: Iterable[Dict] = ()):
+        """
+        Build the timeline.
+
+        :configurations (Iterable[Dict]) The configurations, as returned by the rating-api.
+        """
+        self._starts = []
+        self._configurations = []
+        self.update(configurations)
+
+    def __len__(self) -> int:
+        """Return the number of configurations in the timeline."""
+        return len(self._starts)
+
+    def add(self, configuration: Dict):
+        """
+        Insert a configuration, replacing the one valid from the same epoch.
+
+        :configuration (Dict) The configuration, as returned by the rating-api.
+        """
+        start = int(configuration['valid_from'])
+        index = bisect.bisect_left(self._starts, start)
+        if index < len(self._starts) and self._starts[index] == start:
+            self._configurations[index] = configuration
+        else:
+            self._starts.insert(index, start)
+            self._configurations.insert(index, configuration)
+
+    def discard(self, start: int):
+        """
+        Remove the configuration valid from the given epoch, if any.
+
+        :start (int) The epoch the configuration is valid from.
+        """
+        index = bisect.bisect_left(self._starts, start)
+        if index < len(self._starts) and self._starts[index] == start:
+            del self._starts[index]
+            del self._configurations[index]
+
+    def update(self, configurations: Iterable[Dict]):
+        """
+        Synchronize the timeline with a new list of configurations.
+
+        Only the configurations that were added, removed or changed are touched.
+
+        :configurations (Iterable[Dict]) The configurations, as returned by the rating-api.
+        """
+        latest = {int(configuration['valid_from']): configuration
+                  for configuration in configurations}
+        for start in [start for start in self._starts if start not in latest]:
+            self.discard(start)
+        for start, configuration in latest.items():
+            index = bisect.bisect_left(self._starts, start)
+            if index == len(self._starts) or self._starts[index] != start or \
+               self._configurations[index] != configuration:
+                self.add(configuration)
+
+    def active(self, timestamp: int) -> Dict or None:
+        """
+        Get the configuration active at a given time.
+
+        Before the first configuration, the first one is used.
+
+        :timestamp (int) The epoch to look for.
+
+        Return the configuration, or None if the timeline is empty.
+        """
+        if not self._starts:
+            return None
+        index = bisect.bisect_right(self._starts, timestamp) - 1
+        return self._configurations[max(index, 0)]
+
+    def overlapping(self, begin: int, end: int) -> List[Dict]:
+        """
+        Get the configurations active during a period, in chronological order.
+
+        :begin (int) The epoch the period starts at.
+        :end (int) The epoch the period ends at.
+
+        Return a list of configurations.
+        """
+        if not self._starts:
+            return []
+        low = max(bisect.bisect_right(self._starts, begin) - 1, 0)
+        high = bisect.bisect_left(self._starts, end)
+        return self._configurations[low:max(high, low + 1)]
+
+
+# Configurations of CONFIGURATIONS, updated each time they are retrieved
+TIMELINE = ConfigurationTimeline()
+
+
+def invalidate(start: int = None):
+    """
+    Forget the cached configurations, after a change of the RatingRules.
+
+    :start (int) The epoch a deleted configuration was valid from, if any.
+    """
+    CONFIGURATIONS.invalidate()
+    VALIDATIONS.clear()
+    if start is not None:
+        TIMELINE.discard(start)
+
+
+async def retrieve_configurations() -> List[Dict]:
+    """
+    Get the rating configurations, from the cache or from the rating-api.
+
+    Return the list of configurations.
+    """
+    configurations = CONFIGURATIONS.get('local')
+    if configurations is None:
+        configurations = await utils.get_from_rating_api_async(endpoint='/ratingrules/list/local')
+        VALIDATIONS.clear()
+        if configurations:
+            CONFIGURATIONS.set('local', configurations)
+        TIMELINE.update(configurations or [])
+    return configurations
+
+
+async def retrieve_timeline() -> ConfigurationTimeline:
+    """
+    Get the timeline of the rating configurations, retrieving them if needed.
+
+    Return the timeline.
+    """
+    await retrieve_configurations()
+    return TIMELINE
+
+
+def memoized_validation(validator: Callable, configuration: Dict, config: Dict):
+    """
+    Validate part of a configuration once per configuration version.
+
+    :validator (Callable) The validation function to apply.
+    :configuration (Dict) The configuration the part belongs to.
+    :config (Dict) The part of the configuration to validate.
+
+    Return the validated part of the configuration.
+    """
+    key = (validator.__name__, configuration['valid_from'])
+    if key in VALIDATIONS:
+        error = VALIDATIONS[key]
+        if error is not None:
+            raise error
+        return config
+    try:
+        validator(config)
+    except utils.ConfigurationExceptionError as exc:
+        VALIDATIONS[key] = exc
+        raise
+    VALIDATIONS[key] = None
+    return config
+
+
+def ensure_metrics_config(configuration: Dict) -> Dict:
+    """
+    Validate the metrics of a configuration, once per configuration version.
+
+    :configuration (Dict) The configuration, as returned by the rating-api.
+
+    Return the metrics configuration.
+    """
+    return memoized_validation(metrics.ensure_metrics_config,
+                               configuration,
+                               configuration['metrics']['metrics'])
+
+
+def ensure_rules_config(configuration: Dict) -> List[Dict]:
+    """
+    Validate the rules of a configuration, once per configuration version.
+
+    :configuration (Dict) The configuration, as returned by the rating-api.
+
+    Return the rules configuration.
+    """
+    return memoized_validation(rules.ensure_rules_config,
+                               configuration,
+                               configuration['rules']['rules'])
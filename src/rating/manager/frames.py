@@ -0,0 +1,337 @@
+from array import array
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, AnyStr, Dict, Iterable, List, Sequence, Tuple
+import math
+
+# Columns of the metering tables which are never labels
+EXCLUDED_COLUMNS = frozenset(('period_start', 'period_end', 'pod', 'namespace', 'node'))
+
+# Fields of the rated frames sent to the rating-api, in the order of the tuples
+RATED_COLUMNS = ('frame_begin', 'frame_end', 'namespace', 'node', 'metric',
+                 'pod', 'quantity', 'rating', 'labels')
+
+# Fields of the rated frames ordering them, by index in the tuples
+ORDER_FIELDS = (0, 1, 2, 3, 5, 8, 6)
+
+
+def row_key(rated_frame: Sequence) -> Tuple[AnyStr, ...]:
+    """
+    Get the key ordering the rated frames of a window, the same in every process.
+
+    Frames are ordered by period, namespace, node, pod, labelSet and quantity.
+
+    :rated_frame (Sequence) A rated frame, as a tuple.
+
+    Return the key, as a tuple of strings.
+    """
+    return tuple('' if rated_frame[index] is None else str(rated_frame[index])
+                 for index in ORDER_FIELDS)
+
+
+class Dictionary:
+    """Dictionary encoding of repeated values, as integer codes."""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        """Create an empty dictionary."""
+        self.values = []
+        self.codes = {}
+
+    def __len__(self) -> int:
+        """Return the number of distinct values."""
+        return len(self.values)
+
+    def encode(self, value: Any) -> int:
+        """
+        Get the code of a value, adding it to the dictionary if needed.
+
+        :value (Any) A hashable value.
+
+        Return the code of the value.
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class LabelProjection:
+    """
+    Projection of frames onto the labels columns of a table.
+
+    The labels columns are resolved once per table schema, so that projecting
+    a frame does not compare every key of the frame with the excluded columns.
+    """
+
+    __slots__ = ('names', 'keys', '_getter')
+
+    def __init__(self, columns: Iterable[AnyStr], column: AnyStr):
+        """
+        Compute the projection of a table.
+
+        :columns (Iterable[AnyStr]) The names of the columns of the table.
+        :column (AnyStr) The name of the column holding the quantities.
+        """
+        excluded = EXCLUDED_COLUMNS | {column}
+        self.names = tuple(name for name in columns if name not in excluded)
+        self.keys = frozenset(self.names)
+        if len(self.names) > 1:
+            self._getter = itemgetter(*self.names)
+        elif self.names:
+            getter = itemgetter(self.names[0])
+            self._getter = lambda frame: (getter(frame),)
+        else:
+            self._getter = lambda frame: ()
+
+    def values(self, frame: Dict) -> Tuple:
+        """
+        Get the labels values of a frame, in the order of the labels names.
+
+        :frame (Dict) The frame, as returned by the rating-api.
+
+        Return a tuple of values, None for missing labels.
+        """
+        try:
+            return self._getter(frame)
+        except KeyError:
+            return tuple(frame.get(name) for name in self.names)
+
+    def extract(self, frame: Dict) -> Dict:
+        """
+        Get the labels of a frame.
+
+        :frame (Dict) The frame, as returned by the rating-api.
+
+        Return a dictionary holding the labels present in the frame.
+        """
+        keys = self.keys
+        return {key: value for key, value in frame.items() if key in keys}
+
+
+@lru_cache(maxsize=128)
+def label_projection(columns: Tuple[AnyStr, ...], column: AnyStr) -> LabelProjection:
+    """
+    Get the projection of a table schema, computed once per schema.
+
+    :columns (Tuple[AnyStr, ...]) The names of the columns of the table.
+    :column (AnyStr) The name of the column holding the quantities.
+
+    Return the projection.
+    """
+    return LabelProjection(columns, column)
+
+
+class FrameBatch:
+    """
+    Frames of a time window, stored by column.
+
+    Quantities are kept in a float array, every other column is dictionary
+    encoded: rows hold integer codes, and each distinct string is stored once.
+    Labels are encoded as a whole, each distinct combination of label values
+    being interned once, so that work on labels can be done per combination.
+    """
+
+    columns = ('period_start', 'period_end', 'namespace', 'node', 'pod')
+
+    def __init__(self, column: AnyStr, labels_name: List[AnyStr]):
+        """
+        Create an empty batch.
+
+        :column (AnyStr) The name of the column holding the quantities.
+        :labels_name (List[AnyStr]) The names of the labels columns.
+        """
+        self.column = column
+        self.projection = label_projection(tuple(labels_name), column)
+        self.labels_name = list(self.projection.names)
+        self.dictionaries = {name: Dictionary() for name in self.columns}
+        self.codes = {name: array('i') for name in self.columns}
+        self.labelsets = Dictionary()
+        self.labelset_codes = array('i')
+        self.quantities = array('d')
+
+    @classmethod
+    def from_frames(cls,
+                    frames: Iterable[Dict],
+                    column: AnyStr,
+                    labels_name: List[AnyStr]) -> 'FrameBatch':
+        """
+        Build a batch from frames, as returned by the rating-api.
+
+        :frames (Iterable[Dict]) The frames to store.
+        :column (AnyStr) The name of the column holding the quantities.
+        :labels_name (List[AnyStr]) The names of the labels columns.
+
+        Return the batch.
+        """
+        batch = cls(column, labels_name)
+        for frame in frames:
+            batch.append(frame)
+        return batch
+
+    def __len__(self) -> int:
+        """Return the number of frames in the batch."""
+        return len(self.quantities)
+
+    def append(self, frame: Dict):
+        """
+        Add a frame to the batch.
+
+        :frame (Dict) The frame, as returned by the rating-api.
+        """
+        self.quantities.append(float(frame[self.column]))
+        for name in self.columns:
+            self.codes[name].append(self.dictionaries[name].encode(frame[name]))
+        self.labelset_codes.append(self.labelsets.encode(self.projection.values(frame)))
+
+    def merge(self, other: 'FrameBatch'):
+        """
+        Add the frames of another batch of the same table, after the frames of this one.
+
+        :other (FrameBatch) The batch to add.
+        """
+        self.quantities.extend(other.quantities)
+        for name in self.columns:
+            encode = self.dictionaries[name].encode
+            table = [encode(value) for value in other.dictionaries[name].values]
+            self.codes[name].extend(map(table.__getitem__, other.codes[name]))
+        table = [self.labelsets.encode(values) for values in other.labelsets.values]
+        self.labelset_codes.extend(map(table.__getitem__, other.labelset_codes))
+
+    def values(self, name: AnyStr) -> List:
+        """
+        Decode a column of the batch.
+
+        :name (AnyStr) The name of the column.
+
+        Return the list of values of the column.
+        """
+        values = self.dictionaries[name].values
+        return [values[code] for code in self.codes[name]]
+
+    def labels(self, index: int) -> Dict:
+        """
+        Get the labels of a frame.
+
+        :index (int) The index of the frame in the batch.
+
+        Return a dictionary holding the labels key:value.
+        """
+        return dict(zip(self.labels_name,
+                        self.labelsets.values[self.labelset_codes[index]]))
+
+
+class RatedFrames:
+    """
+    Rated frames of a batch, stored by column.
+
+    Slicing returns the rated frames as tuples, in the format expected by
+    the /rated/frames/add endpoint of the rating-api, in the order of the
+    batch, or by row_key once sorted.
+    """
+
+    def __init__(self, batch: FrameBatch, metric: AnyStr):
+        """
+        Create an empty rating of a batch.
+
+        :batch (FrameBatch) The rated batch.
+        :metric (AnyStr) The name of the rated metric.
+        """
+        self.batch = batch
+        self.metric = metric
+        self.quantities = array('d')
+        self.ratings = array('d')
+        self.labelsets = Dictionary()
+        self.labels = array('i')
+        self.order = None
+
+    def __len__(self) -> int:
+        """Return the number of rated frames."""
+        return len(self.quantities)
+
+    def sort(self):
+        """Order the rated frames by row_key, once every frame of the batch is rated."""
+        self.order = None
+        keys = []
+        # Decode the frames a slice at a time, keeping only their keys
+        for row in range(0, len(self), 4096):
+            keys.extend(row_key(frame) for frame in self[row:row + 4096])
+        self.order = array('i', sorted(range(len(keys)), key=keys.__getitem__))
+
+    def append(self, quantity: float, rating: float or None, labelset: AnyStr):
+        """
+        Add the rating of the next frame of the batch.
+
+        :quantity (float) The converted quantity.
+        :rating (float) The rating, or None.
+        :labelset (AnyStr) The matched labelSet, serialized.
+        """
+        self.quantities.append(quantity)
+        self.ratings.append(math.nan if rating is None else rating)
+        self.labels.append(self.labelsets.encode(labelset))
+
+    def extend(self, quantities: Iterable[float], ratings: Iterable, labels: Iterable[int]):
+        """
+        Add the ratings of the next frames of the batch.
+
+        :quantities (Iterable[float]) The converted quantities.
+        :ratings (Iterable) The ratings, or None.
+        :labels (Iterable[int]) The codes of the matched labelSets, in labelsets.
+        """
+        self.quantities.extend(quantities)
+        self.ratings.extend(math.nan if rating is None else rating for rating in ratings)
+        self.labels.extend(labels)
+
+    def __getitem__(self, index: slice) -> List[Tuple]:
+        """
+        Get rated frames as tuples.
+
+        :index (slice) The slice of frames to get.
+
+        Return a list of tuples.
+        """
+        rows = range(len(self))[index]
+        if self.order is not None:
+            rows = [self.order[row] for row in rows]
+        decoded = {name: self.batch.dictionaries[name].values for name in self.batch.columns}
+        codes = self.batch.codes
+        rated = []
+        for row in rows:
+            rating = self.ratings[row]
+            rated.append((
+                decoded['period_start'][codes['period_start'][row]],   # frame_begin
+                decoded['period_end'][codes['period_end'][row]],       # frame_end
+                decoded['namespace'][codes['namespace'][row]],         # namespace
+                decoded['node'][codes['node'][row]],                   # node
+                self.metric,                                           # metric
+                decoded['pod'][codes['pod'][row]],                     # pod
+                self.quantities[row],                                  # quantity
+                None if math.isnan(rating) else rating,                # rating
+                self.labelsets.values[self.labels[row]]
+            ))
+        return rated
+
+
+def encode_columns(rated_frames: Sequence[Tuple]) -> Dict:
+    """
+    Encode rated frames by column, for the columnar uploads format.
+
+    Strings are stored once in a table shared by every column, and the
+    string columns hold their index in that table.
+
+    :rated_frames (Sequence[Tuple]) The rated frames, as tuples.
+
+    Return a dictionary holding the format, the strings table and the columns.
+    """
+    strings = Dictionary()
+    values = list(zip(*rated_frames)) or [()] * len(RATED_COLUMNS)
+    columns = {}
+    for name, column in zip(RATED_COLUMNS, values):
+        if name in ('quantity', 'rating'):
+            columns[name] = list(column)
+            continue
+        table = {value: strings.encode(value) for value in dict.fromkeys(column)}
+        columns[name] = list(map(table.__getitem__, column))
+    return {'format': 'columnar', 'strings': strings.values, 'columns': columns}
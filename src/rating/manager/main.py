@@ -1,4 +1,6 @@
-from typing import Dict
+from typing import Dict, List
+import asyncio
+import functools
 import kopf
 from kubernetes import client, config
 from base64 import b64decode
@@ -6,9 +8,13 @@ import os
 from kubernetes.client.rest import ApiException
 
 from rating.manager import utils
+from rating.manager import workers
 from rating.manager import rating_rules
 from rating.manager import rating_instances
 
+# Whether the rating-api provides the bulk /namespaces/tenants endpoint
+BULK_TENANTS = True
+
 
 def register_admin_key(api: client.CoreV1Api):
     """
@@ -29,21 +35,23 @@ def register_admin_key(api: client.CoreV1Api):
 
 @kopf.on.create('', 'v1', 'namespaces')
 @kopf.on.update('', 'v1', 'namespaces')
-def callback_namespace_tenant(body: Dict, **kwargs: Dict):
+async def callback_namespace_tenant(body: Dict, **kwargs: Dict):
     """
     Update a namespace after a create or update event.
 
     :body (Dict) A dictionary representing the kubernetes object affected by the event.
     :kwargs (Dict) A dictionary containing optional parameters (for compatibility).
     """
-    update_namespace_tenant(body['metadata'])
+    await update_namespace_tenant(body['metadata'])
 
 
-def update_namespace_tenant(metadata: Dict):
+def namespace_tenants(metadata: Dict) -> List[Dict]:
     """
-    Update the tenant of a namespace through the rating-api.
+    Get the (namespace, tenant) pairs to register for a namespace.
 
     :metadata (Dict) A dictionary containing the metadata values of the object.
+
+    Return a list of payloads for the /namespaces/tenant endpoint.
     """
     tenant = None
     tenants = []
@@ -60,33 +68,99 @@ def update_namespace_tenant(metadata: Dict):
     else:
         tenants = ['']
 
-    for tenant in tenants:
-        payload = {
-            'tenant_id': tenant or 'default',
-            'namespace': metadata['name']
-        }
-        utils.post_for_rating_api(endpoint='/namespaces/tenant', payload=payload)
+    return [{
+        'tenant_id': tenant or 'default',
+        'namespace': metadata['name']
+    } for tenant in tenants]
+
+
+async def update_namespace_tenant(metadata: Dict):
+    """
+    Update the tenant of a namespace through the rating-api.
+
+    :metadata (Dict) A dictionary containing the metadata values of the object.
+    """
+    await asyncio.gather(*(
+        utils.post_for_rating_api_async(endpoint='/namespaces/tenant', payload=payload)
+        for payload in namespace_tenants(metadata)
+    ))
+
+
+async def register_namespaces_tenants(pairs: List[Dict]):
+    """
+    Register (namespace, tenant) pairs in batches of $RATING_NAMESPACES_BATCH_SIZE.
+
+    Batches are sent to the bulk /namespaces/tenants endpoint. If the rating-api
+    does not provide it, pairs are sent one by one to /namespaces/tenant.
+
+    :pairs (List[Dict]) A list of payloads for the /namespaces/tenant endpoint.
+    """
+    global BULK_TENANTS
+    batch_size = max(utils.envvar_int('RATING_NAMESPACES_BATCH_SIZE', 500), 1)
+    for index in range(0, len(pairs), batch_size):
+        batch = pairs[index:index + batch_size]
+        if BULK_TENANTS:
+            try:
+                await utils.post_for_rating_api_async(endpoint='/namespaces/tenants',
+                                                      payload={'namespaces': batch})
+                continue
+            except utils.ApiExceptionError:
+                BULK_TENANTS = False
+        await asyncio.gather(*(
+            utils.post_for_rating_api_async(endpoint='/namespaces/tenant', payload=payload)
+            for payload in batch
+        ))
+
+
+def namespace_metadata(namespace_obj: client.V1Namespace) -> Dict:
+    """
+    Extract the metadata fields used for the tenants registration.
+
+    :namespace_obj (V1Namespace) The namespace, as returned by the api client.
+
+    Return a dictionary holding the name, labels and annotations of the namespace.
+    """
+    metadata = namespace_obj.metadata
+    return {
+        'name': metadata.name,
+        'labels': metadata.labels,
+        'annotations': metadata.annotations
+    }
 
 
-def scan_cluster_namespaces(api: client.CoreV1Api):
+async def scan_cluster_namespaces(api: client.CoreV1Api):
     """
     Scan the namespaces in the cluster and attribute them tenant_id.
 
     If no annotation or label named 'tenant' exist, tenant will be default.
+    Namespaces are listed by pages of $RATING_NAMESPACES_PAGE_SIZE, and each page
+    is registered while the next one is listed.
 
     :api (client.CoreV1Api) The api client to use to execute the request.
     """
-    try:
-        namespace_list = api.list_namespace()
-    except ApiException as exc:
-        raise exc
-    for namespace_obj in namespace_list.items:
-        update_namespace_tenant(
-            namespace_obj.to_dict()['metadata']
-        )
+    loop = asyncio.get_running_loop()
+    page_size = max(utils.envvar_int('RATING_NAMESPACES_PAGE_SIZE', 500), 1)
+    token = None
+    registration = None
+    while True:
+        try:
+            namespace_list = await loop.run_in_executor(None, functools.partial(
+                api.list_namespace, limit=page_size, _continue=token))
+        except ApiException as exc:
+            raise exc
+        pairs = []
+        for namespace_obj in namespace_list.items:
+            pairs.extend(namespace_tenants(namespace_metadata(namespace_obj)))
+        if registration:
+            await registration
+        registration = asyncio.ensure_future(register_namespaces_tenants(pairs))
+        token = namespace_list.metadata._continue
+        if not token:
+            break
+    await registration
 
 @kopf.on.startup()
-def callback_startup(**kwargs: Dict):
+async def callback_startup(**kwargs: Dict):
     """
     Execute the startup routine, registering administrator key and namespaces tenants.
 
@@ -97,11 +171,22 @@ def callback_startup(**kwargs: Dict):
         from rating.manager import reports
     config.load_incluster_config()
     api = client.CoreV1Api()
-    register_admin_key(api)
+    await asyncio.get_running_loop().run_in_executor(None, register_admin_key, api)
     kwargs['logger'].info('Registered admin token.')
-    scan_cluster_namespaces(api)
+    await scan_cluster_namespaces(api)
     kwargs['logger'].info('Registered active namespaces.')
-    update_namespace_tenant({'name': 'unspecified'})
+    await update_namespace_tenant({'name': 'unspecified'})
+
+
+@kopf.on.cleanup()
+async def callback_cleanup(**kwargs: Dict):
+    """
+    Execute the cleanup routine, closing the connections to the rating-api and stopping the rating workers.
+
+    :kwargs (Dict) A dictionary containing optional parameters (for compatibility).
+    """
+    await utils.close_rating_api_session_async()
+    await asyncio.get_running_loop().run_in_executor(None, workers.close_rating_executor)
 
 
 @kopf.on.login()
@@ -0,0 +1,71 @@
+from typing import Iterable, Iterator
+import queue
+import threading
+
+# Marks the end of the items of a stage
+_END = object()
+
+
+def _put(items: queue.Queue, item: object, stop: threading.Event) -> bool:
+    """
+    Put an item in a queue, waiting for room unless the consumer stopped.
+
+    :items (Queue) The queue of the stage.
+    :item (object) The item to put.
+    :stop (Event) The event set once the consumer stopped.
+
+    Return whether the item was put.
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(iterable: Iterable, depth: int) -> Iterator:
+    """
+    Iterate over iterable in a background thread, as a stage of a pipeline.
+
+    The thread runs ahead of the consumer by at most depth items, and waits
+    for the consumer to catch up. Exceptions raised by the iterable are raised
+    to the consumer, and the iterable is closed when the consumer stops early.
+
+    :iterable (Iterable) The items of the stage.
+    :depth (int) The number of items the stage can run ahead of its consumer.
+
+    Return an iterator over the items, in order.
+    """
+    items = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def produce():
+        iterator = iter(iterable)
+        outcome = (_END, None)
+        try:
+            for item in iterator:
+                if not _put(items, (item, None), stop):
+                    return
+        except BaseException as exc:
+            outcome = (_END, exc)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+        _put(items, outcome, stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -1,10 +1,55 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
 from logging import Logger
-from typing import AnyStr, Dict, List, Tuple
-from datetime import datetime as dt
+from typing import AnyStr, Dict, Iterator, List, Sequence, Tuple
+from datetime import datetime as dt, timedelta
+import logging
+import os
+import time
 
+import kopf
+import requests
+
+from rating.manager import checkpoints
+from rating.manager import pipeline
 from rating.manager import utils
-from rating.manager import rates
-from rating.manager import rules as rs
+from rating.manager import watermarks
+from rating.manager import workers
+from rating.manager.cache import TTLCache
+from rating.manager.frames import FrameBatch, LabelProjection, RatedFrames, encode_columns, label_projection, row_key
+
+# Encodings of the uploads, from the most compact one
+UPLOAD_ENCODINGS = ('columnar', 'gzip', 'json')
+
+# Encoding of the uploads negotiated with the rating-api, kept for an hour
+ENCODINGS = TTLCache(ttl=3600, maxsize=1)
+
+# Encodings the rating-api answered 415 Unsupported Media Type to
+REFUSED_ENCODINGS = set()
+
+# Columns of the presto tables, by table name, kept for $RATING_SCHEMAS_TTL
+SCHEMAS = TTLCache(ttl=utils.envvar_int('RATING_SCHEMAS_TTL', 3600),
+                   maxsize=utils.envvar_int('RATING_SCHEMAS_CACHE_SIZE', 64))
+
+
+def get_table_columns(table: AnyStr) -> Tuple[AnyStr, ...]:
+    """
+    Get the columns of a presto table, from the cache or the rating-api.
+
+    Empty schemas are not cached, the table may not be created yet.
+
+    :table (AnyStr) A string representing the table.
+
+    Return a tuple of columns names.
+    """
+    columns = SCHEMAS.get(table)
+    if columns is None:
+        columns = tuple(col['column_name'] for col in
+                        utils.get_from_rating_api(endpoint=f'/presto/{table}/columns'))
+        if columns:
+            SCHEMAS.set(table, columns)
+    return columns
 
 
 def get_labels_from_table(table: AnyStr, column_name: AnyStr) -> List[AnyStr]:
@@ -16,49 +61,34 @@ def get_labels_from_table(table: AnyStr, column_name: AnyStr) -> List[AnyStr]:
 
     Return a list of labels.
     """
-    columns = utils.get_from_rating_api(endpoint=f'/presto/{table}/columns')
-    return [col['column_name'] for col in columns if col['column_name'] not in [
-        'period_start',
-        'period_end',
-        'pod',
-        'namespace',
-        'node',
-        column_name]
-    ]
+    return list(label_projection(get_table_columns(table), column_name).names)
 
 
 def extract_frames_labels(frame: Dict,
                           column_name: AnyStr,
-                          labels: List) -> Dict:
+                          labels: List or LabelProjection) -> Dict:
     """
     Extract the labels from a frame.
 
     :frame (Dict) A dictionary containing the frame.
     :column_Name (AnyStr) A string representing the name of the column.
-    :labels (List) A list containing the labels names.
+    :labels (List) A list containing the labels names, or their projection.
 
     Return a dictionary containing the frame labels.
     """
-    frame_labels = {}
-    for key, value in frame.items():
-        if key not in ['period_start',
-                       'period_end',
-                       'pod',
-                       'namespace',
-                       'node',
-                       column_name] and key in labels:
-            frame_labels[key] = value
-    return frame_labels
+    if not isinstance(labels, LabelProjection):
+        labels = label_projection(tuple(labels), column_name)
+    return labels.extract(frame)
 
 
-def get_frames(metric_config: Dict, labels: Dict) -> Dict:
+def get_frames(metric_config: Dict, labels: Dict) -> Iterator[Dict]:
     """
-    Get frames from the rating-api.
+    Get frames from the rating-api, decoded as they are received.
 
     :metric_config (Dict) A dictionary containing the metric configuration.
     :labels (Dict) A dictionary holding the labels key:value
 
-    Return the response of the rating-api, as a dictionary.
+    Return an iterator over the frames.
     """
     payload = {
         'labels': labels,
@@ -66,22 +96,61 @@ def get_frames(metric_config: Dict, labels: Dict) -> Dict:
         'start': metric_config['begin'].isoformat(sep=' ', timespec='milliseconds'),
         'end': metric_config['end'].isoformat(sep=' ', timespec='milliseconds')
     }
-    return utils.get_from_rating_api(
+    return utils.iter_from_rating_api(
         endpoint=f'/presto/{metric_config["presto_table"]}/frames',
         payload=payload)
 
 
+def upload_encoding(logger: Logger) -> AnyStr:
+    """
+    Get the encoding of the rated frames uploads.
+
+    The encoding is read from $RATING_UPLOAD_ENCODING: json, gzip (compressed
+    json) or columnar (compressed columns with a strings table). With auto,
+    the best encoding listed by /rated/frames/encodings is used, json if the
+    rating-api does not list any or has no such endpoint. If the encodings
+    cannot be retrieved, json is used and they are asked again for the next
+    upload. Encodings refused by the rating-api are replaced by the next one.
+
+    :logger (Logger) A Logger object to log informations.
+
+    Return the name of the encoding.
+    """
+    wanted = os.environ.get('RATING_UPLOAD_ENCODING', 'json')
+    if wanted == 'auto':
+        wanted = ENCODINGS.get('upload')
+        if wanted is None:
+            try:
+                supported = utils.get_from_rating_api(endpoint='/rated/frames/encodings')
+            except utils.NotFoundError:
+                supported = []
+            except (kopf.TemporaryError, requests.exceptions.RequestException) as exc:
+                logger.warning(f'upload encodings could not be retrieved, using json: {exc}')
+                return 'json'
+            wanted = next((name for name in UPLOAD_ENCODINGS if name in supported), 'json')
+            ENCODINGS.set('upload', wanted)
+    elif wanted not in UPLOAD_ENCODINGS:
+        wanted = 'json'
+    return next((name for name in UPLOAD_ENCODINGS[UPLOAD_ENCODINGS.index(wanted):]
+                 if name not in REFUSED_ENCODINGS), 'json')
+
+
 def update_rated_data(rated_frames: List[Tuple],
                       rated_namespaces: List,
                       metric_config: Dict,
-                      timestamp: dt) -> Dict:
+                      timestamp: dt,
+                      logger: Logger) -> Dict:
     """
     Update the rated data with new frames.
 
+    The frames are encoded as negotiated with the rating-api, falling back
+    to the next encoding if the rating-api refuses one.
+
     :rated_frames (List[Tuple]) A list of tuple containing the frames to insert.
     :rated_namespaces (List) A list containing the namespaces concerned by the rating.
     :metric_config (Dict) A dictionary holding the configuration for the current metric.
-    :timestamp (datetime) A timestamp representing the time of rating.
+    :timestamp (datetime) A timestamp representing the time up to which the metric is rated.
+    :logger (Logger) A Logger object to log informations.
 
     Return the response of the rating-api, as a dictionary.
     """
@@ -92,74 +161,347 @@ def update_rated_data(rated_frames: List[Tuple],
         'metric': metric_config['metric'],
         'last_insert': timestamp
     }
-    return utils.post_for_rating_api(endpoint='/rated/frames/add',
-                                     payload=payload)
+    encoding = upload_encoding(logger)
+    if encoding == 'columnar':
+        payload['rated_frames'] = encode_columns(rated_frames)
+    try:
+        return utils.post_for_rating_api(endpoint='/rated/frames/add',
+                                         payload=payload,
+                                         content_encoding=None if encoding == 'json' else 'gzip')
+    except utils.UnsupportedEncodingError:
+        if encoding == 'json':
+            raise
+        REFUSED_ENCODINGS.add(encoding)
+        logger.warning(f'{encoding} uploads refused by the rating-api, using {upload_encoding(logger)}')
+        return update_rated_data(rated_frames, rated_namespaces, metric_config, timestamp, logger)
 
-def retrieve_data(rules: Dict,
-                  metric_config: Dict,
-                  logger: Logger):
+
+def progress_key(metric_config: Dict, begin: dt) -> AnyStr:
+    """Return the key of a window in the checkpoints."""
+    return checkpoints.CHECKPOINTS.key(metric_config['report_name'], metric_config['metric'], begin)
+
+
+def update_rated_batch(rated_frames: List[Tuple],
+                       metric_config: Dict,
+                       timestamp: dt,
+                       logger: Logger) -> Dict:
     """
-    Retrieve and rate data according to rules and metrics configuration.
+    Send a batch of rated frames, retrying it on its own on failure.
+
+    The number of retries is read from $RATING_UPLOAD_RETRIES.
+
+    :rated_frames (List[Tuple]) A list of tuple containing the frames to insert.
+    :metric_config (Dict) A dictionary holding the configuration for the current metric.
+    :timestamp (datetime) The time up to which the metric is rated once the batch is sent.
+    :logger (Logger) A Logger object to log informations.
+
+    Return the response of the rating-api, as a dictionary.
+    """
+    rated_namespaces = list(dict.fromkeys(frame[2] for frame in rated_frames))
+    retries = utils.envvar_int('RATING_UPLOAD_RETRIES', 3)
+    for attempt in range(retries + 1):
+        try:
+            return update_rated_data(rated_frames,
+                                     rated_namespaces,
+                                     metric_config,
+                                     timestamp.isoformat(sep=' ', timespec='milliseconds'),
+                                     logger)
+        except (kopf.TemporaryError, requests.exceptions.RequestException):
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def first_unsent_row(rated_frames: Sequence[Tuple], last_row: Tuple[AnyStr, ...] or None) -> int:
+    """
+    Find the first rated frame after the last committed one, in frames sorted by row_key.
+
+    :rated_frames (Sequence[Tuple]) The sorted rated frames, as tuples or RatedFrames.
+    :last_row (Tuple[AnyStr, ...]) The key of the last committed frame, or None.
+
+    Return the index of the frame.
+    """
+    if last_row is None:
+        return 0
+    low, high = 0, len(rated_frames)
+    while low < high:
+        middle = (low + high) // 2
+        if row_key(rated_frames[middle:middle + 1][0]) <= last_row:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def send_rated_frames(rated_frames: Sequence[Tuple],
+                      window_config: Dict,
+                      logger: Logger):
+    """
+    Send the rated frames of a window in batches of $RATING_UPLOAD_BATCH_SIZE rows.
+
+    Frames are sent in the order of their row_key. The rated period only moves
+    to the end of the window with its last batch. The key of the last frame
+    of each committed batch is checkpointed, so that a retry of the rating,
+    even after a restart, skips the frames up to that key whatever order the
+    rating-api returns them in, and moves the watermark of the report.
+
+    :rated_frames (Sequence[Tuple]) The rated frames, as tuples or RatedFrames.
+    :window_config (Dict) A dictionary holding the configuration for the window.
+    :logger (Logger) A Logger object to log informations.
+    """
+    if isinstance(rated_frames, RatedFrames):
+        rated_frames.sort()
+    else:
+        rated_frames = sorted(rated_frames, key=row_key)
+    batch_size = max(utils.envvar_int('RATING_UPLOAD_BATCH_SIZE', 5000), 1)
+    key = progress_key(window_config, window_config['begin'])
+    progress = checkpoints.CHECKPOINTS.start(key, window_config['report_name'], window_config['end'])
+    first = first_unsent_row(rated_frames, progress['last_row'])
+    if first:
+        logger.info(f'resuming upload after {first} committed frames')
+    batches = range(first, len(rated_frames), batch_size)
+    for index, row in enumerate(batches):
+        last = index == len(batches) - 1
+        batch = rated_frames[row:row + batch_size]
+        watermark = window_config['end' if last else 'begin']
+        try:
+            result = update_rated_batch(batch, window_config, watermark, logger)
+        except (kopf.TemporaryError, requests.exceptions.RequestException):
+            watermarks.WATERMARKS.invalidate(window_config['report_name'])
+            raise kopf.TemporaryError(
+                f'rated data failed to be transmitted after {row}/{len(rated_frames)} frames, '
+                'retrying in 5s..', delay=5)
+        checkpoints.CHECKPOINTS.commit(key, row_key(batch[-1]))
+        watermarks.WATERMARKS.set(window_config['report_name'], watermark)
+        if result and last:
+            logger.info(f'updated rated-{window_config["metric"].replace("_", "-")} object')
+    checkpoints.CHECKPOINTS.finish(key)
+
+
+def labels_query(labels_name: List[AnyStr]) -> AnyStr:
+    """
+    Get the labels columns to query, from their names.
+
+    :labels_name (List[AnyStr]) A list containing the labels names.
+
+    Return the labels columns, as expected by the frames endpoint.
+    """
+    if not labels_name:
+        return ''
+    return ', ' + ', '.join(labels_name)
+
+
+def split_window(begin: dt, end: dt) -> List[Tuple[dt, dt]]:
+    """
+    Split a window in slices fetched at once.
+
+    The window is split in up to $RATING_FETCH_CONCURRENCY slices of the same
+    length, each at least $RATING_FETCH_SLICE_MIN seconds long.
+    Consecutive slices share their bounds, like consecutive windows do.
+
+    :begin (datetime) The begin of the window.
+    :end (datetime) The end of the window.
+
+    Return the begin and end of each slice, in chronological order.
+    """
+    concurrency = max(utils.envvar_int('RATING_FETCH_CONCURRENCY', 4), 1)
+    minimum = max(utils.envvar_int('RATING_FETCH_SLICE_MIN', 86400), 1)
+    count = int(min(concurrency, max((end - begin).total_seconds() // minimum, 1)))
+    length = (end - begin) / count
+    bounds = [begin + length * index for index in range(count)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def fetch_window(window_config: Dict,
+                 labels: AnyStr,
+                 labels_name: List[AnyStr]) -> FrameBatch:
+    """
+    Get the frames of a whole period rated as a single window, fetching its slices concurrently.
+
+    Each slice is stored in its own batch as it is received, and the batches
+    are merged in chronological order.
+
+    :window_config (Dict) A dictionary holding the configuration for the window.
+    :labels (AnyStr) The labels columns to query.
+    :labels_name (List[AnyStr]) A list containing the labels names.
+
+    Return the frames of the window.
+    """
+    column = window_config['presto_column']
+    slices = split_window(window_config['begin'], window_config['end'])
+    if len(slices) == 1:
+        return FrameBatch.from_frames(get_frames(window_config, labels), column, labels_name)
+
+    def fetch(bounds: Tuple[dt, dt]) -> FrameBatch:
+        slice_config = dict(window_config, begin=bounds[0], end=bounds[1])
+        return FrameBatch.from_frames(get_frames(slice_config, labels), column, labels_name)
+
+    frames = FrameBatch(column, labels_name)
+    with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+        for batch in executor.map(fetch, slices):
+            frames.merge(batch)
+    return frames
+
+
+def iter_frames(metric_config: Dict,
+                labels_name: List[AnyStr]) -> Iterator[Tuple[Dict, FrameBatch]]:
+    """
+    Get frames from the rating-api, one time window at a time, as columnar batches.
+
+    The window length is read from $RATING_FRAMES_WINDOW, in seconds, 0 meaning
+    the whole period at once, fetched as concurrent slices. After an empty
+    window the length doubles, up to $RATING_FRAMES_WINDOW_MAX windows.
+    Consecutive windows share their bounds, like consecutive rating runs do.
+
+    The next $RATING_FETCH_CONCURRENCY windows are fetched at once, and yielded
+    in order. Their lengths are planned from the last window received: if it
+    was empty, the planned windows keep doubling as if they were empty too.
+
+    :metric_config (Dict) A dictionary containing the metric configuration.
+    :labels_name (List[AnyStr]) A list containing the labels names.
+
+    Return an iterator over the configuration of each window and its frames.
+    """
+    labels = labels_query(labels_name)
+    window = utils.envvar_int('RATING_FRAMES_WINDOW', 86400)
+    limit = window * max(utils.envvar_int('RATING_FRAMES_WINDOW_MAX', 32), 1)
+    concurrency = max(utils.envvar_int('RATING_FETCH_CONCURRENCY', 4), 1)
+    column = metric_config['presto_column']
+    begin, end = metric_config['begin'], metric_config['end']
+    step, empty = window, False
+
+    def fetch(window_config: Dict) -> FrameBatch:
+        if window <= 0:
+            return fetch_window(window_config, labels, labels_name)
+        return FrameBatch.from_frames(get_frames(window_config, labels), column, labels_name)
+
+    # Without concurrency, windows are fetched by the calling thread
+    with ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else nullcontext() as executor:
+        while begin < end:
+            planned = []
+            while begin < end and len(planned) < concurrency:
+                pending = checkpoints.CHECKPOINTS.get(progress_key(metric_config, begin))
+                if pending:
+                    window_end = pending['end']
+                elif window <= 0:
+                    window_end = end
+                else:
+                    window_end = min(begin + timedelta(seconds=step), end)
+                planned.append((dict(metric_config, begin=begin, end=window_end), step))
+                begin = window_end
+                if empty:
+                    step = min(step * 2, limit)
+            if executor is not None:
+                futures = deque(executor.submit(fetch, window_config) for window_config, _ in planned)
+            for window_config, length in planned:
+                # Futures are dropped as they are consumed, not to hold their windows
+                frames = fetch(window_config) if executor is None else futures.popleft().result()
+                empty = not frames
+                yield window_config, frames
+                # Drop the window before the next round is fetched
+                del frames
+            step = min(length * 2, limit) if empty else window
+
+
+def load_labels(metric_config: Dict, logger: Logger) -> List[AnyStr]:
+    """
+    Get the labels of the table of a metric.
 
-    :rules (Dict) A dictionary holding the rules to rate the frames.
     :metric_config (Dict) A dictionary holding the metrics configuration.
+    :logger (Logger) A Logger object to log informations.
+
+    Return the labels names.
     """
     logger.info(f'Loading frames from {metric_config["presto_table"]}..')
     logger.info('checking for labels..')
     labels_name = get_labels_from_table(metric_config['presto_table'],
                                         metric_config['presto_column'])
-
-    potential_labels = ', '.join(labels_name)
-    if len(potential_labels) > 0:
-        logger.info(f'found labels: {potential_labels}')
-        potential_labels = f', {potential_labels}'
+    if labels_name:
+        logger.info(f'found labels: {", ".join(labels_name)}')
     else:
         logger.info('no labels found')
+    return labels_name
+
+
+def rate_windows(windows: Iterator[Tuple[Dict, FrameBatch]],
+                 pool: workers.RatingPool,
+                 metric_config: Dict,
+                 logger: Logger) -> Iterator[Tuple[Dict, RatedFrames]]:
+    """
+    Rate the frames of each window, skipping empty windows.
+
+    :windows (Iterator[Tuple[Dict, FrameBatch]]) The configuration of each window and its frames.
+    :pool (RatingPool) The pool to rate the frames with.
+    :metric_config (Dict) A dictionary holding the metrics configuration.
+    :logger (Logger) A Logger object to log informations.
+
+    Return an iterator over the configuration of each window and its rated frames.
+    """
+    for window_config, frames in windows:
+        if not frames:
+            continue
+        logger.info(f'{len(frames)} frames loaded from {window_config["begin"]} to {window_config["end"]}')
+        rated_frames = pool.rate(frames, metric_config)
+        # Release the frames before loading the next window
+        del frames
+        yield window_config, rated_frames
+
+
+def retrieve_periods(periods: List[Tuple[List[Dict], Dict]],
+                     logger: Logger):
+    """
+    Retrieve and rate data over consecutive periods, each with its own configuration.
+
+    Frames are loaded, rated and sent one time window at a time, stored by
+    column, so that memory usage does not depend on the length of the periods.
+    The last insert time sent with each window is the end of that window,
+    which is where the next rating of the report starts from.
 
-    frames = get_frames(metric_config, potential_labels)
-    loaded = len(frames)
+    Loading, rating and sending run as a pipeline, each stage in its own
+    thread and up to $RATING_PIPELINE_DEPTH windows ahead of the next one,
+    0 running them one after the other. Windows are sent in order.
+
+    :periods (List[Tuple[List[Dict], Dict]]) The rules and the metrics configuration of each period.
+    :logger (Logger) A Logger object to log informations.
+    """
+    depth = utils.envvar_int('RATING_PIPELINE_DEPTH', 1)
+    labels = {}
+    loaded = 0
+    for rules, metric_config in periods:
+        columns = (metric_config['presto_table'], metric_config['presto_column'])
+        if columns not in labels:
+            labels[columns] = load_labels(metric_config, logger)
+        labels_name = labels[columns]
+
+        windows = iter_frames(metric_config, labels_name)
+        if depth > 0:
+            windows = pipeline.prefetch(windows, depth)
+        rated = rate_windows(windows, workers.RatingPool(rules), metric_config, logger)
+        if depth > 0:
+            rated = pipeline.prefetch(rated, depth)
+        # Stop both stages if a window fails to be sent
+        with closing(windows), closing(rated):
+            for window_config, rated_frames in rated:
+                loaded += len(rated_frames)
+                logger.info('sending data..')
+                send_rated_frames(rated_frames, window_config, logger)
+                # Release the window before sending the next one
+                del rated_frames
     if loaded == 0:
         logger.info('no frames loaded')
         return
-    logger.info(f'{loaded} frames loaded')
-
-    rated_frames, rated_namespaces = [], []
-    rating_time = dt.utcnow()
-    for frame in frames:
-        # 6 here because every columns after is considered a label
-        frame_labels = extract_frames_labels(frame,
-                                             metric_config['presto_column'],
-                                             labels_name)
-        labels, rule = rs.find_match(metric_config['metric'],
-                                     frame_labels,
-                                     rules)
-        converted = rates.convert_metrics_unit(
-            metric_config['unit'],
-            rule['unit'],
-            frame[metric_config['presto_column']]
-        )
-
-        rated_frames.append((
-            frame['period_start'],                              # frame_begin
-            frame['period_end'],                                # frame_end
-            frame['namespace'],                                 # namespace
-            frame['node'],                                      # node
-            metric_config['metric'],                            # metric
-            frame['pod'],                                       # pod
-            converted,                                          # quantity
-            rates.rate(rule, {'qty': converted}),               # rating
-            f'{labels}'
-        ))
-        rated_namespace = frame['namespace']
-        if rated_namespace not in rated_namespaces:
-            rated_namespaces.append(rated_namespace)
-    logger.info('frame processed')
-
-    logger.info('sending data..')
-    result = update_rated_data(rated_frames,
-                               rated_namespaces,
-                               metric_config,
-                               rating_time.isoformat(sep=' ', timespec='milliseconds'))
-    if result:
-        logger.info(f'updated rated-{metric_config["metric"].replace("_", "-")} object')
+    logger.info(f'{loaded} frames processed')
     logger.info('finished rating instance')
+
+
+def retrieve_data(rules: Dict,
+                  metric_config: Dict,
+                  logger: Logger):
+    """
+    Retrieve and rate data according to rules and metrics configuration.
+
+    :rules (Dict) A dictionary holding the rules to rate the frames.
+    :metric_config (Dict) A dictionary holding the metrics configuration.
+    :logger (Logger) A Logger object to log informations.
+    """
+    retrieve_periods([(rules, metric_config)], logger)
@@ -1,8 +1,8 @@
 from logging import Logger
 from typing import Dict
 
+import aiohttp
 import kopf
-import requests
 
 from datetime import datetime as dt
 
@@ -12,16 +12,16 @@ from rating.manager import utils
 @kopf.on.create('rating.smile.fr', 'v1', 'ratingruleinstances')
 @kopf.on.update('rating.smile.fr', 'v1', 'ratingruleinstances')
 @utils.assert_rating_namespace
-def rating_instances_creation_smile(body: Dict,
-                                    spec: Dict,
-                                    logger: Logger,
-                                    **kwargs: Dict):
-    handle_rating_instances_creation(body, spec, logger, **kwargs)
+async def rating_instances_creation_smile(body: Dict,
+                                          spec: Dict,
+                                          logger: Logger,
+                                          **kwargs: Dict):
+    await handle_rating_instances_creation(body, spec, logger, **kwargs)
 
-def handle_rating_instances_creation(body: Dict,
-                                     spec: Dict,
-                                     logger: Logger,
-                                     **kwargs: Dict):
+async def handle_rating_instances_creation(body: Dict,
+                                           spec: Dict,
+                                           logger: Logger,
+                                           **kwargs: Dict):
     """
     Create values of RatingRuleInstances through rating-api after creation in Kubernetes.
 
@@ -46,27 +46,27 @@ def handle_rating_instances_creation(body: Dict,
             'price': spec.get('price', {})
         }
         try:
-            utils.post_for_rating_api(endpoint='/templates/metric/add', payload=data)
-            utils.post_for_rating_api(endpoint='/templates/instance/add', payload=data)
+            await utils.post_for_rating_api_async(endpoint='/templates/metric/add', payload=data)
+            await utils.post_for_rating_api_async(endpoint='/templates/instance/add', payload=data)
         except utils.ConfigurationExceptionError as exc:
             logger.error(f'RatingRulesInstance {rules_name} is invalid. Reason: {exc}')
-        except requests.exceptions.RequestException:
+        except aiohttp.ClientError:
             logger.error(f'Request for RatingRulesInstance {rules_name} update failed')
         else:
             logger.info(f'RatingRule {rules_name} created/updated.')
 
 @kopf.on.delete('rating.smile.fr', 'v1', 'ratingruleinstances')
 @utils.assert_rating_namespace
-def rating_instances_deletion_smile(body: Dict,
-                                    spec: Dict,
-                                    logger: Logger,
-                                    **kwargs: Dict):
-    handle_rating_instances_deletion(body, spec, logger, **kwargs)
+async def rating_instances_deletion_smile(body: Dict,
+                                          spec: Dict,
+                                          logger: Logger,
+                                          **kwargs: Dict):
+    await handle_rating_instances_deletion(body, spec, logger, **kwargs)
 
-def handle_rating_instances_deletion(body: Dict,
-                                     spec: Dict,
-                                     logger: Logger,
-                                     **kwargs: Dict):
+async def handle_rating_instances_deletion(body: Dict,
+                                           spec: Dict,
+                                           logger: Logger,
+                                           **kwargs: Dict):
     """
     Delete values of RatingRuleInstances through rating-api after deletion in Kubernetes.
 
@@ -86,11 +86,11 @@ def handle_rating_instances_deletion(body: Dict,
             'metric_name': spec.get('name', {}),
         }
         try:
-            utils.post_for_rating_api(endpoint='/templates/metric/delete', payload=data)
-            utils.post_for_rating_api(endpoint='/templates/instance/delete', payload=data)
+            await utils.post_for_rating_api_async(endpoint='/templates/metric/delete', payload=data)
+            await utils.post_for_rating_api_async(endpoint='/templates/instance/delete', payload=data)
         except utils.ConfigurationExceptionError as exc:
             logger.error(f'RatingRulesInstance {rules_name} is invalid. Reason: {exc}')
-        except requests.exceptions.RequestException:
+        except aiohttp.ClientError:
             logger.error(f'Request for RatingRulesInstance {rules_name} delete failed')
         else:
             logger.info(f'RatingRule {rules_name} deleted.')
@@ -1,21 +1,22 @@
 from logging import Logger
 from typing import Dict
 
+import aiohttp
 import kopf
-import requests
 
 from datetime import datetime as dt
 
+from rating.manager import configurations
 from rating.manager import utils
 
 
 
 @kopf.on.create('rating.smile.fr', 'v1', 'ratingrules')
 @utils.assert_rating_namespace
-def rating_rules_creation_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
-    handle_rating_rules_creation(body, spec, logger, **kwargs)
+async def rating_rules_creation_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+    await handle_rating_rules_creation(body, spec, logger, **kwargs)
 
-def handle_rating_rules_creation(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+async def handle_rating_rules_creation(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
     timestamp = body['metadata']['creationTimestamp']
     rules_name = body['metadata']['name']
     data = {
@@ -24,22 +25,23 @@ def handle_rating_rules_creation(body: Dict, spec: Dict, logger: Logger, **kwarg
         'timestamp': timestamp
     }
     try:
-        utils.post_for_rating_api(endpoint='/ratingrules/add', payload=data)
+        await utils.post_for_rating_api_async(endpoint='/ratingrules/add', payload=data)
     except utils.ConfigurationExceptionError as exc:
         logger.error(f'RatingRules {rules_name} is invalid. Reason: {exc}')
-    except requests.exceptions.RequestException:
+    except aiohttp.ClientError:
         raise kopf.TemporaryError(f'Request for RatingRules {rules_name} update failed. retrying in 30s', delay=30)
     else:
+        configurations.invalidate()
         logger.info(f'RatingRule {rules_name} created, valid from {timestamp}.')
 
 
 
 @kopf.on.update('rating.smile.fr', 'v1', 'ratingrules')
 @utils.assert_rating_namespace
-def rating_rules_update_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
-    handle_rating_rules_update(body, spec, logger, **kwargs)
+async def rating_rules_update_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+    await handle_rating_rules_update(body, spec, logger, **kwargs)
 
-def handle_rating_rules_update(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+async def handle_rating_rules_update(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
     timestamp = body['metadata']['creationTimestamp']
     rules_name = body['metadata']['name']
     data = {
@@ -48,49 +50,51 @@ def handle_rating_rules_update(body: Dict, spec: Dict, logger: Logger, **kwargs:
         'timestamp': timestamp
     }
     try:
-        utils.post_for_rating_api(endpoint='/ratingrules/update', payload=data)
+        await utils.post_for_rating_api_async(endpoint='/ratingrules/update', payload=data)
     except utils.ApiExceptionError:
         logger.warning(f'RatingRules {rules_name} does not exist in storage, ignoring.')
     except utils.ConfigurationExceptionError as exc:
         logger.error(f'RatingRules {rules_name} is invalid. Reason: {exc}')
-    except requests.exceptions.RequestException:
+    except aiohttp.ClientError:
         logger.error(f'Request for RatingRules {rules_name} update failed.')
     else:
+        configurations.invalidate()
         logger.info(f'Rating rules {rules_name} was updated.')
 
 
 
 @kopf.on.delete('rating.smile.fr', 'v1', 'ratingrules')
 @utils.assert_rating_namespace
-def rating_rules_deletion_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
-    handle_rating_rules_deletion(body, spec, logger, **kwargs)
+async def rating_rules_deletion_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+    await handle_rating_rules_deletion(body, spec, logger, **kwargs)
 
-def handle_rating_rules_deletion(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+async def handle_rating_rules_deletion(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
     timestamp = body['metadata']['creationTimestamp']
     rules_name = body['metadata']['name']
     data = {
         'timestamp': int(dt.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ').timestamp())
     }
     try:
-        utils.post_for_rating_api(endpoint='/ratingrules/delete', payload=data)
+        await utils.post_for_rating_api_async(endpoint='/ratingrules/delete', payload=data)
     except utils.ApiExceptionError:
         logger.warning(f'RatingRules {rules_name} does not exist in storage, ignoring.')
-    except requests.exceptions.RequestException:
+    except aiohttp.ClientError:
         logger.error(f'Request for RatingRules {rules_name} deletion failed.')
     else:
+        configurations.invalidate(data['timestamp'])
         logger.info(f'RatingRules {rules_name} ({timestamp}) was deleted.')
 
 @kopf.on.delete('rating.smile.fr', 'v1', 'ratedmetrics')
 @utils.assert_rating_namespace
-def delete_rated_metric_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
-    handle_delete_rated_metric(body, spec, logger, **kwargs)
+async def delete_rated_metric_smile(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+    await handle_delete_rated_metric(body, spec, logger, **kwargs)
 
 
 
-def handle_delete_rated_metric(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
+async def handle_delete_rated_metric(body: Dict, spec: Dict, logger: Logger, **kwargs: Dict):
     data = {
         'metric': spec['metric']
     }
-    response = utils.post_for_rating_api(endpoint='/rated/frames/delete', payload=data)
+    response = await utils.post_for_rating_api_async(endpoint='/rated/frames/delete', payload=data)
     if response:
         logger.info(f'deleted {response["results"]} rows associated with {body["metadata"]["name"]}')
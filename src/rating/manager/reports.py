@@ -1,36 +1,53 @@
 from logging import Logger
-from typing import AnyStr, Dict
+from typing import AnyStr, Dict, List, Tuple
+import asyncio
+import calendar
+import functools
 import kopf
 
-from datetime import datetime as dt
+from datetime import datetime as dt, timedelta
 
 from rating.manager import utils
-from rating.manager import metrics
-from rating.manager import rules
+from rating.manager import checkpoints
+from rating.manager import configurations
 from rating.manager import rated_metrics
-from rating.manager.bisect import get_closest_configs_bisect
+from rating.manager import scheduler
+from rating.manager import watermarks
 
+# Presto table of each report, to notice when its tableRef changes
+REPORT_TABLES = {}
 
-def retrieve_configurations_from_API() -> Dict:
-    """Wrap the configuration retrieval from the rating-api."""
-    return utils.get_from_rating_api(endpoint='/ratingrules/list/local')
+# Ratings requested by report events, kept until they are done
+RATINGS = set()
 
+# Longest schedule period of a report, its first period starting at most that long before its creation
+REPORT_PERIOD_MAX = timedelta(days=31)
 
-def retrieve_last_rated_report(report_name: AnyStr) -> AnyStr or None:
+
+async def retrieve_last_rated_report(report_name: AnyStr) -> AnyStr or None:
     """Get the timestamp of the last rating time, for a given report."""
-    results = utils.get_from_rating_api(endpoint=f'/reports/{report_name}/last_rated')
+    results = await utils.get_from_rating_api_async(endpoint=f'/reports/{report_name}/last_rated')
     if results:
         return results[0]['last_insert']
     return None
 
 
-def rated_or_not(report_name: AnyStr) -> dt:
-    """Get a timestamp corresponding to the last rated frame for a report, or 0."""
-    timestamp = retrieve_last_rated_report(report_name)
+async def rated_or_not(report_name: AnyStr) -> dt:
+    """
+    Get a timestamp corresponding to the last rated frame for a report, or 0.
+
+    The local watermark of the report is used once it was checked against the rating-api.
+    """
+    watermark = watermarks.WATERMARKS.get(report_name)
+    if watermark is not None:
+        return watermark
+    timestamp = await retrieve_last_rated_report(report_name)
     if timestamp:
         # [:-4] because of comma and milliseconds
-        return dt.strptime(timestamp[:-4], '%a, %d %b %Y %H:%M:%S')
-    return dt.utcfromtimestamp(0)
+        reference = dt.strptime(timestamp[:-4], '%a, %d %b %Y %H:%M:%S')
+    else:
+        reference = dt.utcfromtimestamp(0)
+    return watermarks.WATERMARKS.verify(report_name, reference)
 
 
 def select_end_period(valid_from: dt,
@@ -63,8 +80,7 @@ def extract_metric_config(source: Dict,
     """
     for key in source.keys():
         if source[key][target] == match:
-            source[key]['metric'] = key
-            return source[key]
+            return dict(source[key], metric=key)
     return None
 
 
@@ -83,7 +99,7 @@ def check_rating_conditions(report_name: AnyStr,
     Return the full configuration to run the rating mechanism.
     """
     metric_config = extract_metric_config(
-        metrics.ensure_metrics_config(configuration['metrics']['metrics']),
+        configurations.ensure_metrics_config(configuration),
         'report_name',
         report_name)
     if not metric_config:
@@ -99,51 +115,209 @@ def check_rating_conditions(report_name: AnyStr,
     return rating_config
 
 
+def split_rating_period(report_name: AnyStr,
+                        table_name: AnyStr,
+                        begin: dt,
+                        timeline: configurations.ConfigurationTimeline) -> List[Tuple[Dict, Dict]]:
+    """
+    Split the period to rate at the boundaries of the configurations.
+
+    The first period starts at begin, each following one when its configuration
+    becomes valid, and each period ends when the next one starts.
+    Configurations that do not rate the report are skipped.
+
+    :report_name (AnyStr) The name of the report to be rated.
+    :table_name (AnyStr) The name of the table to use to get data.
+    :begin (datetime) The timestamp from which to recover the frames from table_name.
+    :timeline (ConfigurationTimeline) The configurations to choose from.
+
+    Return a list of configurations and their full rating configuration, in chronological order.
+    """
+    selected = timeline.overlapping(calendar.timegm(begin.utctimetuple()),
+                                    calendar.timegm(dt.utcnow().utctimetuple()))
+    periods = []
+    for index, configuration in enumerate(selected):
+        period_begin = begin
+        if index > 0:
+            period_begin = dt.utcfromtimestamp(int(configuration['valid_from']))
+        metric_config = check_rating_conditions(report_name,
+                                                table_name,
+                                                period_begin,
+                                                configuration)
+        if not metric_config:
+            continue
+        if index + 1 < len(selected):
+            metric_config['end'] = min(metric_config['end'], dt.utcfromtimestamp(
+                int(selected[index + 1]['valid_from'])))
+        if metric_config['begin'] >= metric_config['end']:
+            continue
+        periods.append((configuration, metric_config))
+    return periods
+
+
+def track_table_ref(report_name: AnyStr, table_name: AnyStr or None):
+    """
+    Record the table of a report, dropping cached schemas when it changes.
+
+    :report_name (AnyStr) The name of the report.
+    :table_name (AnyStr) The name of the table of the report, None if it has none anymore.
+    """
+    presto_table = table_name.replace('-', '_') if table_name else None
+    previous = REPORT_TABLES.get(report_name)
+    if previous == presto_table:
+        return
+    if previous:
+        rated_metrics.SCHEMAS.invalidate(previous)
+        if presto_table:
+            rated_metrics.SCHEMAS.invalidate(presto_table)
+    if presto_table:
+        REPORT_TABLES[report_name] = presto_table
+    else:
+        REPORT_TABLES.pop(report_name, None)
+
+
+def parse_report_time(value: AnyStr or None) -> dt or None:
+    """
+    Parse a time from the status of a report.
+
+    :value (AnyStr) A string holding the time, in RFC 3339 format, or None.
+
+    Return the datetime, or None if it is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return dt.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    except ValueError:
+        return None
+
+
+def reporting_start(body: Dict) -> dt or None:
+    """
+    Get the earliest time the frames of a report can start at.
+
+    It is the reportingStart of the report if set. Otherwise the report starts
+    with the schedule period it was created in, which began at most
+    REPORT_PERIOD_MAX before its creation.
+
+    :body (Dict) A dictionary containing the report object.
+
+    Return the datetime, or None if the report does not tell.
+    """
+    start = parse_report_time(body.get('spec', {}).get('reportingStart'))
+    if start is not None:
+        return start
+    created = parse_report_time(body['metadata'].get('creationTimestamp'))
+    if created is not None:
+        return created - REPORT_PERIOD_MAX
+    return None
+
+
+async def rate_report(report_name: AnyStr,
+                      table_name: AnyStr,
+                      logger: Logger,
+                      last_report_time: dt = None,
+                      first_frame_time: dt = None):
+    """
+    Rate the frames of a report not rated yet.
+
+    Nothing is rated if the report did not run since the last rating, or if
+    the period to rate is empty. The rating itself is CPU bound and runs in
+    the default executor, so that other events keep being handled meanwhile.
+    A report never rated is rated from first_frame_time rather than from
+    epoch 0, so that its first rating does not query every day since 1970.
+
+    :report_name (AnyStr) The name of the report to be rated.
+    :table_name (AnyStr) The name of the table to use to get data.
+    :logger (Logger) A Logger object to log informations.
+    :last_report_time (datetime) The last time the report ran, if known.
+    :first_frame_time (datetime) The earliest time the frames of the report can start at, if known.
+    """
+    timeline = await configurations.retrieve_timeline()
+    if not timeline:
+        raise utils.ConfigurationMissingError(
+            'Bad response from API, no configuration found.'
+        )
+    begin = await rated_or_not(report_name)
+    if first_frame_time is not None and begin < first_frame_time:
+        begin = first_frame_time
+    if last_report_time is not None and last_report_time <= begin:
+        logger.debug(f'{report_name} already rated up to {begin}, skipping')
+        return
+    periods = split_rating_period(report_name, table_name, begin, timeline)
+    if not periods:
+        logger.debug(f'nothing to rate for {report_name} from {begin}, skipping')
+        return
+    for configuration, metric_config in periods:
+        configurations.ensure_rules_config(configuration)
+        logger.info(f'using config with timestamp {configuration["valid_from"]}')
+        logger.info(
+            'rating for {metric} in {table} for period {begin} to {end} started..'
+            .format(metric=metric_config['metric'],
+                    table=metric_config['presto_table'],
+                    begin=metric_config['begin'],
+                    end=metric_config['end'])
+        )
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        rated_metrics.retrieve_periods,
+        [(configuration['rules']['rules'], metric_config)
+         for configuration, metric_config in periods],
+        logger))
+
+
+def log_rating(report_name: AnyStr, logger: Logger, rating: asyncio.Future):
+    """
+    Forget a rating requested by report events, logging its error if it failed.
+
+    :report_name (AnyStr) The name of the rated report.
+    :logger (Logger) A Logger object to log informations.
+    :rating (Future) The future holding the result of the rating.
+    """
+    RATINGS.discard(rating)
+    if not rating.cancelled() and rating.exception() is not None:
+        logger.error(f'rating of {report_name} failed: {rating.exception()}')
+
+
 @kopf.on.event('metering.openshift.io', 'v1', 'reports')
-def report_event(body: Dict,
-                 logger: Logger,
-                 **kwargs: Dict):
+async def report_event(body: Dict,
+                       logger: Logger,
+                       **kwargs: Dict):
     """
     Catch events of reports and rate the frames.
 
+    The rating is requested without waiting for it, so that the next events
+    of the report reach the handler meanwhile. Bursts of events of a report
+    are collapsed into one rating, made after the last event. Ratings are run
+    by the scheduler, several reports at once, and an event for a report being
+    rated queues one more rating of it, made once the current one is done.
+
     :body (Dict) A dictionary containing the report object.
     :logger (Logger) A Logger object to log informations.
     :kwargs (Dict) A dictionary holding optional parameters.
     """
     metadata = body['metadata']
+    if kwargs['type'] == 'DELETED':
+        track_table_ref(metadata['name'], None)
+        watermarks.WATERMARKS.discard(metadata['name'])
+        checkpoints.CHECKPOINTS.discard(metadata['name'])
+        return
     if kwargs["type"] not in ['ADDED', 'MODIFIED']:
         return
 
-    configurations = retrieve_configurations_from_API()
-    if not configurations:
-        raise utils.ConfigurationMissingError(
-            'Bad response from API, no configuration found.'
-        )
-    begin = rated_or_not(metadata['name'])
-    configs = tuple(ts['valid_from'] for ts in configurations)
-    choosen_config = get_closest_configs_bisect(
-        begin.strftime('%s'),
-        configs)
-
     table = kwargs['status'].get('tableRef')
     if not table:
         return
-    metric_config = check_rating_conditions(metadata['name'],
-                                            table['name'],
-                                            begin,
-                                            configurations[choosen_config])
-    if not metric_config:
-        return
-    logger.info(f'using config with timestamp {configs[choosen_config]}')
-    logger.info(
-        'rating for {metric} in {table} for period {begin} to {end} started..'
-        .format(metric=metric_config['metric'],
-                table=metric_config['presto_table'],
-                begin=metric_config['begin'],
-                end=metric_config['end'])
-    )
-    rules.ensure_rules_config(configurations[choosen_config]['rules']['rules'])
-    rated_metrics.retrieve_data(
-        configurations[choosen_config]['rules']['rules'],
-        metric_config,
-        logger)
+    track_table_ref(metadata['name'], table['name'])
+    job = functools.partial(rate_report,
+                            metadata['name'],
+                            table['name'],
+                            logger,
+                            parse_report_time(kwargs['status'].get('lastReportTime')),
+                            reporting_start(body))
+
+    async def schedule():
+        return await scheduler.SCHEDULER.submit(metadata['name'], table['name'], job)
+    rating = scheduler.COALESCER.submit(metadata['name'], schedule)
+    if rating not in RATINGS:
+        RATINGS.add(rating)
+        rating.add_done_callback(functools.partial(log_rating, metadata['name'], logger))
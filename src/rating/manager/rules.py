@@ -91,3 +91,73 @@ def ensure_rules_config(ruleset: List[Dict]):
         for value in labels.values():
             if not isinstance(value, (str, int, float)):
                 raise utils.ConfigurationExceptionError('Wrong type for label', value)
+
+
+class RuleMatcher:
+    """
+    Compiled form of a list of rulesets, built once per configuration.
+
+    Rules are indexed by metric, then by the keys of their labelSet and the
+    values expected for those keys. Matching a frame costs one dictionary lookup
+    per distinct set of label keys, instead of a scan over every rule.
+    The first-match-wins order of find_match is preserved.
+    """
+
+    def __init__(self, rules: List[Dict]):
+        """
+        Compile the rules into the matching index.
+
+        :rules (List[Dict]) The rulesets to compile, in priority order.
+        """
+        index = {}
+        position = 0
+        for ruleset in rules:
+            labelset = ruleset.get('labelSet') or {}
+            keys = tuple(sorted(labelset, key=str))
+            values = tuple(labelset[key] for key in keys)
+            for rule in ruleset.get('ruleset', []):
+                groups = index.setdefault(rule['metric'], {})
+                group = groups.setdefault(keys, [position, {}])
+                try:
+                    group[1].setdefault(values, (position, labelset, rule))
+                except TypeError:
+                    raise utils.ConfigurationExceptionError('Wrong type for label', values)
+                position += 1
+        # Groups are kept ordered by their first rule, so that the lookup
+        # can stop as soon as no remaining group can beat the current match.
+        self._index = {
+            metric: sorted(((first, keys, table) for keys, (first, table) in groups.items()),
+                           key=lambda group: group[0])
+            for metric, groups in index.items()
+        }
+
+    def find_match(self, metric: AnyStr, frame_labels: Dict) -> Union[Dict, Dict]:
+        """
+        Find the rule to use for a frame, like find_match does.
+
+        :metric (AnyStr) The metric name to be matched in rules.
+        :frame_labels (Dict) The labels of the frame.
+
+        Return dictionaries containing the rules to use, and the matched labelset.
+        """
+        best = None
+        for first, keys, table in self._index.get(metric, ()):
+            if best is not None and first > best[0]:
+                break
+            match = table.get(tuple(frame_labels.get(key) for key in keys))
+            if match is not None and (best is None or match[0] < best[0]):
+                best = match
+        if best is None:
+            return {}, {}
+        return best[1], best[2]
+
+
+def compile_rules(rules: List[Dict]) -> RuleMatcher:
+    """
+    Compile a list of rulesets into a RuleMatcher.
+
+    :rules (List[Dict]) The rulesets to compile.
+
+    Return the compiled matcher.
+    """
+    return RuleMatcher(rules)
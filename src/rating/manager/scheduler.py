@@ -0,0 +1,193 @@
+from collections import OrderedDict, deque
+from typing import Any, AnyStr, Awaitable, Callable, Hashable
+import asyncio
+
+from rating.manager import utils
+
+
+class RatingScheduler:
+    """
+    Rate several reports at once, with a global concurrency limit.
+
+    Waiting reports are queued by table, and tables take turns when a slot
+    frees up, so that a burst of reports on one table does not delay the others.
+    A report is rated by one run at a time: an event for a report already
+    waiting replaces the job of that run, and an event for a report being
+    rated queues one more run, started once the current one is done.
+    """
+
+    def __init__(self, limit: int):
+        """
+        Create an idle scheduler.
+
+        :limit (int) The maximum number of reports rated at once.
+        """
+        self.limit = max(limit, 1)
+        self._tables = OrderedDict()
+        self._waiting = {}
+        self._running = {}
+        self._reruns = {}
+        self._tasks = set()
+
+    def submit(self,
+               report_name: AnyStr,
+               table_name: AnyStr,
+               job: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        Schedule the rating of a report.
+
+        If the report is waiting, its job is replaced by the given one. If it
+        is being rated, the job is run again afterwards, so that the rating
+        sees what the event changed; later events replace that job too.
+
+        :report_name (AnyStr) The name of the report.
+        :table_name (AnyStr) The name of the table of the report.
+        :job (Callable[[], Awaitable]) The coroutine function rating the report.
+
+        Return a future holding the result of the run rating the report.
+        """
+        queued = self._reruns if report_name in self._running else self._waiting
+        pending = queued.get(report_name)
+        if pending is not None:
+            pending[0] = job
+            return pending[1]
+        future = asyncio.get_running_loop().create_future()
+        queued[report_name] = [job, future, table_name]
+        if queued is self._waiting:
+            self._tables.setdefault(table_name, deque()).append(report_name)
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Start waiting runs, one table after the other, while slots are free."""
+        while self._tables and len(self._running) < self.limit:
+            table_name, reports = next(iter(self._tables.items()))
+            report_name = reports.popleft()
+            if reports:
+                self._tables.move_to_end(table_name)
+            else:
+                del self._tables[table_name]
+            job, future, _ = self._waiting.pop(report_name)
+            self._running[report_name] = future
+            task = asyncio.ensure_future(self._run(report_name, job, future))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self,
+                   report_name: AnyStr,
+                   job: Callable[[], Awaitable],
+                   future: asyncio.Future) -> Any:
+        """
+        Run a job, then queue the run of the report requested meanwhile, if any, and start the next waiting one.
+
+        :report_name (AnyStr) The name of the report.
+        :job (Callable[[], Awaitable]) The coroutine function rating the report.
+        :future (Future) The future holding the result of the run.
+        """
+        try:
+            result = await job()
+        except BaseException as exc:
+            if not future.done():
+                future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            del self._running[report_name]
+            rerun = self._reruns.pop(report_name, None)
+            if rerun is not None:
+                self._waiting[report_name] = rerun
+                self._tables.setdefault(rerun[2], deque()).append(report_name)
+            self._dispatch()
+
+    @property
+    def running(self) -> int:
+        """Return the number of reports being rated."""
+        return len(self._running)
+
+    @property
+    def waiting(self) -> int:
+        """Return the number of runs waiting to be started."""
+        return len(self._waiting) + len(self._reruns)
+
+
+class EventCoalescer:
+    """
+    Collapse bursts of events into one call per key.
+
+    A call is made once no event came for its key during delay seconds, or
+    at the latest max_wait seconds after the first event of the burst.
+    The call made is the one of the last event.
+    """
+
+    def __init__(self, delay: float, max_wait: float = None):
+        """
+        Create an idle coalescer.
+
+        :delay (float) The time without events to wait for, in seconds.
+        :max_wait (float) The longest time to delay a call, ten times delay by default.
+        """
+        self.delay = delay
+        self.max_wait = delay * 10 if max_wait is None else max_wait
+        self._pending = {}
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        """Return the number of delayed calls."""
+        return len(self._pending)
+
+    def submit(self, key: Hashable, call: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        Delay a call, replacing the delayed call of the same key.
+
+        :key (Hashable) The key of the events.
+        :call (Callable[[], Awaitable]) The coroutine function to call.
+
+        Return a future holding the result of the call made for the burst.
+        """
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {
+                'future': loop.create_future(),
+                'deadline': loop.time() + self.max_wait,
+                'handle': None
+            }
+        else:
+            pending['handle'].cancel()
+        pending['call'] = call
+        delay = max(min(self.delay, pending['deadline'] - loop.time()), 0)
+        pending['handle'] = loop.call_later(delay, self._fire, key)
+        return pending['future']
+
+    def _fire(self, key: Hashable):
+        """
+        Make the delayed call of a key, passing its outcome to the future.
+
+        :key (Hashable) The key of the events.
+        """
+        pending = self._pending.pop(key)
+        future = pending['future']
+        task = asyncio.ensure_future(pending['call']())
+        self._tasks.add(task)
+
+        def done(task: asyncio.Future):
+            self._tasks.discard(task)
+            if future.done():
+                return
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        task.add_done_callback(done)
+
+
+# Scheduler of the report ratings, rating $RATING_CONCURRENT_REPORTS reports at once
+SCHEDULER = RatingScheduler(utils.envvar_int('RATING_CONCURRENT_REPORTS', 4))
+
+# Coalescer of the report events, waiting for $RATING_EVENTS_DEBOUNCE seconds without events
+COALESCER = EventCoalescer(utils.envvar_int('RATING_EVENTS_DEBOUNCE', 2))
@@ -1,10 +1,23 @@
-from typing import AnyStr, Callable, Dict
+from typing import Any, AnyStr, Callable, Dict, Iterable, Iterator, Tuple
+import aiohttp
+import asyncio
+import codecs
+import gzip
+import json
 import kopf
 import logging
 import os
 import re
 import requests
 import sys
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_ASYNC_SESSION = None
+_ASYNC_SESSION_LOOP = None
 
 
 class ConfigurationMissingError(Exception):
@@ -25,14 +38,60 @@ class ApiExceptionError(Exception):
     pass
 
 
+class UnsupportedEncodingError(ApiExceptionError):
+    """Simple error class to handle request encodings refused by the rating-api."""
+
+    pass
+
+
+class NotFoundError(kopf.TemporaryError):
+    """Simple error class to handle endpoints or objects missing from the rating-api."""
+
+    pass
+
+
+def in_rating_namespace(kwargs: Dict) -> bool:
+    """
+    Check that the namespace of the requests is covered by the rating-operator.
+
+    :kwargs (Dict) A dictionary containing all the parameter for the callback.
+
+    Return a boolean reflecting the result of the check.
+    """
+    namespace = kwargs['body']['metadata']['namespace']
+    rating_namespace = envvar('RATING_NAMESPACE')
+    if namespace != rating_namespace:
+        kwargs['logger'].info(f'event not in {rating_namespace} namespace, discarding')
+        return False
+    return True
+
+
 def assert_rating_namespace(func: Callable) -> Callable:
     """
     Assert that the namespace of the requests is covered by the rating-operator.
 
+    Coroutine functions are wrapped in a coroutine function, so that kopf
+    keeps running them in its event loop.
+
     :func (Callable) The decorated function.
 
     Return the wrapped function.
     """
+    if asyncio.iscoroutinefunction(func):
+        async def async_wrapper(**kwargs: Dict) -> Callable:
+            """
+            Assert that the namespace of the requests is covered by the rating-operator.
+
+            :kwargs (Dict) A dictionary containing all the parameter for the callback.
+
+            Return the awaited wrapped function.
+            """
+            if not in_rating_namespace(kwargs):
+                return {}
+            return await func(**kwargs)
+        async_wrapper.__name__ = func.__name__
+        return async_wrapper
+
     def wrapper(**kwargs: Dict) -> Callable:
         """
         Assert that the namespace of the requests is covered by the rating-operator.
@@ -41,10 +100,7 @@ def assert_rating_namespace(func: Callable) -> Callable:
 
         Return the wrapped function.
         """
-        namespace = kwargs['body']['metadata']['namespace']
-        rating_namespace = envvar('RATING_NAMESPACE')
-        if namespace != rating_namespace:
-            kwargs['logger'].info(f'event not in {rating_namespace} namespace, discarding')
+        if not in_rating_namespace(kwargs):
             return {}
         return func(**kwargs)
     wrapper.__name__ = func.__name__
@@ -77,6 +133,38 @@ def admin_token(func: Callable) -> Callable:
     return wrapper
 
 
+def rating_api_session() -> requests.Session:
+    """
+    Return the HTTP session shared by every call to the rating-api.
+
+    The session keeps connections alive in a pool of $RATING_API_POOL_SIZE
+    connections, and retries failed connections $RATING_API_RETRIES times with
+    an exponential backoff. GET requests are also retried on gateway errors.
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            retries = Retry(total=envvar_int('RATING_API_RETRIES', 3),
+                            backoff_factor=0.5,
+                            status_forcelist=(502, 503, 504),
+                            allowed_methods=frozenset({'GET'}),
+                            raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=envvar_int('RATING_API_POOL_SIZE', 10),
+                                  max_retries=retries)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSION = session
+        return _SESSION
+
+
+def rating_api_timeout() -> Tuple[float, float]:
+    """Return the connect and read timeouts of rating-api requests, in seconds."""
+    return (envvar_int('RATING_API_CONNECT_TIMEOUT', 5),
+            envvar_int('RATING_API_READ_TIMEOUT', 300))
+
+
 @admin_token
 def get_from_rating_api(endpoint: AnyStr, payload: Dict) -> Dict:
     """
@@ -88,22 +176,145 @@ def get_from_rating_api(endpoint: AnyStr, payload: Dict) -> Dict:
     Return the results of the requests, as a dictionary.
     """
     api_url = envvar('RATING_API_URL')
-    response = requests.get(f'{api_url}{endpoint}', params=payload)
+    response = rating_api_session().get(f'{api_url}{endpoint}',
+                                        params=payload,
+                                        timeout=rating_api_timeout())
     try:
         response.raise_for_status()
     except requests.exceptions.RequestException:
+        if response.status_code == 404:
+            raise NotFoundError(f'{endpoint} not found on the rating-api, retrying in 5s..', delay=5)
         raise kopf.TemporaryError('rated data failed to be retrieved, retrying in 5s..', delay=5)
     content = response.json()
     return content.get('results', {})
 
 
+def iter_json_array(chunks: Iterable[bytes], key: AnyStr = 'results') -> Iterator:
+    """
+    Decode the items of an array of a JSON object incrementally, as chunks arrive.
+
+    Only the array under key is streamed, the other members of the object
+    are decoded and dropped. Nothing is yielded if key does not hold an array.
+
+    :chunks (Iterable[bytes]) The body of a response, as chunks of UTF-8 bytes.
+    :key (AnyStr) The key of the array in the top-level object.
+
+    Return an iterator over the items of the array.
+    """
+    decoder = json.JSONDecoder()
+    whitespaces = re.compile(r'[ \t\n\r]*').match
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, position, exhausted = '', 0, False
+
+    def fill() -> bool:
+        """Read the next chunk into the buffer, return False at the end of the body."""
+        nonlocal buffer, position, exhausted
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + text.decode(chunk)
+                position = 0
+                return True
+        if not exhausted:
+            exhausted = True
+            buffer = buffer[position:] + text.decode(b'', final=True)
+            position = 0
+            return True
+        return False
+
+    def skip() -> str:
+        """Skip whitespaces, return the next character, or '' at the end of the body."""
+        nonlocal position
+        while True:
+            position = whitespaces(buffer, position).end()
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                return ''
+
+    def expect(characters: str) -> str:
+        """Consume one of the expected characters, and return it."""
+        nonlocal position
+        character = skip()
+        if not character or character not in characters:
+            raise json.JSONDecodeError(f'Expecting one of {characters!r}', buffer, position)
+        position += 1
+        return character
+
+    def value() -> Any:
+        """Decode the next value, reading chunks until it is complete."""
+        nonlocal position
+        skip()
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number read up to the end of the buffer may go on in the next chunk
+            if exhausted or (end < len(buffer) and buffer[end] not in '0123456789.eE+-'):
+                position = end
+                return decoded
+            fill()
+
+    expect('{')
+    if skip() == '}':
+        return
+    while True:
+        name = value()
+        expect(':')
+        if name == key and skip() == '[':
+            position += 1
+            if skip() == ']':
+                position += 1
+            else:
+                while True:
+                    yield value()
+                    if expect(',]') == ']':
+                        break
+        else:
+            value()
+        if expect(',}') == '}':
+            return
+
+
+@admin_token
+def iter_from_rating_api(endpoint: AnyStr, payload: Dict) -> Iterator[Dict]:
+    """
+    Send a GET request to the given endpoint of the rating-api, streaming the results.
+
+    The response may be gzip compressed, and its results array is decoded
+    as it is received, one item at a time.
+
+    :endpoint (AnyStr) The endpoint to which to send the request.
+    :payload (Dict) A dictionary containing everything to be embedded in the request.
+
+    Return an iterator over the results of the request.
+    """
+    api_url = envvar('RATING_API_URL')
+    try:
+        with rating_api_session().get(f'{api_url}{endpoint}',
+                                      params=payload,
+                                      headers={'accept-encoding': 'gzip'},
+                                      timeout=rating_api_timeout(),
+                                      stream=True) as response:
+            response.raise_for_status()
+            yield from iter_json_array(response.iter_content(chunk_size=65536))
+    except (requests.exceptions.RequestException, ValueError):
+        raise kopf.TemporaryError('rated data failed to be retrieved, retrying in 5s..', delay=5)
+
+
 @admin_token
-def post_for_rating_api(endpoint: AnyStr, payload: Dict) -> Dict:
+def post_for_rating_api(endpoint: AnyStr,
+                        payload: Dict,
+                        content_encoding: AnyStr = None) -> Dict:
     """
     Send a POST request to the given endpoint of the rating-api.
 
     :endpoint (AnyStr) The endpoint to which to send the request.
     :payload (Dict) A dictionary containing everything to be embedded in the request.
+    :content_encoding (AnyStr) 'gzip' to compress the request body, None to send it as is.
 
     Return the results of the requests, as a dictionary.
     """
@@ -111,8 +322,17 @@ def post_for_rating_api(endpoint: AnyStr, payload: Dict) -> Dict:
     headers = {
         'content-type': 'application/json'
     }
-    response = requests.post(url=f'{api_url}{endpoint}', headers=headers,json=payload)
-    if response.status_code == 400:  # When ratingrule is wrong
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    if content_encoding == 'gzip':
+        headers['content-encoding'] = 'gzip'
+        body = gzip.compress(body, compresslevel=1)
+    response = rating_api_session().post(url=f'{api_url}{endpoint}',
+                                         headers=headers,
+                                         data=body,
+                                         timeout=rating_api_timeout())
+    if response.status_code == 415:  # When the encoding is not supported
+        raise UnsupportedEncodingError(response.content.decode('utf-8'))
+    elif response.status_code == 400:  # When ratingrule is wrong
         raise ConfigurationExceptionError(response.content.decode("utf-8"))
     elif response.status_code == 404:  # When object is not found
         raise ApiExceptionError
@@ -123,6 +343,101 @@ def post_for_rating_api(endpoint: AnyStr, payload: Dict) -> Dict:
     return response.json()
 
 
+async def rating_api_session_async() -> aiohttp.ClientSession:
+    """
+    Return the asynchronous HTTP session shared by every call to the rating-api.
+
+    The session is bound to the running event loop, and is created again
+    if the loop changed. It holds up to $RATING_API_POOL_SIZE connections.
+    """
+    global _ASYNC_SESSION, _ASYNC_SESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if _ASYNC_SESSION is None or _ASYNC_SESSION.closed or _ASYNC_SESSION_LOOP is not loop:
+        connect_timeout, read_timeout = rating_api_timeout()
+        _ASYNC_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=envvar_int('RATING_API_POOL_SIZE', 10)),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                          sock_read=read_timeout))
+        _ASYNC_SESSION_LOOP = loop
+    return _ASYNC_SESSION
+
+
+async def close_rating_api_session_async():
+    """Close the asynchronous HTTP session, if any."""
+    global _ASYNC_SESSION
+    if _ASYNC_SESSION is not None and _ASYNC_SESSION_LOOP is asyncio.get_running_loop():
+        await _ASYNC_SESSION.close()
+    _ASYNC_SESSION = None
+
+
+async def request_rating_api_async(method: AnyStr,
+                                   endpoint: AnyStr,
+                                   **kwargs: Dict) -> Tuple[int, bytes]:
+    """
+    Send a request to the rating-api, retrying it like the synchronous session does.
+
+    Connection errors are retried for every method, gateway and read errors
+    only for GET requests, up to $RATING_API_RETRIES times.
+
+    :method (AnyStr) The HTTP method of the request.
+    :endpoint (AnyStr) The endpoint to which to send the request.
+    :kwargs (Dict) The parameters of the request, passed to aiohttp.
+
+    Return the status and the content of the response.
+    """
+    api_url = envvar('RATING_API_URL')
+    session = await rating_api_session_async()
+    retries = envvar_int('RATING_API_RETRIES', 3)
+    for attempt in range(retries + 1):
+        try:
+            async with session.request(method, f'{api_url}{endpoint}', **kwargs) as response:
+                if method != 'GET' or response.status not in (502, 503, 504) or attempt == retries:
+                    return response.status, await response.read()
+        except aiohttp.ClientConnectorError:
+            if attempt == retries:
+                raise
+        except aiohttp.ClientError:
+            if method != 'GET' or attempt == retries:
+                raise
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+@admin_token
+async def get_from_rating_api_async(endpoint: AnyStr, payload: Dict) -> Dict:
+    """
+    Send a GET request to the given endpoint of the rating-api, without blocking.
+
+    :endpoint (AnyStr) The endpoint to which to send the request.
+    :payload (Dict) A dictionary containing everything to be embedded in the request.
+
+    Return the results of the requests, as a dictionary.
+    """
+    status, content = await request_rating_api_async('GET', endpoint, params=payload)
+    if status >= 400:
+        raise kopf.TemporaryError('rated data failed to be retrieved, retrying in 5s..', delay=5)
+    return json.loads(content).get('results', {})
+
+
+@admin_token
+async def post_for_rating_api_async(endpoint: AnyStr, payload: Dict) -> Dict:
+    """
+    Send a POST request to the given endpoint of the rating-api, without blocking.
+
+    :endpoint (AnyStr) The endpoint to which to send the request.
+    :payload (Dict) A dictionary containing everything to be embedded in the request.
+
+    Return the results of the requests, as a dictionary.
+    """
+    status, content = await request_rating_api_async('POST', endpoint, json=payload)
+    if status == 400:  # When ratingrule is wrong
+        raise ConfigurationExceptionError(content.decode('utf-8'))
+    elif status == 404:  # When object is not found
+        raise ApiExceptionError
+    elif status >= 400:
+        raise kopf.TemporaryError('rated data failed to be transmitted (connection error), retrying in 5s..', delay=5)
+    return json.loads(content)
+
+
 def is_valid_against(target: AnyStr, regexp: AnyStr) -> bool:
     """
     Validate a string against a given regular exepression.
@@ -135,6 +450,42 @@ def is_valid_against(target: AnyStr, regexp: AnyStr) -> bool:
     return re.match(regexp, target) is not None
 
 
+def load_json_file(path: AnyStr, description: AnyStr) -> Any:
+    """
+    Load the content of a JSON file written by save_json_file.
+
+    :path (AnyStr) The path of the file.
+    :description (AnyStr) What the file holds, for the logs.
+
+    Return the content, or None if the file is missing or unreadable.
+    """
+    try:
+        with open(path) as saved:
+            return json.load(saved)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logging.warning('Ignoring %s file %s: %s', description, path, exc)
+        return None
+
+
+def save_json_file(path: AnyStr, content: Any, description: AnyStr):
+    """
+    Save content to a JSON file atomically, so that it holds either the previous content or the new one.
+
+    :path (AnyStr) The path of the file.
+    :content (Any) The content to save.
+    :description (AnyStr) What the file holds, for the logs.
+    """
+    temporary = f'{path}.tmp'
+    try:
+        with open(temporary, 'w') as saved:
+            json.dump(content, saved)
+        os.replace(temporary, path)
+    except OSError as exc:
+        logging.warning('%s could not be saved to %s: %s', description.capitalize(), path, exc)
+
+
 def envvar_bool(name: AnyStr) -> bool:
     """
     Return a boolean value of the variable.
@@ -151,6 +502,25 @@ def envvar_bool(name: AnyStr) -> bool:
     return True
 
 
+def envvar_int(name: AnyStr, default: int) -> int:
+    """
+    Return the integer value of an optional environment variable.
+
+    :name (AnyStr) The name of the environment variable.
+    :default (int) The value to use when the variable is not set.
+
+    Return an integer corresponding to the name.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.error('Invalid integer in envvar $%s', name)
+        sys.exit(1)
+
+
 def envvar(name: AnyStr) -> AnyStr:
     """Return the value of an environment variable, or die trying."""
     try:
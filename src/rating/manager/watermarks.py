@@ -0,0 +1,119 @@
+from datetime import datetime as dt
+from typing import AnyStr
+import logging
+import os
+import threading
+
+from rating.manager import utils
+
+
+class WatermarkStore:
+    """
+    Time up to which each report is rated, kept in memory and optionally in a file.
+
+    The rating-api holds the reference value. A stored watermark is checked
+    against it once, the first time the report is rated by this process, and
+    again after a failed upload; in between it is trusted as is. Watermarks
+    are updated after every upload, so that they keep the exact time the last
+    batch was committed at, where the rating-api only keeps seconds.
+    """
+
+    def __init__(self, path: AnyStr = None):
+        """
+        Create the store, loading the watermarks saved in path if any.
+
+        :path (AnyStr) The file the watermarks are saved to, None to keep them in memory only.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._watermarks = {}
+        self._verified = set()
+        if path:
+            self.load()
+
+    def load(self):
+        """Load the watermarks saved in the file of the store, if any."""
+        watermarks = utils.load_json_file(self.path, 'watermarks')
+        if watermarks is None:
+            return
+        with self._lock:
+            self._watermarks = {report_name: dt.fromisoformat(watermark)
+                                for report_name, watermark in watermarks.items()}
+
+    def _save(self):
+        """Save the watermarks to the file of the store, atomically. The lock must be held."""
+        if self.path:
+            utils.save_json_file(self.path,
+                                 {report_name: watermark.isoformat()
+                                  for report_name, watermark in self._watermarks.items()},
+                                 'watermarks')
+
+    def get(self, report_name: AnyStr) -> dt or None:
+        """
+        Get the watermark of a report, if it was checked against the rating-api.
+
+        :report_name (AnyStr) The name of the report.
+
+        Return the datetime up to which the report is rated, or None.
+        """
+        with self._lock:
+            if report_name not in self._verified:
+                return None
+            return self._watermarks.get(report_name)
+
+    def verify(self, report_name: AnyStr, reference: dt) -> dt:
+        """
+        Check the watermark of a report against the value of the rating-api.
+
+        The stored watermark is kept if it matches the reference to the second,
+        the reference replaces it otherwise.
+
+        :report_name (AnyStr) The name of the report.
+        :reference (datetime) The last rated time of the report, from the rating-api.
+
+        Return the datetime up to which the report is rated.
+        """
+        with self._lock:
+            watermark = self._watermarks.get(report_name)
+            if watermark is None or watermark.replace(microsecond=0) != reference:
+                if watermark is not None:
+                    logging.info('Watermark of %s moved from %s to %s', report_name, watermark, reference)
+                watermark = self._watermarks[report_name] = reference
+                self._save()
+            self._verified.add(report_name)
+            return watermark
+
+    def set(self, report_name: AnyStr, watermark: dt):
+        """
+        Move the watermark of a report, after a successful upload.
+
+        :report_name (AnyStr) The name of the report.
+        :watermark (datetime) The time up to which the report is rated.
+        """
+        with self._lock:
+            self._watermarks[report_name] = watermark
+            self._save()
+
+    def invalidate(self, report_name: AnyStr):
+        """
+        Check the watermark of a report against the rating-api on next use.
+
+        :report_name (AnyStr) The name of the report.
+        """
+        with self._lock:
+            self._verified.discard(report_name)
+
+    def discard(self, report_name: AnyStr):
+        """
+        Forget the watermark of a report.
+
+        :report_name (AnyStr) The name of the report.
+        """
+        with self._lock:
+            self._verified.discard(report_name)
+            if self._watermarks.pop(report_name, None) is not None:
+                self._save()
+
+
+# Watermarks of the reports, saved to $RATING_WATERMARKS_FILE if set
+WATERMARKS = WatermarkStore(os.environ.get('RATING_WATERMARKS_FILE') or None)
@@ -0,0 +1,225 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AnyStr, Dict, List, Sequence, Tuple
+import hashlib
+import json
+import multiprocessing
+import threading
+
+from rating.manager import rates
+from rating.manager import rules as rs
+from rating.manager import utils
+from rating.manager.frames import Dictionary, FrameBatch, RatedFrames
+
+
+def rate_rows(matcher: rs.RuleMatcher,
+              matches: Dict,
+              metric_config: Dict,
+              labels_name: Sequence[AnyStr],
+              combinations: Sequence[Tuple],
+              codes: Sequence[int],
+              quantities: Sequence[float],
+              labelsets: Dictionary) -> Tuple[List[float], List, List[int]]:
+    """
+    Rate rows of a batch, converting and pricing them at once.
+
+    Rules are matched once per distinct combination of labels, and the matched
+    labelSet is serialized once too. Matches can be kept between batches.
+
+    :matcher (RuleMatcher) The compiled rules to rate the rows with.
+    :matches (Dict) The serialized labelSet and the rule of each combination of labels.
+    :metric_config (Dict) A dictionary holding the metrics configuration.
+    :labels_name (Sequence[AnyStr]) The names of the labels columns.
+    :combinations (Sequence[Tuple]) The combinations of labels values of the batch.
+    :codes (Sequence[int]) The combination of each row.
+    :quantities (Sequence[float]) The quantity of each row.
+    :labelsets (Dictionary) The serialized labelSets, encoded as the rows are rated.
+
+    Return the converted quantities, the ratings and the code of the labelSet of each row.
+    """
+    rated = {}
+    for code in sorted(set(codes)):
+        values = combinations[code]
+        match = matches.get(values)
+        if match is None:
+            labels, rule = matcher.find_match(metric_config['metric'],
+                                              dict(zip(labels_name, values)))
+            match = matches[values] = (f'{labels}', rule)
+        rated[code] = (labelsets.encode(match[0]), match[1])
+
+    converted, ratings = rates.rate_batch(metric_config['unit'],
+                                          [rated[code][1] for code in codes],
+                                          quantities)
+    return converted, ratings, [rated[code][0] for code in codes]
+
+
+def rate_frames(frames: FrameBatch,
+                matcher: rs.RuleMatcher,
+                metric_config: Dict,
+                matches: Dict = None) -> RatedFrames:
+    """
+    Rate frames, converting and pricing them as a batch.
+
+    :frames (FrameBatch) The frames to rate.
+    :matcher (RuleMatcher) The compiled rules to rate the frames with.
+    :metric_config (Dict) A dictionary holding the metrics configuration.
+    :matches (Dict) The serialized labelSet and the rule of each combination of labels.
+
+    Return the rated frames.
+    """
+    if matches is None:
+        matches = {}
+    rated_frames = RatedFrames(frames, metric_config['metric'])
+    rated_frames.extend(*rate_rows(matcher,
+                                   matches,
+                                   metric_config,
+                                   frames.labels_name,
+                                   frames.labelsets.values,
+                                   frames.labelset_codes,
+                                   frames.quantities,
+                                   rated_frames.labelsets))
+    return rated_frames
+
+
+# Compiled rules and matches of a rating worker process
+WORKER = {}
+
+# Number of rulesets kept compiled by each rating worker
+WORKER_RULESETS = 8
+
+# Rating worker processes shared by every rating, started on first use
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def rules_digest(rules: List[Dict]) -> AnyStr:
+    """Return a digest identifying a set of rules, for the rating workers."""
+    return hashlib.sha1(json.dumps(rules, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def rating_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Return the pool of rating worker processes, starting it with workers processes if needed.
+
+    Workers are started from a forkserver, or spawned where there is none,
+    rather than forked from the operator, whose threads could hold locks
+    the children would inherit.
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _EXECUTOR = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _EXECUTOR
+
+
+def close_rating_executor():
+    """Stop the rating worker processes, if any were started."""
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        executor, _EXECUTOR = _EXECUTOR, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def rate_rows_in_worker(digest: AnyStr,
+                        rules: List[Dict],
+                        metric_config: Dict,
+                        labels_name: Sequence[AnyStr],
+                        combinations: Sequence[Tuple],
+                        codes: Sequence[int],
+                        quantities: Sequence[float]) -> Tuple[List[float], List, List[int], List[AnyStr]]:
+    """
+    Rate rows of a batch in a rating worker process.
+
+    Workers keep the last WORKER_RULESETS rulesets compiled, by digest, with
+    the labelSets they matched.
+
+    :digest (AnyStr) The digest of the rules.
+    :rules (List[Dict]) The rules to rate the frames with.
+    :metric_config (Dict) A dictionary holding the metrics configuration.
+    :labels_name (Sequence[AnyStr]) The names of the labels columns.
+    :combinations (Sequence[Tuple]) The combinations of labels values of the batch.
+    :codes (Sequence[int]) The combination of each row.
+    :quantities (Sequence[float]) The quantity of each row.
+
+    Return the converted quantities, the ratings, the code of the labelSet of
+    each row and the serialized labelSets.
+    """
+    compiled = WORKER.pop(digest, None)
+    if compiled is None:
+        compiled = (rs.compile_rules(rules), {})
+        if len(WORKER) >= WORKER_RULESETS:
+            del WORKER[next(iter(WORKER))]
+    WORKER[digest] = compiled
+    labelsets = Dictionary()
+    converted, ratings, labels = rate_rows(compiled[0],
+                                           compiled[1],
+                                           metric_config,
+                                           labels_name,
+                                           combinations,
+                                           codes,
+                                           quantities,
+                                           labelsets)
+    return converted, ratings, labels, labelsets.values
+
+
+class RatingPool:
+    """
+    Rate frames of a period, over the rating worker processes for large batches.
+
+    The operator starts at most $RATING_WORKERS worker processes, shared by
+    every rating. Batches of at least $RATING_PARALLEL_MIN_FRAMES frames are
+    split in row ranges rated by the workers, and merged back in order.
+    Smaller batches, or every batch when less than two workers are configured,
+    are rated in the current process. The processes are only started once a
+    batch is large enough.
+    """
+
+    def __init__(self, rules: List[Dict]):
+        """
+        Prepare the rating of a period.
+
+        :rules (List[Dict]) The rules to rate the frames with.
+        """
+        self.rules = rules
+        self.digest = rules_digest(rules)
+        self.matcher = rs.compile_rules(rules)
+        self.matches = {}
+        self.workers = utils.envvar_int('RATING_WORKERS', 0)
+        self.min_frames = max(utils.envvar_int('RATING_PARALLEL_MIN_FRAMES', 50000), 1)
+
+    def rate(self, frames: FrameBatch, metric_config: Dict) -> RatedFrames:
+        """
+        Rate frames, in the worker processes if the batch is large enough.
+
+        :frames (FrameBatch) The frames to rate.
+        :metric_config (Dict) A dictionary holding the metrics configuration.
+
+        Return the rated frames, in the order of the batch.
+        """
+        if self.workers < 2 or len(frames) < self.min_frames:
+            return rate_frames(frames, self.matcher, metric_config, self.matches)
+        executor = rating_executor(self.workers)
+        size = -(-len(frames) // self.workers)
+        futures = [executor.submit(rate_rows_in_worker,
+                                   self.digest,
+                                   self.rules,
+                                   metric_config,
+                                   frames.labels_name,
+                                   frames.labelsets.values,
+                                   frames.labelset_codes[row:row + size],
+                                   frames.quantities[row:row + size])
+                   for row in range(0, len(frames), size)]
+        rated_frames = RatedFrames(frames, metric_config['metric'])
+        try:
+            for future in futures:
+                converted, ratings, labels, labelsets = future.result()
+                codes = [rated_frames.labelsets.encode(labelset) for labelset in labelsets]
+                rated_frames.extend(converted, ratings, [codes[label] for label in labels])
+        except BrokenProcessPool:
+            # Start new workers for the next rating
+            close_rating_executor()
+            raise
+        return rated_frames
@@ -0,0 +1,53 @@
+"""
+Compare the precomputed label projection against the per-frame label scan.
+
+Run with ``python tests/benchmarks/bench_labels.py [labels] [frames]``.
+"""
+import sys
+import timeit
+
+from generators import COLUMN, generate_frames
+
+from rating.manager import rated_metrics
+from rating.manager.frames import label_projection
+
+
+def scan_frames_labels(frame: dict, column_name: str, labels: list) -> dict:
+    """Extract the labels of a frame, comparing every key with the excluded columns."""
+    frame_labels = {}
+    for key, value in frame.items():
+        if key not in ['period_start',
+                       'period_end',
+                       'pod',
+                       'namespace',
+                       'node',
+                       column_name] and key in labels:
+            frame_labels[key] = value
+    return frame_labels
+
+
+def main(labels_count: int, frames_count: int):
+    labels = [f'label_{idx}' for idx in range(labels_count)]
+    frames = generate_frames(frames_count, dict.fromkeys(labels, 3))
+    projection = label_projection(tuple(frames[0]), COLUMN)
+
+    def scan():
+        for frame in frames:
+            scan_frames_labels(frame, COLUMN, labels)
+
+    def extract():
+        for frame in frames:
+            rated_metrics.extract_frames_labels(frame, COLUMN, projection)
+
+    def values():
+        for frame in frames:
+            projection.values(frame)
+
+    for name, func in (('scan', scan), ('projection', extract), ('values', values)):
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        print(f'{name:>10}: {elapsed:.4f}s, {frames_count / elapsed:,.0f} frames/s')
+
+
+if __name__ == '__main__':
+    arguments = [int(arg) for arg in sys.argv[1:3]]
+    main(*(arguments or [50, 20000]))
@@ -0,0 +1,37 @@
+"""
+Compare the batch rating kernel against the frame by frame conversion and rating.
+
+Run with ``python tests/benchmarks/bench_rates.py [frames] [rules]``.
+"""
+import random
+import sys
+import timeit
+
+from rating.manager import rates
+
+
+def main(frames_count: int, rules_count: int):
+    generator = random.Random(0)
+    ruleset = [{'metric': 'usage_memory', 'value': generator.random(), 'unit': 'GiB-hours'}
+               for _ in range(rules_count)]
+    rules = [generator.choice(ruleset) for _ in range(frames_count)]
+    quantities = [generator.randrange(1, 2 ** 40) for _ in range(frames_count)]
+
+    def scalar():
+        for rule, qty in zip(rules, quantities):
+            converted = rates.convert_metrics_unit('byte-seconds', rule['unit'], qty)
+            rates.rate(rule, {'qty': converted})
+
+    def batch():
+        rates.rate_batch('byte-seconds', rules, quantities)
+
+    if rates.numpy is None:
+        print('numpy is not installed, the batch kernel falls back to the scalar path')
+    for name, func in (('scalar', scalar), ('batch', batch)):
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        print(f'{name:>8}: {elapsed:.4f}s, {elapsed / frames_count * 1e9:,.0f} ns/frame')
+
+
+if __name__ == '__main__':
+    arguments = [int(arg) for arg in sys.argv[1:3]]
+    main(*(arguments or [200000, 50]))
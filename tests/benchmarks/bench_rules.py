@@ -0,0 +1,38 @@
+"""
+Compare the compiled rule matcher against the linear find_match.
+
+Run with ``python tests/benchmarks/bench_rules.py [labelsets] [frames]``.
+"""
+import sys
+import timeit
+
+from generators import generate_frames, generate_rules
+
+from rating.manager import rules
+
+CARDINALITIES = {'instance_type': 200, 'storage_type': 3}
+
+
+def main(labelsets: int, frames_count: int):
+    metrics = ['request_cpu', 'usage_cpu', 'request_memory', 'usage_memory']
+    ruleset = generate_rules(labelsets, CARDINALITIES, metrics)
+    frames = [{label: frame[label] for label in CARDINALITIES}
+              for frame in generate_frames(frames_count, CARDINALITIES)]
+
+    def linear():
+        for frame_labels in frames:
+            rules.find_match('usage_memory', frame_labels, ruleset)
+
+    def compiled():
+        matcher = rules.compile_rules(ruleset)
+        for frame_labels in frames:
+            matcher.find_match('usage_memory', frame_labels)
+
+    for name, func in (('linear', linear), ('compiled', compiled)):
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        print(f'{name:>10}: {elapsed:.4f}s, {frames_count / elapsed:,.0f} frames/s')
+
+
+if __name__ == '__main__':
+    arguments = [int(arg) for arg in sys.argv[1:3]]
+    main(*(arguments or [300, 20000]))
@@ -0,0 +1,189 @@
+"""
+Benchmark the rating hot path on synthetic frames, reporting throughput and peak memory.
+
+Each case runs three times timed, keeping the best time, then once under
+tracemalloc for its peak memory.
+retrieve_data runs against a local stand-in rating-api, serving from the same
+process: its throughput includes the HTTP round trips and the stand-in itself.
+
+Results can be checked against the baselines stored in baselines.json for
+the same frames and labelSets counts: --check exits with an error if a case
+is slower, or uses more memory, than its baseline beyond --tolerance.
+--update stores the results as the new baselines. Throughputs depend on the
+machine, so baselines.json is not versioned: run --update first on the
+machine that checks them.
+
+Run with ``python tests/benchmarks/bench_suite.py [frames] [labelsets] [--check|--update]``.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime as dt, timedelta
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generators import COLUMN, generate_frames, generate_rules  # noqa: E402
+from rating_api_stub import RatingApiStub  # noqa: E402
+
+from rating.manager import rated_metrics, rates, rules  # noqa: E402
+
+CARDINALITIES = {'instance_type': 20, 'storage_type': 3, 'zone': 6, 'team': 50}
+METRICS = ['usage_cpu', 'usage_memory', 'request_memory']
+DAYS = 4
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+def measure(func: Callable) -> tuple:
+    """Run func for its best time out of three runs, and once for its peak memory, in MiB."""
+    elapsed = min(timeit.repeat(func, number=1, repeat=3))
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def rating_api(frames: list, ruleset: list) -> RatingApiStub:
+    """Serve the columns, the frames by day, and accept the rated frames."""
+    days = {}
+    for frame in frames:
+        days.setdefault(frame['period_start'][:10], []).append(frame)
+    bodies = {day: json.dumps(day_frames)[1:-1].encode('utf-8') for day, day_frames in days.items()}
+    columns = [{'column_name': name} for name in frames[0]]
+
+    def get_frames(request: dict) -> tuple:
+        begin = dt.fromisoformat(request['params']['start'][0])
+        end = dt.fromisoformat(request['params']['end'][0])
+        selected = []
+        while begin < end:
+            body = bodies.get(begin.date().isoformat())
+            if body:
+                selected.append(body)
+            begin += timedelta(days=1)
+        return 200, b'{"results": [' + b', '.join(selected) + b']}'
+
+    return RatingApiStub({
+        ('GET', '/presto/benchmark/columns'): lambda _: (200, {'results': columns}),
+        ('GET', '/presto/benchmark/frames'): get_frames,
+        ('POST', '/rated/frames/add'): lambda _: (200, {'results': 'ok'})
+    })
+
+
+def compare(results: Dict[str, Dict], baselines: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Return the cases of results slower or larger than their baseline, beyond tolerance."""
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        if result['frames/s'] < baseline['frames/s'] * (1 - tolerance):
+            regressions.append(f'{name}: {result["frames/s"]:,.0f} frames/s, '
+                               f'baseline {baseline["frames/s"]:,.0f}')
+        # Small peaks vary by a few allocations, hence the extra MiB
+        if result['peak MiB'] > baseline['peak MiB'] * (1 + tolerance) + 1:
+            regressions.append(f'{name}: {result["peak MiB"]:.1f} peak MiB, '
+                               f'baseline {baseline["peak MiB"]:.1f}')
+    return regressions
+
+
+def main(frames_count: int, labelsets: int) -> Dict[str, Dict]:
+    logging.disable(logging.INFO)
+    frames = generate_frames(frames_count, CARDINALITIES, hours=24 * DAYS)
+    ruleset = generate_rules(labelsets, CARDINALITIES, METRICS)
+    labels_name = sorted(CARDINALITIES)
+    frames_labels = [{label: frame[label] for label in labels_name} for frame in frames]
+    projection = rated_metrics.label_projection(tuple(frames[0]), COLUMN)
+    rule = ruleset[0]['ruleset'][1]
+    quantities = [frame[COLUMN] for frame in frames]
+    metric_config = {
+        'metric': 'usage_memory',
+        'report_name': 'benchmark',
+        'presto_table': 'benchmark',
+        'presto_column': COLUMN,
+        'unit': 'byte-seconds',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 1) + timedelta(days=DAYS)
+    }
+
+    # Cases keep their outputs, for their peak memory to include them
+    def find_match_linear():
+        return [rules.find_match('usage_memory', labels, ruleset) for labels in frames_labels]
+
+    def find_match_compiled():
+        matcher = rules.compile_rules(ruleset)
+        return [matcher.find_match('usage_memory', labels) for labels in frames_labels]
+
+    def convert_metrics_unit():
+        return [rates.convert_metrics_unit('byte-seconds', 'GiB-hours', quantity) for quantity in quantities]
+
+    def rate():
+        return [rates.rate(rule, {'qty': quantity}) for quantity in quantities]
+
+    def rate_batch():
+        return rates.rate_batch('byte-seconds', [rule] * len(quantities), quantities)
+
+    def extract_frames_labels():
+        return [rated_metrics.extract_frames_labels(frame, COLUMN, projection) for frame in frames]
+
+    def retrieve_data():
+        rated_metrics.retrieve_data(ruleset, metric_config, logging.getLogger())
+
+    cases = [
+        ('find_match (linear)', find_match_linear),
+        ('find_match (compiled)', find_match_compiled),
+        ('convert_metrics_unit', convert_metrics_unit),
+        ('rate', rate),
+        ('rate_batch', rate_batch),
+        ('extract_frames_labels', extract_frames_labels),
+    ]
+    results = {}
+    print(f'{frames_count:,} frames, {labelsets} labelSets, labels {CARDINALITIES}')
+    print(f'{"case":<24}{"seconds":>10}{"frames/s":>14}{"peak MiB":>10}')
+    for name, func in cases:
+        elapsed, peak = measure(func)
+        results[name] = {'frames/s': frames_count / elapsed, 'peak MiB': peak}
+        print(f'{name:<24}{elapsed:>10.4f}{frames_count / elapsed:>14,.0f}{peak:>10.1f}')
+
+    with rating_api(frames, ruleset) as stub:
+        os.environ.update({'RATING_API_URL': stub.url, 'RATING_ADMIN_API_KEY': 'benchmark'})
+        elapsed, peak = measure(retrieve_data)
+        uploads = sum(1 for request in stub.requests if request['path'] == '/rated/frames/add')
+    results['retrieve_data'] = {'frames/s': frames_count / elapsed, 'peak MiB': peak}
+    print(f'{"retrieve_data":<24}{elapsed:>10.4f}{frames_count / elapsed:>14,.0f}{peak:>10.1f}'
+          f'  ({uploads // 4} uploads per run)')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the rating hot path.')
+    parser.add_argument('frames', type=int, nargs='?', default=100000)
+    parser.add_argument('labelsets', type=int, nargs='?', default=300)
+    parser.add_argument('--check', action='store_true', help='fail on regressions against the baselines')
+    parser.add_argument('--update', action='store_true', help='store the results as the baselines')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed regression, 0.5 by default')
+    options = parser.parse_args()
+    results = main(options.frames, options.labelsets)
+
+    size = f'{options.frames}/{options.labelsets}'
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as saved:
+            baselines = json.load(saved)
+    if options.update:
+        baselines[size] = {name: {key: round(value, 1) for key, value in result.items()}
+                           for name, result in results.items()}
+        with open(BASELINES, 'w') as saved:
+            json.dump(baselines, saved, indent=2, sort_keys=True)
+            saved.write('\n')
+    elif options.check:
+        if size not in baselines:
+            sys.exit(f'no baselines for {size} frames/labelSets')
+        regressions = compare(results, baselines[size], options.tolerance)
+        if regressions:
+            sys.exit('regressions:\n' + '\n'.join(regressions))
+        print(f'no regression beyond {options.tolerance:.0%} of the baselines')
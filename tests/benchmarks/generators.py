@@ -0,0 +1,71 @@
+"""Synthetic frames, labels and rulesets for the benchmarks."""
+import random
+from datetime import datetime as dt, timedelta
+from typing import Dict, List
+
+COLUMN = 'pod_usage_memory_byte_seconds'
+
+
+def generate_label_values(cardinalities: Dict[str, int]) -> Dict[str, List[str]]:
+    """Generate the possible values of each label, cardinalities giving their number."""
+    return {label: [f'{label}-{idx}' for idx in range(count)]
+            for label, count in cardinalities.items()}
+
+
+def generate_frames(count: int,
+                    cardinalities: Dict[str, int],
+                    begin: dt = dt(2020, 1, 1),
+                    hours: int = 24,
+                    namespaces: int = 20,
+                    seed: int = 0) -> List[Dict]:
+    """
+    Generate frames as returned by the rating-api, spread over hours from begin.
+
+    Every label of cardinalities is a column of the frames, each frame taking
+    one of its values at random.
+    """
+    generator = random.Random(seed)
+    values = generate_label_values(cardinalities)
+    frames = []
+    for idx in range(count):
+        period_start = begin + timedelta(hours=idx * hours // count)
+        frame = {
+            'period_start': period_start.isoformat(sep=' '),
+            'period_end': (period_start + timedelta(hours=1)).isoformat(sep=' '),
+            'namespace': f'namespace-{generator.randrange(namespaces)}',
+            'node': f'node-{generator.randrange(10)}',
+            'pod': f'pod-{idx % (count // 4 + 1)}',
+            COLUMN: generator.randrange(1, 2 ** 40)
+        }
+        for label, choices in values.items():
+            frame[label] = generator.choice(choices)
+        frames.append(frame)
+    return frames
+
+
+def generate_rules(labelsets: int,
+                   cardinalities: Dict[str, int],
+                   metrics: List[str],
+                   seed: int = 0) -> List[Dict]:
+    """
+    Generate rules in the format of the rating rules, plus a default rule.
+
+    Each labelSet selects one to two labels of cardinalities, and holds a rule
+    for every metric.
+    """
+    generator = random.Random(seed)
+    values = generate_label_values(cardinalities)
+    labels = sorted(values)
+    rules = []
+    for idx in range(labelsets):
+        selected = generator.sample(labels, min(len(labels), generator.randint(1, 2)))
+        rules.append({
+            'labelSet': {label: generator.choice(values[label]) for label in selected},
+            'ruleset': [{'metric': metric, 'value': generator.random(), 'unit': 'GiB-hours'}
+                        for metric in metrics]
+        })
+    rules.append({
+        'ruleset': [{'metric': metric, 'value': 0.001, 'unit': 'GiB-hours'}
+                    for metric in metrics]
+    })
+    return rules
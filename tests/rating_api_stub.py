@@ -0,0 +1,99 @@
+"""Local stand-in for the rating-api, serving canned responses over HTTP."""
+import json
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+
+class RatingApiStub:
+    """
+    Serve the rating-api endpoints registered in routes, on a local port.
+
+    Routes map (method, path) to a callable receiving the recorded request,
+    and returning a (status, body) or (status, body, headers) tuple.
+    Every request is recorded in requests.
+    """
+
+    def __init__(self, routes: Dict[tuple, Callable] = None):
+        self.routes = routes or {}
+        self.requests: List[Dict] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self, method: str):
+                url = urlparse(self.path)
+                length = int(self.headers.get('content-length', 0))
+                raw = self.rfile.read(length) if length else b''
+                request = {
+                    'method': method,
+                    'path': url.path,
+                    'params': parse_qs(url.query),
+                    'headers': dict(self.headers),
+                    'raw': raw,
+                    'client': self.client_address
+                }
+                stub.requests.append(request)
+                route = stub.routes.get((method, url.path))
+                headers = {}
+                if route is None:
+                    status, body = 404, {'message': 'not found'}
+                else:
+                    status, body, *headers = route(request)
+                    headers = headers[0] if headers else {}
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_rating_api_stub(test: unittest.TestCase, environ: Dict[str, str] = None) -> RatingApiStub:
+    """
+    Start a stub for a test, pointing the rating-api settings at it until the test ends.
+
+    :test (TestCase) The test using the stub.
+    :environ (Dict[str, str]) More environment variables to set during the test.
+
+    Return the started stub.
+    """
+    stub = RatingApiStub().__enter__()
+    test.addCleanup(stub.__exit__)
+    patcher = mock.patch.dict(os.environ, dict({
+        'RATING_API_URL': stub.url,
+        'RATING_ADMIN_API_KEY': 'secret'
+    }, **(environ or {})))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return stub
@@ -0,0 +1,95 @@
+import logging
+import os
+import tempfile
+import unittest
+from datetime import datetime as dt
+from unittest import mock
+
+import kopf
+
+from rating.manager import checkpoints
+from rating.manager import rated_metrics
+from rating.manager.checkpoints import CheckpointStore
+
+
+class TestCheckpointStore(unittest.TestCase):
+    """Test the checkpoints kept in memory and in a file."""
+
+    def test_lifecycle(self):
+        store = CheckpointStore()
+        key = store.key('report', 'usage_cpu', dt(2020, 1, 1))
+        self.assertIsNone(store.get(key))
+        self.assertIsNone(store.start(key, 'report', dt(2020, 1, 2))['last_row'])
+        store.commit(key, ['2020-01-01', 'ns'])
+        self.assertEqual(('2020-01-01', 'ns'), store.start(key, 'report', dt(2020, 1, 3))['last_row'])
+        self.assertEqual(dt(2020, 1, 2), store.get(key)['end'])
+        store.finish(key)
+        self.assertEqual(0, len(store))
+
+    def test_begin_compared_to_the_second(self):
+        self.assertEqual(CheckpointStore.key('report', 'usage_cpu', dt(2020, 1, 1, 0, 0, 0, 250000)),
+                         CheckpointStore.key('report', 'usage_cpu', dt(2020, 1, 1)))
+
+    def test_discard_report(self):
+        store = CheckpointStore()
+        for report_name in ('report', 'other'):
+            store.start(store.key(report_name, 'usage_cpu', dt(2020, 1, 1)), report_name, dt(2020, 1, 2))
+        store.discard('report')
+        self.assertIsNone(store.get(store.key('report', 'usage_cpu', dt(2020, 1, 1))))
+        self.assertIsNotNone(store.get(store.key('other', 'usage_cpu', dt(2020, 1, 1))))
+
+    def test_saved_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoints.json')
+            store = CheckpointStore(path)
+            key = store.key('report', 'usage_cpu', dt(2020, 1, 1))
+            store.start(key, 'report', dt(2020, 1, 2))
+            store.commit(key, ('2020-01-01', 'ns'))
+            self.assertEqual({'report': 'report', 'end': dt(2020, 1, 2), 'last_row': ('2020-01-01', 'ns')},
+                             CheckpointStore(path).get(key))
+
+
+class TestResumeAfterRestart(unittest.TestCase):
+    """Test that a restarted rating resumes after the last committed frame."""
+
+    window_config = {
+        'metric': 'usage_cpu',
+        'report_name': 'report',
+        'presto_table': 'table',
+        'presto_column': 'pod_usage_cpu_core_seconds',
+        'unit': 'core-seconds',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 1, 12)
+    }
+    frame = {'period_start': 'start', 'period_end': 'end', 'namespace': 'ns',
+             'node': 'node', 'pod': 'pod', 'pod_usage_cpu_core_seconds': 3600}
+
+    def frames(self, pods: list) -> list:
+        return [dict(self.frame, pod=f'pod-{pod}') for pod in pods]
+    rules = [{'ruleset': [{'metric': 'usage_cpu', 'value': 1, 'unit': 'core-hours'}]}]
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_BATCH_SIZE': '2',
+                                  'RATING_UPLOAD_RETRIES': '0',
+                                  'RATING_FRAMES_WINDOW': '21600'})
+    @mock.patch.object(rated_metrics, 'get_labels_from_table', return_value=[])
+    def test_resume_from_file(self, _):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoints.json')
+            failure = kopf.TemporaryError('failed', delay=5)
+            with mock.patch.object(checkpoints, 'CHECKPOINTS', CheckpointStore(path)), \
+                 mock.patch.object(rated_metrics, 'get_frames', return_value=self.frames(range(5))), \
+                 mock.patch.object(rated_metrics, 'update_rated_data',
+                                   side_effect=[{}, {}, {}, {}, failure]):
+                with self.assertRaises(kopf.TemporaryError):
+                    rated_metrics.retrieve_data(self.rules, self.window_config, logging.getLogger())
+
+            # A new process, with the second window pinned and pods 0 and 1 committed.
+            # The rating-api returns the frames in another order, with a late one.
+            with mock.patch.object(checkpoints, 'CHECKPOINTS', CheckpointStore(path)), \
+                 mock.patch.object(rated_metrics, 'get_frames', return_value=self.frames([4, 3, 5, 2, 1, 0])), \
+                 mock.patch.object(rated_metrics, 'update_rated_data') as update:
+                resumed = dict(self.window_config, begin=dt(2020, 1, 1, 6))
+                rated_metrics.retrieve_data(self.rules, resumed, logging.getLogger())
+                sent = [[frame[5] for frame in call.args[0]] for call in update.call_args_list]
+                self.assertEqual([['pod-2', 'pod-3'], ['pod-4', 'pod-5']], sent)
+                self.assertEqual(0, len(checkpoints.CHECKPOINTS))
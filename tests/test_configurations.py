@@ -0,0 +1,98 @@
+import os
+import unittest
+from unittest import mock
+
+from rating.manager import cache
+from rating.manager import configurations
+from rating.manager import utils
+
+from rating_api_stub import RatingApiStub
+
+
+def make_configuration(valid_from: str, unit: str = 'core-seconds') -> dict:
+    """Build a configuration as returned by /ratingrules/list/local."""
+    return {
+        'valid_from': valid_from,
+        'valid_to': '4102448460',
+        'metrics': {'metrics': {
+            'usage_cpu': {
+                'report_name': 'pod-cpu-usage-hourly',
+                'presto_table': 'report_metering_pod_cpu_usage_hourly',
+                'presto_column': 'pod_usage_cpu_core_seconds',
+                'unit': unit
+            }
+        }},
+        'rules': {'rules': [{
+            'ruleset': [{'metric': 'usage_cpu', 'value': 0.5, 'unit': 'core-hours'}]
+        }]}
+    }
+
+
+class TestTTLCache(unittest.TestCase):
+    """Test the expiry and eviction of the cache entries."""
+
+    def test_expiry(self):
+        ttl_cache = cache.TTLCache(ttl=10)
+        with mock.patch.object(cache.time, 'monotonic', return_value=100):
+            ttl_cache.set('key', 'value')
+        with mock.patch.object(cache.time, 'monotonic', return_value=109):
+            self.assertEqual('value', ttl_cache.get('key'))
+        with mock.patch.object(cache.time, 'monotonic', return_value=110):
+            self.assertIsNone(ttl_cache.get('key'))
+
+    def test_eviction(self):
+        ttl_cache = cache.TTLCache(ttl=10, maxsize=2)
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2)
+        ttl_cache.get('a')
+        ttl_cache.set('c', 3)
+        self.assertEqual((1, None, 3), (ttl_cache.get('a'), ttl_cache.get('b'), ttl_cache.get('c')))
+        ttl_cache.invalidate('a')
+        self.assertIsNone(ttl_cache.get('a'))
+
+
+class TestConfigurationsCache(unittest.IsolatedAsyncioTestCase):
+    """Test the cache of the rating configurations."""
+
+    def setUp(self):
+        configurations.invalidate()
+        self.stub = RatingApiStub({
+            ('GET', '/ratingrules/list/local'): lambda _: (200, {'results': [make_configuration('0')]})
+        }).__enter__()
+        self.environ = mock.patch.dict(os.environ, {
+            'RATING_API_URL': self.stub.url,
+            'RATING_ADMIN_API_KEY': 'secret'
+        })
+        self.environ.start()
+
+    async def asyncTearDown(self):
+        await utils.close_rating_api_session_async()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.stub.__exit__()
+        configurations.invalidate()
+
+    async def test_cached_until_invalidated(self):
+        first = await configurations.retrieve_configurations()
+        second = await configurations.retrieve_configurations()
+        self.assertIs(first, second)
+        self.assertEqual(1, len(self.stub.requests))
+        configurations.invalidate()
+        await configurations.retrieve_configurations()
+        self.assertEqual(2, len(self.stub.requests))
+
+    def test_memoized_validation(self):
+        configuration = make_configuration('1')
+        with mock.patch.object(configurations.rules, 'ensure_rules_config') as validator:
+            validator.__name__ = 'ensure_rules_config'
+            configurations.ensure_rules_config(configuration)
+            configurations.ensure_rules_config(configuration)
+        self.assertEqual(1, validator.call_count)
+
+    def test_memoized_validation_error(self):
+        configuration = make_configuration('2', unit='pokemon')
+        for _ in range(2):
+            with self.assertRaisesRegex(utils.ConfigurationExceptionError, 'Unsupported unit'):
+                configurations.ensure_metrics_config(configuration)
+        self.assertIn(('ensure_metrics_config', '2'), configurations.VALIDATIONS)
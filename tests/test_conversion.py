@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 
 from rating.manager import rates
 from rating.manager.utils import ConfigurationExceptionError
@@ -42,3 +43,38 @@ class TestConversion(unittest.TestCase):
             rates.convert_metrics_unit(metric_unit,
                                        rating_unit,
                                        qty)
+
+
+class TestBatchRating(unittest.TestCase):
+    """Test that the batch rating gives the same results as the frame by frame one."""
+
+    rules = [
+        {'metric': 'usage_memory', 'value': 0.0014, 'unit': 'GiB-hours'},
+        {'metric': 'usage_memory', 'value': '0.012', 'unit': 'GiB-hours'},
+        {'metric': 'usage_memory', 'value': None, 'unit': 'GiB-hours'}
+    ]
+    quantities = [7e12, 42, 0, 123456789, 3.5, '1024', 2 ** 40, 1e-3, 17]
+
+    def scalar(self, rules: list) -> tuple:
+        converted = [rates.convert_metrics_unit('byte-seconds', rule['unit'], qty)
+                     for rule, qty in zip(rules, self.quantities)]
+        return converted, [rates.rate(rule, {'qty': qty}) for rule, qty in zip(rules, converted)]
+
+    def matched_rules(self) -> list:
+        return [self.rules[idx % len(self.rules)] for idx in range(len(self.quantities))]
+
+    @unittest.skipIf(rates.numpy is None, 'numpy is not installed')
+    def test_vectorized_identical_to_scalar(self):
+        rules = self.matched_rules()
+        self.assertEqual(self.scalar(rules),
+                         rates.rate_batch('byte-seconds', rules, self.quantities))
+
+    def test_without_numpy(self):
+        rules = self.matched_rules()
+        with mock.patch.object(rates, 'numpy', None):
+            self.assertEqual(self.scalar(rules),
+                             rates.rate_batch('byte-seconds', rules, self.quantities))
+
+    def test_batch_wrong_conversion(self):
+        with self.assertRaisesRegex(ConfigurationExceptionError, 'Unsupported key'):
+            rates.rate_batch('core-seconds', self.rules[:1], [1])
@@ -0,0 +1,119 @@
+import unittest
+from unittest import mock
+
+from rating.manager import rated_metrics
+from rating.manager import rules
+from rating.manager import workers
+from rating.manager.frames import FrameBatch, LabelProjection, RatedFrames, label_projection
+
+
+class TestFrameBatch(unittest.TestCase):
+    """Test the columnar storage of frames."""
+
+    frames = [{
+        'period_start': f'2020-01-01 0{idx % 2}:00:00',
+        'period_end': f'2020-01-01 0{idx % 2 + 1}:00:00',
+        'namespace': f'ns-{idx % 3}',
+        'node': 'node-1',
+        'pod': f'pod-{idx}',
+        'pod_usage_cpu_core_seconds': idx * 10,
+        'instance_type': 'small' if idx % 2 else 'large'
+    } for idx in range(6)]
+
+    def test_dictionary_encoding(self):
+        batch = FrameBatch.from_frames(self.frames, 'pod_usage_cpu_core_seconds', ['instance_type'])
+        self.assertEqual(6, len(batch))
+        self.assertEqual(3, len(batch.dictionaries['namespace']))
+        self.assertEqual(1, len(batch.dictionaries['node']))
+        self.assertEqual([frame['pod'] for frame in self.frames], batch.values('pod'))
+        self.assertEqual({'instance_type': 'small'}, batch.labels(1))
+        self.assertEqual([0.0, 10.0, 20.0, 30.0, 40.0, 50.0], list(batch.quantities))
+
+    def test_missing_label(self):
+        batch = FrameBatch.from_frames(self.frames, 'pod_usage_cpu_core_seconds', ['zone'])
+        self.assertEqual({'zone': None}, batch.labels(0))
+
+    def test_rated_frames_as_tuples(self):
+        batch = FrameBatch.from_frames(self.frames, 'pod_usage_cpu_core_seconds', [])
+        rated_frames = RatedFrames(batch, 'usage_cpu')
+        for index in range(len(batch)):
+            rated_frames.append(index / 2, None if index == 5 else index * 2.0, "{'a': 'b'}")
+        self.assertEqual(6, len(rated_frames))
+        self.assertEqual(('2020-01-01 01:00:00', '2020-01-01 02:00:00', 'ns-1', 'node-1',
+                          'usage_cpu', 'pod-1', 0.5, 2.0, "{'a': 'b'}"), rated_frames[1:2][0])
+        self.assertEqual([4, 5], [row[6] * 2 for row in rated_frames[4:]])
+        self.assertIsNone(rated_frames[5:][0][7])
+        self.assertEqual(1, len(rated_frames.labelsets))
+
+
+class TestLabelsInterning(unittest.TestCase):
+    """Test that labels are matched and serialized once per combination."""
+
+    frames = TestFrameBatch.frames
+    metric_config = {'metric': 'usage_cpu', 'unit': 'core-seconds'}
+
+    def test_combinations_interned(self):
+        batch = FrameBatch.from_frames(self.frames, 'pod_usage_cpu_core_seconds', ['instance_type'])
+        self.assertEqual([('large',), ('small',)], batch.labelsets.values)
+        self.assertEqual([0, 1, 0, 1, 0, 1], list(batch.labelset_codes))
+
+    def test_matched_once_per_combination(self):
+        matcher = rules.compile_rules([
+            {'labelSet': {'instance_type': 'small'},
+             'ruleset': [{'metric': 'usage_cpu', 'value': 2, 'unit': 'core-hours'}]},
+            {'ruleset': [{'metric': 'usage_cpu', 'value': 1, 'unit': 'core-hours'}]}
+        ])
+        batch = FrameBatch.from_frames(self.frames, 'pod_usage_cpu_core_seconds', ['instance_type'])
+        matches = {}
+        with mock.patch.object(matcher, 'find_match', wraps=matcher.find_match) as find_match:
+            rated_frames = workers.rate_frames(batch, matcher, self.metric_config, matches)
+            workers.rate_frames(batch, matcher, self.metric_config, matches)
+        self.assertEqual(2, find_match.call_count)
+        self.assertEqual(["{}", "{'instance_type': 'small'}"], rated_frames.labelsets.values)
+        self.assertEqual([0.0, 2.0 * (10 / 3600), 20 / 3600], [row[7] for row in rated_frames[0:3]])
+
+
+class TestLabelProjection(unittest.TestCase):
+    """Test the projection of frames onto their labels columns."""
+
+    columns = ('period_start', 'period_end', 'namespace', 'node', 'pod',
+               'pod_usage_cpu_core_seconds', 'instance_type', 'storage_type')
+    frame = {
+        'period_start': '2020-01-01 00:00:00',
+        'period_end': '2020-01-01 01:00:00',
+        'namespace': 'ns',
+        'node': 'node-1',
+        'pod': 'pod-1',
+        'pod_usage_cpu_core_seconds': 10,
+        'instance_type': 'small',
+        'storage_type': 'ssd'
+    }
+
+    def test_labels_columns(self):
+        projection = LabelProjection(self.columns, 'pod_usage_cpu_core_seconds')
+        self.assertEqual(('instance_type', 'storage_type'), projection.names)
+        self.assertEqual(('small', 'ssd'), projection.values(self.frame))
+        self.assertEqual({'instance_type': 'small', 'storage_type': 'ssd'},
+                         projection.extract(self.frame))
+
+    def test_single_and_missing_labels(self):
+        single = LabelProjection(self.columns[:7], 'pod_usage_cpu_core_seconds')
+        self.assertEqual(('small',), single.values(self.frame))
+        projection = LabelProjection(self.columns, 'pod_usage_cpu_core_seconds')
+        self.assertEqual(('small', None), projection.values({'instance_type': 'small'}))
+        self.assertEqual((), LabelProjection(self.columns[:6], 'pod_usage_cpu_core_seconds').values(self.frame))
+
+    def test_computed_once_per_schema(self):
+        self.assertIs(label_projection(self.columns, 'pod_usage_cpu_core_seconds'),
+                      label_projection(self.columns, 'pod_usage_cpu_core_seconds'))
+
+    def test_shared_by_labels_helpers(self):
+        rated_metrics.SCHEMAS.invalidate()
+        with mock.patch('rating.manager.utils.get_from_rating_api',
+                        return_value=[{'column_name': column} for column in self.columns]):
+            labels = rated_metrics.get_labels_from_table('table', 'pod_usage_cpu_core_seconds')
+        self.assertEqual(['instance_type', 'storage_type'], labels)
+        self.assertEqual({'instance_type': 'small'},
+                         rated_metrics.extract_frames_labels(self.frame,
+                                                             'pod_usage_cpu_core_seconds',
+                                                             ['instance_type', 'namespace']))
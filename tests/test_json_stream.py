@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+import unittest
+from unittest import mock
+
+import kopf
+
+from rating.manager import utils
+
+from rating_api_stub import start_rating_api_stub
+
+
+def chunked(data: bytes, size: int) -> list:
+    """Split data in chunks of size bytes."""
+    return [data[idx:idx + size] for idx in range(0, len(data), size)]
+
+
+class TestJsonArrayStream(unittest.TestCase):
+    """Test the incremental decoding of the results array."""
+
+    body = {
+        'total': 12345,
+        'meta': {'columns': ['a', 'b'], 'nested': [1, [2, 3]]},
+        'results': [{'pod': f'pod-é{idx}', 'quantity': idx * 1000.25, 'ok': idx % 2 == 0,
+                     'labels': None} for idx in range(20)],
+        'after': 'ignored'
+    }
+
+    def test_any_chunking(self):
+        data = json.dumps(self.body, indent=1, ensure_ascii=False).encode('utf-8')
+        for size in (1, 2, 3, 7, 64, len(data)):
+            self.assertEqual(self.body['results'],
+                             list(utils.iter_json_array(chunked(data, size))), size)
+
+    def test_numbers_split_between_chunks(self):
+        data = b'{"results": [1234567, 89.5e3, -0.25], "count": 2}'
+        for size in range(1, 8):
+            self.assertEqual([1234567, 89500.0, -0.25],
+                             list(utils.iter_json_array(chunked(data, size))), size)
+
+    def test_missing_or_empty_results(self):
+        self.assertEqual([], list(utils.iter_json_array([b'{}'])))
+        self.assertEqual([], list(utils.iter_json_array([b'{"results": []}'])))
+        self.assertEqual([], list(utils.iter_json_array([b'{"results": {"a": 1}, "b": 2}'])))
+
+    def test_items_yielded_before_the_end(self):
+        chunks = iter([b'{"results": [{"a": 1}, ', b'{"a": 2}'])
+        items = utils.iter_json_array(chunks)
+        self.assertEqual({'a': 1}, next(items))
+        self.assertEqual({'a': 2}, next(items))
+        with self.assertRaises(json.JSONDecodeError):
+            next(items)
+
+    def test_invalid_body(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(utils.iter_json_array([b'[1, 2]']))
+
+
+class TestStreamedFrames(unittest.TestCase):
+    """Test the streamed GET requests, against a stand-in rating-api."""
+
+    frames = [{'namespace': f'ns-{idx}', 'quantity': idx} for idx in range(500)]
+
+    def setUp(self):
+        self.stub = start_rating_api_stub(self)
+
+    def test_gzip_response(self):
+        body = gzip.compress(json.dumps({'results': self.frames}).encode('utf-8'))
+        self.stub.routes[('GET', '/presto/table/frames')] = \
+            lambda _: (200, body, {'content-encoding': 'gzip'})
+        frames = list(utils.iter_from_rating_api(endpoint='/presto/table/frames',
+                                                 payload={'column': 'quantity'}))
+        self.assertEqual(self.frames, frames)
+        request = self.stub.requests[0]
+        headers = {name.lower(): value for name, value in request['headers'].items()}
+        self.assertIn('gzip', headers['accept-encoding'])
+        self.assertEqual(['secret'], request['params']['token'])
+
+    def test_errors_are_temporary(self):
+        self.stub.routes[('GET', '/presto/table/frames')] = lambda _: (200, b'{"results": [{')
+        with self.assertRaises(kopf.TemporaryError):
+            list(utils.iter_from_rating_api(endpoint='/presto/table/frames', payload={}))
+        self.stub.routes[('GET', '/presto/table/frames')] = lambda _: (404, {})
+        with self.assertRaises(kopf.TemporaryError):
+            list(utils.iter_from_rating_api(endpoint='/presto/table/frames', payload={}))
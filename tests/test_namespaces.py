@@ -0,0 +1,84 @@
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from rating.manager import main
+from rating.manager import utils
+
+from rating_api_stub import start_rating_api_stub
+
+
+def fake_namespace(name: str, labels: dict = None) -> SimpleNamespace:
+    """Mimic a V1Namespace of the kubernetes client."""
+    return SimpleNamespace(metadata=SimpleNamespace(name=name,
+                                                    labels=labels,
+                                                    annotations=None))
+
+
+class FakeCoreV1Api:
+    """Mimic the CoreV1Api of the kubernetes client, for namespaces."""
+
+    def __init__(self, namespaces: list):
+        self.namespaces = namespaces
+        self.calls = []
+
+    def list_namespace(self, limit: int = None, _continue: str = None):
+        self.calls.append((limit, _continue))
+        start = int(_continue or 0)
+        end = start + limit
+        token = str(end) if end < len(self.namespaces) else None
+        return SimpleNamespace(items=self.namespaces[start:end],
+                               metadata=SimpleNamespace(_continue=token))
+
+
+class TestNamespacesRegistration(unittest.IsolatedAsyncioTestCase):
+    """Test the registration of the namespaces tenants at startup."""
+
+    namespaces = [fake_namespace(f'ns-{idx}', {'tenant': f'tenant-{idx % 4}'} if idx % 2 else None)
+                  for idx in range(25)]
+
+    def setUp(self):
+        self.stub = start_rating_api_stub(self, {'RATING_NAMESPACES_BATCH_SIZE': '10',
+                                                 'RATING_NAMESPACES_PAGE_SIZE': '1000'})
+        main.BULK_TENANTS = True
+
+    async def asyncTearDown(self):
+        await utils.close_rating_api_session_async()
+
+    def test_namespace_tenants(self):
+        self.assertEqual([{'tenant_id': 'default', 'namespace': 'ns'}],
+                         main.namespace_tenants({'name': 'ns'}))
+        self.assertEqual([{'tenant_id': 'default', 'namespace': 'ns'},
+                          {'tenant_id': 'a', 'namespace': 'ns'}],
+                         main.namespace_tenants({'name': 'ns', 'labels': {'tenant': 'a'}}))
+
+    async def test_bulk_registration(self):
+        self.stub.routes[('POST', '/namespaces/tenants')] = lambda _: (200, {'results': 'ok'})
+        await main.scan_cluster_namespaces(FakeCoreV1Api(self.namespaces))
+        self.assertEqual(['/namespaces/tenants'] * 4,
+                         [request['path'] for request in self.stub.requests])
+        registered = [pair for request in self.stub.requests
+                      for pair in json.loads(request['raw'])['namespaces']]
+        self.assertEqual(37, len(registered))
+        self.assertEqual({'tenant_id': 'default', 'namespace': 'ns-0'}, registered[0])
+
+    async def test_fallback_without_bulk_endpoint(self):
+        self.stub.routes[('POST', '/namespaces/tenant')] = lambda _: (200, {'results': 'ok'})
+        await main.scan_cluster_namespaces(FakeCoreV1Api(self.namespaces))
+        paths = [request['path'] for request in self.stub.requests]
+        self.assertEqual(1, paths.count('/namespaces/tenants'))
+        self.assertEqual(37, paths.count('/namespaces/tenant'))
+        self.assertFalse(main.BULK_TENANTS)
+
+    async def test_paginated_listing(self):
+        self.stub.routes[('POST', '/namespaces/tenants')] = lambda _: (200, {'results': 'ok'})
+        api = FakeCoreV1Api(self.namespaces)
+        with mock.patch.dict(os.environ, {'RATING_NAMESPACES_PAGE_SIZE': '10'}):
+            await main.scan_cluster_namespaces(api)
+        self.assertEqual([(10, None), (10, '10'), (10, '20')], api.calls)
+        registered = [pair['namespace'] for request in self.stub.requests
+                      for pair in json.loads(request['raw'])['namespaces']]
+        self.assertEqual(37, len(registered))
+        self.assertEqual({f'ns-{idx}' for idx in range(25)}, set(registered))
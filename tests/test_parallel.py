@@ -0,0 +1,64 @@
+import os
+import unittest
+from unittest import mock
+
+from rating.manager import workers
+from rating.manager.frames import FrameBatch
+from rating.manager.rules import compile_rules
+
+
+class TestParallelRating(unittest.TestCase):
+    """Test that frames rated by worker processes match the serial rating."""
+
+    rules = [
+        {'labelSet': {'instance_type': 'small'},
+         'ruleset': [{'metric': 'usage_cpu', 'value': 2, 'unit': 'core-hours'}]},
+        {'labelSet': {'instance_type': 'large'},
+         'ruleset': [{'metric': 'usage_cpu', 'value': 4, 'unit': 'core-hours'}]},
+        {'ruleset': [{'metric': 'usage_cpu', 'value': 1, 'unit': 'core-hours'}]}
+    ]
+    metric_config = {'metric': 'usage_cpu', 'unit': 'core-seconds'}
+
+    def tearDown(self):
+        workers.close_rating_executor()
+
+    def batch(self) -> FrameBatch:
+        return FrameBatch.from_frames(({
+            'period_start': '2020-01-01 00:00:00',
+            'period_end': '2020-01-01 01:00:00',
+            'namespace': f'ns-{idx % 7}',
+            'node': 'node-1',
+            'pod': f'pod-{idx}',
+            'pod_usage_cpu_core_seconds': idx,
+            'instance_type': ('small', 'large', 'medium')[idx % 3]
+        } for idx in range(1000)), 'pod_usage_cpu_core_seconds', ['instance_type'])
+
+    @mock.patch.dict(os.environ, {'RATING_WORKERS': '3',
+                                  'RATING_PARALLEL_MIN_FRAMES': '100'})
+    def test_same_result_as_serial(self):
+        batch = self.batch()
+        serial = workers.rate_frames(batch,
+                                           compile_rules(self.rules),
+                                           self.metric_config)
+        parallel = workers.RatingPool(self.rules).rate(batch, self.metric_config)
+        self.assertEqual(serial[:], parallel[:])
+
+    @mock.patch.dict(os.environ, {'RATING_WORKERS': '2',
+                                  'RATING_PARALLEL_MIN_FRAMES': '100'})
+    def test_workers_shared_across_rulesets(self):
+        batch = self.batch()
+        cheaper = [dict(rule, ruleset=[dict(rule['ruleset'][0], value=1)]) for rule in self.rules]
+        first = workers.RatingPool(self.rules).rate(batch, self.metric_config)
+        executor = workers.rating_executor(2)
+        second = workers.RatingPool(cheaper).rate(batch, self.metric_config)
+        self.assertIs(executor, workers.rating_executor(2))
+        # Each ruleset is rated with its own compiled rules
+        self.assertEqual(2 * second[3:4][0][7], first[3:4][0][7])
+        self.assertNotEqual(workers.rules_digest(self.rules), workers.rules_digest(cheaper))
+
+    @mock.patch.dict(os.environ, {'RATING_WORKERS': '3',
+                                  'RATING_PARALLEL_MIN_FRAMES': '5000'})
+    def test_small_batches_rated_in_process(self):
+        rated = workers.RatingPool(self.rules).rate(self.batch(), self.metric_config)
+        self.assertIsNone(workers._EXECUTOR)
+        self.assertEqual(1000, len(rated))
@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import unittest
+from datetime import datetime as dt, timedelta
+from unittest import mock
+
+import kopf
+
+from rating.manager import checkpoints
+from rating.manager import pipeline
+from rating.manager import rated_metrics
+
+
+class TestPrefetch(unittest.TestCase):
+    """Test the stages of the pipeline."""
+
+    def test_items_in_order(self):
+        self.assertEqual(list(range(100)), list(pipeline.prefetch(iter(range(100)), 3)))
+
+    def test_errors_raised_to_consumer(self):
+        def failing():
+            yield 1
+            raise ValueError('failed')
+        items = pipeline.prefetch(failing(), 1)
+        self.assertEqual(1, next(items))
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_bounded_and_closed_early(self):
+        produced = []
+        closed = threading.Event()
+
+        def endless():
+            try:
+                while True:
+                    produced.append(len(produced))
+                    yield produced[-1]
+            finally:
+                closed.set()
+        items = pipeline.prefetch(endless(), 2)
+        self.assertEqual(0, next(items))
+        threading.Event().wait(0.2)
+        # One item consumed, two queued, one waiting for room
+        self.assertLessEqual(len(produced), 4)
+        items.close()
+        self.assertTrue(closed.is_set())
+
+
+class TestPipelinedRating(unittest.TestCase):
+    """Test that windows are loaded while the previous ones are sent."""
+
+    metric_config = {
+        'metric': 'usage_cpu',
+        'report_name': 'report',
+        'presto_table': 'table',
+        'presto_column': 'pod_usage_cpu_core_seconds',
+        'unit': 'core-seconds',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 5)
+    }
+    rules = [{'ruleset': [{'metric': 'usage_cpu', 'value': 1, 'unit': 'core-hours'}]}]
+
+    def setUp(self):
+        checkpoints.CHECKPOINTS.discard()
+        self.fetched = []
+        patchers = [
+            mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '86400',
+                                         'RATING_FETCH_CONCURRENCY': '1',
+                                         'RATING_UPLOAD_RETRIES': '0',
+                                         'RATING_PIPELINE_DEPTH': '1'}),
+            mock.patch.object(rated_metrics, 'get_labels_from_table', return_value=[]),
+            mock.patch.object(rated_metrics, 'get_frames', side_effect=self.get_frames)
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_frames(self, window_config: dict, _) -> list:
+        self.fetched.append(window_config['begin'])
+        return [{'period_start': window_config['begin'].isoformat(), 'period_end': 'end',
+                 'namespace': 'ns', 'node': 'node', 'pod': 'pod',
+                 'pod_usage_cpu_core_seconds': 3600}]
+
+    def test_loaded_while_sending(self):
+        third_window = threading.Event()
+        sent = []
+
+        def update_rated_data(rated_frames, rated_namespaces, metric_config, timestamp, logger):
+            if not sent:
+                # Only returns once the next windows are loaded meanwhile
+                self.assertTrue(third_window.wait(timeout=5))
+            sent.append(rated_frames[0][0])
+            return {}
+
+        def get_frames(window_config, labels):
+            frames = self.get_frames(window_config, labels)
+            if window_config['begin'] == dt(2020, 1, 3):
+                third_window.set()
+            return frames
+        with mock.patch.object(rated_metrics, 'get_frames', side_effect=get_frames), \
+             mock.patch.object(rated_metrics, 'update_rated_data', side_effect=update_rated_data):
+            rated_metrics.retrieve_data(self.rules, self.metric_config, logging.getLogger())
+        self.assertEqual([(dt(2020, 1, 1) + timedelta(days=day)).isoformat() for day in range(4)],
+                         sent)
+
+    def test_failed_upload_stops_the_stages(self):
+        threads = threading.active_count()
+        with mock.patch.object(rated_metrics, 'update_rated_data',
+                               side_effect=kopf.TemporaryError('failed')):
+            try:
+                rated_metrics.retrieve_data(self.rules,
+                                            dict(self.metric_config, end=dt(2020, 2, 1)),
+                                            logging.getLogger())
+                self.fail('TemporaryError not raised')
+            except kopf.TemporaryError:
+                # The traceback still holds the stages, both must be stopped already
+                self.assertEqual(threads, threading.active_count())
+        # Bounded by the queues: one window sent, one per stage and per queue
+        self.assertLessEqual(len(self.fetched), 5)
+
+    @mock.patch.dict(os.environ, {'RATING_PIPELINE_DEPTH': '0'})
+    def test_sequential(self):
+        threads = set()
+        with mock.patch.object(rated_metrics, 'update_rated_data',
+                               side_effect=lambda *_: threads.add(threading.current_thread())), \
+             mock.patch.object(rated_metrics, 'get_frames',
+                               side_effect=lambda *args: threads.add(threading.current_thread())
+                               or self.get_frames(*args)):
+            rated_metrics.retrieve_data(self.rules, self.metric_config, logging.getLogger())
+        self.assertEqual(4, len(self.fetched))
+        self.assertEqual({threading.current_thread()}, threads)
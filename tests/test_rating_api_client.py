@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import unittest
+from unittest import mock
+
+import kopf
+
+from rating.manager import rating_rules
+from rating.manager import utils
+
+from rating_api_stub import start_rating_api_stub
+
+
+class TestRatingApiClient(unittest.TestCase):
+    """Test the HTTP client shared by the rating-api calls."""
+
+    def setUp(self):
+        self.stub = start_rating_api_stub(self)
+
+    def test_connections_are_reused(self):
+        self.stub.routes[('GET', '/ratingrules/list/local')] = lambda _: (200, {'results': [1]})
+        self.stub.routes[('POST', '/namespaces/tenant')] = lambda _: (200, {'results': 'ok'})
+        for _ in range(10):
+            self.assertEqual([1], utils.get_from_rating_api(endpoint='/ratingrules/list/local'))
+            utils.post_for_rating_api(endpoint='/namespaces/tenant', payload={})
+        clients = {request['client'] for request in self.stub.requests}
+        self.assertEqual(20, len(self.stub.requests))
+        self.assertEqual(1, len(clients))
+        self.assertIs(utils.rating_api_session(), utils.rating_api_session())
+
+    def test_get_retried_on_gateway_error(self):
+        responses = iter([(503, {}), (200, {'results': [42]})])
+        self.stub.routes[('GET', '/reports/test/last_rated')] = lambda _: next(responses)
+        self.assertEqual([42], utils.get_from_rating_api(endpoint='/reports/test/last_rated'))
+        self.assertEqual(2, len(self.stub.requests))
+
+    def test_post_not_retried_on_server_error(self):
+        self.stub.routes[('POST', '/rated/frames/add')] = lambda _: (503, {})
+        with self.assertRaises(kopf.TemporaryError):
+            utils.post_for_rating_api(endpoint='/rated/frames/add', payload={})
+        self.assertEqual(1, len(self.stub.requests))
+
+
+class TestAsyncRatingApiClient(unittest.IsolatedAsyncioTestCase):
+    """Test the asynchronous client of the rating-api."""
+
+    def setUp(self):
+        self.stub = start_rating_api_stub(self, {'RATING_NAMESPACE': 'rating'})
+
+    async def asyncTearDown(self):
+        await utils.close_rating_api_session_async()
+
+    async def test_get_and_post(self):
+        self.stub.routes[('GET', '/ratingrules/list/local')] = lambda _: (200, {'results': [1]})
+        self.stub.routes[('POST', '/namespaces/tenant')] = lambda _: (200, {'results': 'ok'})
+        results = await utils.get_from_rating_api_async(endpoint='/ratingrules/list/local')
+        response = await utils.post_for_rating_api_async(endpoint='/namespaces/tenant',
+                                                         payload={'namespace': 'default'})
+        self.assertEqual([1], results)
+        self.assertEqual({'results': 'ok'}, response)
+        self.assertEqual({'token': ['secret']}, self.stub.requests[0]['params'])
+        self.assertIn(b'"token": "secret"', self.stub.requests[1]['raw'])
+
+    async def test_concurrent_requests(self):
+        self.stub.routes[('POST', '/namespaces/tenant')] = lambda _: (200, {'results': 'ok'})
+        await asyncio.gather(*(
+            utils.post_for_rating_api_async(endpoint='/namespaces/tenant', payload={})
+            for _ in range(50)
+        ))
+        self.assertEqual(50, len(self.stub.requests))
+
+    async def test_errors(self):
+        self.stub.routes[('POST', '/ratingrules/add')] = lambda _: (400, b'invalid rules')
+        self.stub.routes[('GET', '/reports/test/last_rated')] = lambda _: (500, {})
+        with self.assertRaisesRegex(utils.ConfigurationExceptionError, 'invalid rules'):
+            await utils.post_for_rating_api_async(endpoint='/ratingrules/add', payload={})
+        with self.assertRaises(utils.ApiExceptionError):
+            await utils.post_for_rating_api_async(endpoint='/ratingrules/update', payload={})
+        with self.assertRaises(kopf.TemporaryError):
+            await utils.get_from_rating_api_async(endpoint='/reports/test/last_rated')
+
+    async def test_async_handler_in_namespace(self):
+        self.stub.routes[('POST', '/ratingrules/delete')] = lambda _: (200, {})
+        body = {'metadata': {'namespace': 'rating',
+                             'name': 'rules',
+                             'creationTimestamp': '2020-01-01T00:00:00Z'}}
+        self.assertTrue(asyncio.iscoroutinefunction(rating_rules.rating_rules_deletion_smile))
+        await rating_rules.rating_rules_deletion_smile(body=body,
+                                                       spec={},
+                                                       logger=logging.getLogger())
+        await rating_rules.rating_rules_deletion_smile(body={'metadata': {'namespace': 'other'}},
+                                                       spec={},
+                                                       logger=logging.getLogger())
+        self.assertEqual(['/ratingrules/delete'],
+                         [request['path'] for request in self.stub.requests])
@@ -0,0 +1,87 @@
+import logging
+import os
+import unittest
+from datetime import datetime as dt
+from unittest import mock
+
+from rating.manager import rated_metrics
+from rating.manager import reports
+from rating.manager.configurations import ConfigurationTimeline
+
+
+def make_configuration(valid_from: dt, valid_to: dt, price: float) -> dict:
+    """Build a configuration rating the usage_cpu metric at the given price."""
+    return {
+        'valid_from': str(int((valid_from - dt(1970, 1, 1)).total_seconds())),
+        'valid_to': str(int((valid_to - dt(1970, 1, 1)).total_seconds())),
+        'metrics': {'metrics': {
+            'usage_cpu': {
+                'report_name': 'pod-cpu-usage-hourly',
+                'presto_table': 'report_metering_pod_cpu_usage_hourly',
+                'presto_column': 'pod_usage_cpu_core_seconds',
+                'unit': 'core-seconds'
+            }
+        }},
+        'rules': {'rules': [{
+            'ruleset': [{'metric': 'usage_cpu', 'value': price, 'unit': 'core-hours'}]
+        }]}
+    }
+
+
+class TestRatingPeriods(unittest.TestCase):
+    """Test the rating of a period spanning several configurations."""
+
+    timeline = ConfigurationTimeline([
+        make_configuration(dt(2020, 1, 1), dt(2020, 2, 1), 1),
+        make_configuration(dt(2020, 2, 1), dt(2020, 3, 1), 2),
+        make_configuration(dt(2020, 3, 1), dt(2020, 3, 1), 3)
+    ])
+
+    def test_split_at_configuration_boundaries(self):
+        periods = reports.split_rating_period('pod-cpu-usage-hourly',
+                                              'report-metering-pod-cpu-usage-hourly',
+                                              dt(2020, 1, 15),
+                                              self.timeline)
+        bounds = [(metric_config['begin'], metric_config['end'])
+                  for _, metric_config in periods]
+        self.assertEqual((dt(2020, 1, 15), dt(2020, 2, 1)), bounds[0])
+        self.assertEqual((dt(2020, 2, 1), dt(2020, 3, 1)), bounds[1])
+        self.assertEqual(dt(2020, 3, 1), bounds[2][0])
+        self.assertEqual([1, 2, 3], [configuration['rules']['rules'][0]['ruleset'][0]['value']
+                                     for configuration, _ in periods])
+        self.assertEqual('report_metering_pod_cpu_usage_hourly',
+                         periods[0][1]['presto_table'])
+
+    def test_unknown_report(self):
+        self.assertEqual([], reports.split_rating_period('unknown', 'table',
+                                                         dt(2020, 1, 15),
+                                                         self.timeline))
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '0'})
+    def test_each_period_rated_with_its_rules(self):
+        periods = reports.split_rating_period('pod-cpu-usage-hourly',
+                                              'report-metering-pod-cpu-usage-hourly',
+                                              dt(2020, 1, 15),
+                                              self.timeline)
+
+        def get_frames(window_config: dict, labels: str) -> list:
+            return [{
+                'period_start': window_config['begin'].isoformat(),
+                'period_end': window_config['begin'].isoformat(),
+                'namespace': 'ns',
+                'node': 'node',
+                'pod': 'pod',
+                'pod_usage_cpu_core_seconds': 3600
+            }]
+
+        with mock.patch.object(rated_metrics, 'get_labels_from_table', return_value=[]) as labels, \
+             mock.patch.object(rated_metrics, 'get_frames', side_effect=get_frames), \
+             mock.patch.object(rated_metrics, 'update_rated_data') as update:
+            rated_metrics.retrieve_periods([(configuration['rules']['rules'], metric_config)
+                                            for configuration, metric_config in periods],
+                                           logging.getLogger())
+        self.assertEqual(1, labels.call_count)
+        ratings = [(call.args[0][0][0], call.args[0][0][7]) for call in update.call_args_list]
+        self.assertEqual([('2020-01-15T00:00:00', 1.0),
+                          ('2020-02-01T00:00:00', 2.0),
+                          ('2020-03-01T00:00:00', 3.0)], ratings)
@@ -0,0 +1,102 @@
+import random
+import unittest
+
+from rating.manager import rules
+
+import yaml
+
+
+class TestRuleMatcher(unittest.TestCase):
+    """Test that the compiled matcher behaves like the linear find_match."""
+
+    rules = yaml.safe_load("""
+        -
+            labelSet:
+                instance_type: small
+            ruleset:
+            -
+                metric: request_cpu
+                value: 0.00075
+                unit: core-hours
+            -
+                metric: usage_cpu
+                value: 0.0015
+                unit: core-hours
+        -
+            labelSet:
+                instance_type: small
+                storage_type: ssd
+            ruleset:
+            -
+                metric: usage_cpu
+                value: 0.003
+                unit: core-hours
+        -
+            labelSet:
+                storage_type: ssd
+            ruleset:
+            -
+                metric: request_cpu
+                value: 0.0005
+                unit: core-hours
+        -
+            ruleset:
+            -
+                metric: request_cpu
+                value: 0.0001
+                unit: core-hours
+        -
+            ruleset:
+            -
+                metric: usage_cpu
+                value: 0.0002
+                unit: core-hours
+    """)
+
+    def test_first_match_wins(self):
+        matcher = rules.compile_rules(self.rules)
+        labelset, rule = matcher.find_match('usage_cpu', {
+            'instance_type': 'small',
+            'storage_type': 'ssd'
+        })
+        self.assertEqual({'instance_type': 'small'}, labelset)
+        self.assertEqual(0.0015, rule['value'])
+
+    def test_later_group_wins_over_default(self):
+        matcher = rules.compile_rules(self.rules)
+        labelset, rule = matcher.find_match('request_cpu', {
+            'instance_type': 'medium',
+            'storage_type': 'ssd'
+        })
+        self.assertEqual({'storage_type': 'ssd'}, labelset)
+        self.assertEqual(0.0005, rule['value'])
+
+    def test_no_match(self):
+        matcher = rules.compile_rules(self.rules)
+        self.assertEqual(({}, {}), matcher.find_match('nothing', {}))
+        self.assertEqual(({}, {}), rules.compile_rules([]).find_match('usage_cpu', {}))
+
+    def test_same_result_as_linear_scan(self):
+        generator = random.Random(42)
+        keys = ['instance_type', 'storage_type', 'gpu_accel', 'zone']
+        values = ['a', 'b', 'c']
+        metrics = ['request_cpu', 'usage_cpu', 'usage_memory']
+        ruleset = []
+        for idx in range(50):
+            labelset = {key: generator.choice(values)
+                        for key in generator.sample(keys, generator.randint(0, 3))}
+            ruleset.append({
+                'labelSet': labelset,
+                'ruleset': [{
+                    'metric': metric,
+                    'value': idx,
+                    'unit': 'core-hours'
+                } for metric in generator.sample(metrics, generator.randint(1, 3))]
+            })
+        matcher = rules.compile_rules(ruleset)
+        for _ in range(2000):
+            metric = generator.choice(metrics)
+            frame_labels = {key: generator.choice(values)
+                            for key in generator.sample(keys, generator.randint(0, 4))}
+            self.assertEqual(rules.find_match(metric, frame_labels, ruleset),
+                             matcher.find_match(metric, frame_labels))
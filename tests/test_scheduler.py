@@ -0,0 +1,260 @@
+import asyncio
+import unittest
+from datetime import datetime as dt
+from unittest import mock
+
+from rating.manager import reports
+from rating.manager.scheduler import EventCoalescer, RatingScheduler
+
+
+class TestRatingScheduler(unittest.IsolatedAsyncioTestCase):
+    """Test the concurrency limit, the fairness and the coalescing of ratings."""
+
+    def setUp(self):
+        self.started = []
+        self.release = {}
+
+    def job(self, report_name: str):
+        async def rate():
+            self.started.append(report_name)
+            self.release[report_name] = asyncio.Event()
+            await self.release[report_name].wait()
+            return report_name
+        return rate
+
+    async def test_global_limit(self):
+        scheduler = RatingScheduler(limit=2)
+        futures = [scheduler.submit(f'report-{idx}', f'table-{idx}', self.job(f'report-{idx}'))
+                   for idx in range(4)]
+        await asyncio.sleep(0)
+        self.assertEqual(['report-0', 'report-1'], self.started)
+        self.assertEqual((2, 2), (scheduler.running, scheduler.waiting))
+        self.release['report-0'].set()
+        self.assertEqual('report-0', await futures[0])
+        await asyncio.sleep(0)
+        self.assertEqual(['report-0', 'report-1', 'report-2'], self.started)
+        for report_name in ('report-1', 'report-2', 'report-3'):
+            self.release[report_name].set()
+            await futures[int(report_name[-1])]
+
+    async def test_tables_take_turns(self):
+        scheduler = RatingScheduler(limit=1)
+        scheduler.submit('a-1', 'table-a', self.job('a-1'))
+        for report_name, table_name in (('a-2', 'table-a'), ('a-3', 'table-a'),
+                                        ('b-1', 'table-b'), ('c-1', 'table-c')):
+            scheduler.submit(report_name, table_name, self.job(report_name))
+        for _ in range(5):
+            await asyncio.sleep(0)
+            self.release[self.started[-1]].set()
+            await asyncio.sleep(0)
+        self.assertEqual(['a-1', 'a-2', 'b-1', 'c-1', 'a-3'], self.started)
+
+    async def test_duplicate_events_coalesced(self):
+        scheduler = RatingScheduler(limit=1)
+        running = scheduler.submit('busy', 'table', self.job('busy'))
+        waiting = scheduler.submit('report', 'table', self.job('stale'))
+        self.assertIs(waiting, scheduler.submit('report', 'table', self.job('report')))
+        await asyncio.sleep(0)
+        self.release['busy'].set()
+        await running
+        await asyncio.sleep(0)
+        self.release['report'].set()
+        self.assertEqual('report', await waiting)
+        self.assertEqual(['busy', 'report'], self.started)
+
+    async def test_events_during_run_rerun_once(self):
+        scheduler = RatingScheduler(limit=2)
+        running = scheduler.submit('report', 'table', self.job('report'))
+        await asyncio.sleep(0)
+        rerun = scheduler.submit('report', 'table', self.job('stale'))
+        self.assertIsNot(running, rerun)
+        self.assertIs(rerun, scheduler.submit('report', 'table', self.job('latest')))
+        self.assertEqual((1, 1), (scheduler.running, scheduler.waiting))
+        self.release['report'].set()
+        self.assertEqual('report', await running)
+        await asyncio.sleep(0)
+        self.assertEqual(['report', 'latest'], self.started)
+        self.release['latest'].set()
+        self.assertEqual('latest', await rerun)
+        self.assertEqual((0, 0), (scheduler.running, scheduler.waiting))
+
+    async def test_errors_reach_every_event(self):
+        scheduler = RatingScheduler(limit=1)
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise ValueError('failed')
+        first = scheduler.submit('report', 'table', fail)
+        second = scheduler.submit('report', 'table', fail)
+        for future in (first, second):
+            with self.assertRaises(ValueError):
+                await future
+        self.assertEqual(0, scheduler.running)
+
+    def event(self, hour: int) -> dict:
+        return {'body': {'metadata': {'name': 'report'}},
+                'type': 'MODIFIED',
+                'status': {'tableRef': {'name': 'table-a'},
+                           'lastReportTime': f'2020-01-01T0{hour}:00:00Z'}}
+
+    async def test_report_event_burst(self):
+        scheduler = RatingScheduler(limit=1)
+        logger = mock.Mock()
+        with mock.patch.object(reports.scheduler, 'SCHEDULER', scheduler), \
+             mock.patch.object(reports.scheduler, 'COALESCER', EventCoalescer(0.01)), \
+             mock.patch.object(reports, 'rate_report', return_value=None) as rate_report:
+            # The handler returns at once, like kopf needs it to get the next events
+            for hour in range(5):
+                await asyncio.wait_for(reports.report_event(logger=logger, **self.event(hour)), 0.01)
+            self.assertEqual(1, len(reports.RATINGS))
+            rate_report.assert_not_called()
+            await asyncio.gather(*reports.RATINGS)
+        rate_report.assert_called_once()
+        self.assertEqual(('report', 'table-a'), rate_report.call_args.args[:2])
+        self.assertEqual(dt(2020, 1, 1, 4), rate_report.call_args.args[3])
+        self.assertEqual(0, len(reports.RATINGS))
+        logger.error.assert_not_called()
+
+    async def test_report_event_during_rating(self):
+        scheduler = RatingScheduler(limit=1)
+        release = asyncio.Event()
+        times = []
+
+        async def rate_report(report_name, table_name, logger, last_report_time, first_frame_time):
+            times.append(last_report_time)
+            await release.wait()
+        with mock.patch.object(reports.scheduler, 'SCHEDULER', scheduler), \
+             mock.patch.object(reports.scheduler, 'COALESCER', EventCoalescer(0)), \
+             mock.patch.object(reports, 'rate_report', side_effect=rate_report):
+            await reports.report_event(logger=mock.Mock(), **self.event(0))
+            first = next(iter(reports.RATINGS))
+            await asyncio.sleep(0.01)
+            for hour in range(1, 3):
+                await reports.report_event(logger=mock.Mock(), **self.event(hour))
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(first, *reports.RATINGS)
+        self.assertEqual([dt(2020, 1, 1, 0), dt(2020, 1, 1, 2)], times)
+
+    async def test_report_event_errors_logged(self):
+        logger = mock.Mock()
+        with mock.patch.object(reports.scheduler, 'SCHEDULER', RatingScheduler(limit=1)), \
+             mock.patch.object(reports.scheduler, 'COALESCER', EventCoalescer(0)), \
+             mock.patch.object(reports, 'rate_report', side_effect=ValueError('failed')):
+            await reports.report_event(logger=logger, **self.event(0))
+            await asyncio.gather(*reports.RATINGS, return_exceptions=True)
+        logger.error.assert_called_once_with('rating of report failed: failed')
+
+
+class TestEventCoalescer(unittest.IsolatedAsyncioTestCase):
+    """Test that bursts of events are collapsed into one call."""
+
+    async def test_burst_collapsed_into_last_call(self):
+        coalescer = EventCoalescer(0.05)
+        calls = []
+
+        def call(idx: int):
+            async def record():
+                calls.append(idx)
+                return idx
+            return record
+        futures = []
+        for idx in range(3):
+            futures.append(coalescer.submit('report', call(idx)))
+            await asyncio.sleep(0.01)
+        self.assertEqual([], calls)
+        self.assertEqual([2, 2, 2], await asyncio.gather(*futures))
+        self.assertEqual([2], calls)
+        self.assertEqual(0, len(coalescer))
+
+    async def test_keys_are_independent(self):
+        coalescer = EventCoalescer(0)
+
+        async def fail():
+            raise ValueError('failed')
+
+        async def succeed():
+            return 'rated'
+        failed = coalescer.submit('a', fail)
+        self.assertEqual('rated', await coalescer.submit('b', succeed))
+        with self.assertRaises(ValueError):
+            await failed
+
+    async def test_max_wait(self):
+        coalescer = EventCoalescer(0.05, max_wait=0.08)
+        calls = []
+
+        async def record():
+            calls.append(asyncio.get_running_loop().time())
+        start = asyncio.get_running_loop().time()
+        for _ in range(6):
+            coalescer.submit('report', record)
+            await asyncio.sleep(0.03)
+        # Made during the burst, before the last event
+        self.assertTrue(calls)
+        self.assertLess(calls[0] - start, 0.15)
+
+
+class TestRateReport(unittest.IsolatedAsyncioTestCase):
+    """Test that ratings with nothing new to rate are skipped."""
+
+    async def rate(self, last_report_time: dt, periods: list) -> mock.Mock:
+        with mock.patch.object(reports.configurations, 'retrieve_timeline',
+                               return_value=[{}]), \
+             mock.patch.object(reports, 'rated_or_not', return_value=dt(2020, 1, 1)), \
+             mock.patch.object(reports, 'split_rating_period', return_value=periods) as split, \
+             mock.patch.object(reports.rated_metrics, 'retrieve_periods') as retrieve:
+            await reports.rate_report('report', 'table', mock.Mock(), last_report_time)
+        return split, retrieve
+
+    async def test_skip_already_rated(self):
+        split, retrieve = await self.rate(dt(2020, 1, 1), [])
+        split.assert_not_called()
+        retrieve.assert_not_called()
+
+    async def test_skip_empty_period(self):
+        split, retrieve = await self.rate(dt(2020, 1, 2), [])
+        split.assert_called_once()
+        retrieve.assert_not_called()
+
+    async def test_first_rating_queries_from_reporting_start(self):
+        now = dt.utcnow()
+        body = {'metadata': {'name': 'report',
+                             'creationTimestamp': now.strftime('%Y-%m-%dT%H:%M:%SZ')}}
+        metric_config = {
+            'metric': 'usage_cpu',
+            'report_name': 'report',
+            'presto_table': 'table',
+            'presto_column': 'pod_usage_cpu_core_seconds',
+            'unit': 'core-seconds'
+        }
+
+        def split(report_name, table_name, begin, timeline):
+            return [({'valid_from': 0, 'rules': {'rules': []}},
+                     dict(metric_config, begin=begin, end=now))]
+
+        with mock.patch.object(reports.configurations, 'retrieve_timeline',
+                               return_value=[{}]), \
+             mock.patch.object(reports.configurations, 'ensure_rules_config'), \
+             mock.patch.object(reports, 'rated_or_not', return_value=dt.utcfromtimestamp(0)), \
+             mock.patch.object(reports, 'split_rating_period', side_effect=split), \
+             mock.patch.object(reports.rated_metrics, 'get_labels_from_table', return_value=[]), \
+             mock.patch.object(reports.rated_metrics, 'get_frames', return_value=[]) as get_frames:
+            await reports.rate_report('report', 'table', mock.Mock(),
+                                      first_frame_time=reports.reporting_start(body))
+        self.assertLessEqual(get_frames.call_count, 8)
+        self.assertEqual(now.replace(microsecond=0) - reports.REPORT_PERIOD_MAX,
+                         get_frames.call_args_list[0].args[0]['begin'])
+
+    def test_reporting_start(self):
+        self.assertEqual(dt(2020, 1, 1), reports.reporting_start({
+            'metadata': {'creationTimestamp': '2020-02-01T00:00:00Z'},
+            'spec': {'reportingStart': '2020-01-01T00:00:00Z'}}))
+        self.assertEqual(dt(2020, 2, 1) - reports.REPORT_PERIOD_MAX, reports.reporting_start({
+            'metadata': {'creationTimestamp': '2020-02-01T00:00:00Z'}}))
+        self.assertIsNone(reports.reporting_start({'metadata': {}}))
+
+    def test_parse_report_time(self):
+        self.assertEqual(dt(2020, 1, 1, 2), reports.parse_report_time('2020-01-01T02:00:00Z'))
+        self.assertIsNone(reports.parse_report_time(None))
+        self.assertIsNone(reports.parse_report_time('yesterday'))
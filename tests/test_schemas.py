@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from rating.manager import rated_metrics
+from rating.manager import reports
+
+
+class TestSchemaCache(unittest.TestCase):
+    """Test that tables columns are fetched once, until the table of a report changes."""
+
+    columns = [{'column_name': name} for name in (
+        'period_start', 'period_end', 'namespace', 'node', 'pod',
+        'pod_usage_cpu_core_seconds', 'instance_type')]
+
+    def setUp(self):
+        rated_metrics.SCHEMAS.invalidate()
+        reports.REPORT_TABLES.clear()
+        patcher = mock.patch('rating.manager.utils.get_from_rating_api',
+                             return_value=self.columns)
+        self.api = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def labels(self, table: str) -> list:
+        return rated_metrics.get_labels_from_table(table, 'pod_usage_cpu_core_seconds')
+
+    def test_columns_fetched_once(self):
+        self.assertEqual(['instance_type'], self.labels('table_a'))
+        self.assertEqual(['instance_type'], self.labels('table_a'))
+        self.assertEqual(1, self.api.call_count)
+        self.labels('table_b')
+        self.assertEqual(2, self.api.call_count)
+
+    def test_empty_schema_not_cached(self):
+        self.api.return_value = []
+        self.assertEqual([], self.labels('table_a'))
+        self.api.return_value = self.columns
+        self.assertEqual(['instance_type'], self.labels('table_a'))
+        self.assertEqual(2, self.api.call_count)
+
+    def test_expired_schema_fetched_again(self):
+        with mock.patch.object(rated_metrics.SCHEMAS, 'ttl', 0):
+            self.labels('table_a')
+            self.labels('table_a')
+        self.assertEqual(2, self.api.call_count)
+
+    def test_invalidated_when_table_ref_changes(self):
+        reports.track_table_ref('report', 'table-a')
+        self.labels('table_a')
+        reports.track_table_ref('report', 'table-a')
+        self.labels('table_a')
+        self.assertEqual(1, self.api.call_count)
+
+        reports.track_table_ref('report', 'table-b')
+        self.assertEqual('table_b', reports.REPORT_TABLES['report'])
+        self.labels('table_a')
+        self.assertEqual(2, self.api.call_count)
+
+        reports.track_table_ref('report', None)
+        self.assertNotIn('report', reports.REPORT_TABLES)
+        self.labels('table_b')
+        self.assertEqual(3, self.api.call_count)
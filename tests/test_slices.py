@@ -0,0 +1,88 @@
+import os
+import threading
+import unittest
+from datetime import datetime as dt, timedelta
+from unittest import mock
+
+from rating.manager import rated_metrics
+from rating.manager.frames import FrameBatch
+
+
+def make_frame(period_start: dt, pod: str) -> dict:
+    """Build a frame as returned by the rating-api."""
+    return {
+        'period_start': period_start.isoformat(),
+        'period_end': period_start.isoformat(),
+        'namespace': 'ns',
+        'node': 'node-1',
+        'pod': pod,
+        'pod_usage_cpu_core_seconds': 60,
+        'instance_type': pod[-1]
+    }
+
+
+class TestWindowSlices(unittest.TestCase):
+    """Test that a period rated as a single window is fetched as concurrent slices, merged in order."""
+
+    window_config = {
+        'metric': 'usage_cpu',
+        'presto_table': 'table',
+        'presto_column': 'pod_usage_cpu_core_seconds',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 4)
+    }
+
+    @mock.patch.dict(os.environ, {'RATING_FETCH_CONCURRENCY': '4',
+                                  'RATING_FETCH_SLICE_MIN': '86400'})
+    def test_split(self):
+        self.assertEqual([(dt(2020, 1, 1), dt(2020, 1, 1, 12))],
+                         rated_metrics.split_window(dt(2020, 1, 1), dt(2020, 1, 1, 12)))
+        self.assertEqual([(dt(2020, 1, 1), dt(2020, 1, 2)),
+                          (dt(2020, 1, 2), dt(2020, 1, 3)),
+                          (dt(2020, 1, 3), dt(2020, 1, 4))],
+                         rated_metrics.split_window(dt(2020, 1, 1), dt(2020, 1, 4)))
+        slices = rated_metrics.split_window(dt(1970, 1, 1), dt(2020, 1, 1))
+        self.assertEqual(4, len(slices))
+        self.assertEqual((dt(1970, 1, 1), dt(2020, 1, 1)), (slices[0][0], slices[-1][1]))
+        self.assertEqual({slices[0][1] - slices[0][0]},
+                         {end - begin for begin, end in slices})
+
+    @mock.patch.dict(os.environ, {'RATING_FETCH_CONCURRENCY': '1'})
+    def test_not_split_without_concurrency(self):
+        self.assertEqual(1, len(rated_metrics.split_window(dt(1970, 1, 1), dt(2020, 1, 1))))
+
+    @mock.patch.dict(os.environ, {'RATING_FETCH_CONCURRENCY': '3',
+                                  'RATING_FETCH_SLICE_MIN': '86400'})
+    def test_fetched_concurrently_in_order(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def get_frames(slice_config, labels):
+            # Every slice waits for the others: only passes if they run at once
+            barrier.wait()
+            begin = slice_config['begin']
+            return [make_frame(begin + timedelta(hours=hour), f'pod-{begin.day}-{hour % 2}')
+                    for hour in range(2)]
+        with mock.patch.object(rated_metrics, 'get_frames', side_effect=get_frames):
+            frames = rated_metrics.fetch_window(self.window_config, '', ['instance_type'])
+        self.assertEqual(['pod-1-0', 'pod-1-1', 'pod-2-0', 'pod-2-1', 'pod-3-0', 'pod-3-1'],
+                         frames.values('pod'))
+        self.assertEqual([('0',), ('1',)], frames.labelsets.values)
+        self.assertEqual([0, 1, 0, 1, 0, 1], list(frames.labelset_codes))
+
+
+class TestFrameBatchMerge(unittest.TestCase):
+    """Test the merge of batches of the same table."""
+
+    def test_merge(self):
+        first = FrameBatch.from_frames([make_frame(dt(2020, 1, 1), 'pod-a'),
+                                        make_frame(dt(2020, 1, 1), 'pod-b')],
+                                       'pod_usage_cpu_core_seconds', ['instance_type'])
+        second = FrameBatch.from_frames([make_frame(dt(2020, 1, 2), 'pod-b'),
+                                         make_frame(dt(2020, 1, 2), 'pod-c')],
+                                        'pod_usage_cpu_core_seconds', ['instance_type'])
+        first.merge(second)
+        self.assertEqual(4, len(first))
+        self.assertEqual(['pod-a', 'pod-b', 'pod-b', 'pod-c'], first.values('pod'))
+        self.assertEqual(3, len(first.dictionaries['pod']))
+        self.assertEqual(['ns'] * 4, first.values('namespace'))
+        self.assertEqual({'instance_type': 'c'}, first.labels(3))
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import unittest
+import weakref
+from datetime import datetime as dt
+from unittest import mock
+
+from rating.manager import rated_metrics
+
+
+def make_frame(period_start: dt, namespace: str) -> dict:
+    """Build a frame as returned by the rating-api."""
+    return {
+        'period_start': period_start.isoformat(),
+        'period_end': period_start.isoformat(),
+        'namespace': namespace,
+        'node': 'node-1',
+        'pod': 'pod-1',
+        'pod_usage_cpu_core_seconds': 3600,
+        'instance_type': 'small'
+    }
+
+
+class TestStreaming(unittest.TestCase):
+    """Test that frames are loaded, rated and sent one window at a time."""
+
+    rules = [{
+        'labelSet': {'instance_type': 'small'},
+        'ruleset': [{'metric': 'usage_cpu', 'value': 2, 'unit': 'core-hours'}]
+    }]
+
+    def metric_config(self, begin: dt, end: dt) -> dict:
+        return {
+            'metric': 'usage_cpu',
+            'report_name': 'pod-cpu-usage-hourly',
+            'presto_table': 'report_metering_pod_cpu_usage_hourly',
+            'presto_column': 'pod_usage_cpu_core_seconds',
+            'unit': 'core-seconds',
+            'begin': begin,
+            'end': end
+        }
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '86400'})
+    def test_windows_are_contiguous(self):
+        config = self.metric_config(dt(2020, 1, 1), dt(2020, 1, 3, 12))
+        with mock.patch.object(rated_metrics, 'get_frames',
+                               side_effect=lambda cfg, _: [make_frame(cfg['begin'], 'ns')]):
+            windows = [(cfg['begin'], cfg['end'])
+                       for cfg, _ in rated_metrics.iter_frames(config, [])]
+        self.assertEqual([
+            (dt(2020, 1, 1), dt(2020, 1, 2)),
+            (dt(2020, 1, 2), dt(2020, 1, 3)),
+            (dt(2020, 1, 3), dt(2020, 1, 3, 12))
+        ], windows)
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '86400',
+                                  'RATING_FRAMES_WINDOW_MAX': '4',
+                                  'RATING_FETCH_CONCURRENCY': '1'})
+    def test_empty_windows_grow(self):
+        config = self.metric_config(dt(2020, 1, 1), dt(2020, 2, 1))
+        with mock.patch.object(rated_metrics, 'get_frames', return_value=[]):
+            lengths = [(cfg['end'] - cfg['begin']).days
+                       for cfg, _ in rated_metrics.iter_frames(config, [])]
+        self.assertEqual([1, 2, 4, 4, 4, 4, 4, 4, 4], lengths)
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '86400',
+                                  'RATING_FRAMES_WINDOW_MAX': '4',
+                                  'RATING_FETCH_CONCURRENCY': '3'})
+    def test_windows_fetched_ahead(self):
+        config = self.metric_config(dt(2020, 1, 1), dt(2020, 1, 29))
+        barrier = threading.Barrier(3, timeout=5)
+        data = {dt(2020, 1, 1), dt(2020, 1, 2), dt(2020, 1, 3)}
+
+        def get_frames(cfg, _):
+            # Every window of a round waits for the others: only passes if they run at once
+            barrier.wait()
+            return [make_frame(cfg['begin'], 'ns')] if cfg['begin'] in data else []
+        with mock.patch.object(rated_metrics, 'get_frames', side_effect=get_frames):
+            windows = [((cfg['end'] - cfg['begin']).days, len(frames))
+                       for cfg, frames in rated_metrics.iter_frames(config, [])]
+        # Windows come in order; after an empty round the next one is planned growing
+        self.assertEqual([(1, 1), (1, 1), (1, 1),
+                          (1, 0), (1, 0), (1, 0),
+                          (2, 0), (4, 0), (4, 0),
+                          (4, 0), (4, 0), (4, 0)], windows)
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '86400',
+                                  'RATING_FETCH_CONCURRENCY': '3'})
+    def test_windows_released_once_consumed(self):
+        config = self.metric_config(dt(2020, 1, 1), dt(2020, 1, 4))
+        with mock.patch.object(rated_metrics, 'get_frames',
+                               side_effect=lambda cfg, _: [make_frame(cfg['begin'], 'ns')]):
+            windows = rated_metrics.iter_frames(config, [])
+            _, frames = next(windows)
+            first = weakref.ref(frames)
+            del frames
+            next(windows)
+            # The rest of the round is still pending, but not the first window
+            self.assertIsNone(first())
+            windows.close()
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '0'})
+    def test_single_window(self):
+        config = self.metric_config(dt(2020, 1, 1), dt(2021, 1, 1))
+        with mock.patch.object(rated_metrics, 'get_frames', return_value=[]):
+            windows = [(cfg, len(frames)) for cfg, frames in rated_metrics.iter_frames(config, [])]
+        self.assertEqual([(config, 0)], windows)
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '86400'})
+    def test_one_upload_per_window(self):
+        config = self.metric_config(dt(2020, 1, 1), dt(2020, 1, 3))
+        frames = {
+            dt(2020, 1, 1): [make_frame(dt(2020, 1, 1), 'ns-a'),
+                             make_frame(dt(2020, 1, 1), 'ns-b'),
+                             make_frame(dt(2020, 1, 1), 'ns-a')],
+            dt(2020, 1, 2): [make_frame(dt(2020, 1, 2), 'ns-c')]
+        }
+        with mock.patch.object(rated_metrics, 'get_labels_from_table',
+                               return_value=['instance_type']), \
+             mock.patch.object(rated_metrics, 'get_frames',
+                               side_effect=lambda cfg, _: frames[cfg['begin']]), \
+             mock.patch.object(rated_metrics, 'update_rated_data') as update:
+            rated_metrics.retrieve_data(self.rules, config, logging.getLogger())
+        self.assertEqual(2, update.call_count)
+        first, second = (call.args for call in update.call_args_list)
+        self.assertEqual(3, len(first[0]))
+        self.assertEqual(['ns-a', 'ns-b'], first[1])
+        self.assertEqual(2.0, first[0][0][7])
+        self.assertEqual(['ns-c'], second[1])
+        # Each window moves the rated time to its own end, not to the time of the rating
+        self.assertEqual('2020-01-02 00:00:00.000', first[3])
+        self.assertEqual('2020-01-03 00:00:00.000', second[3])
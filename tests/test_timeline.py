@@ -0,0 +1,64 @@
+import unittest
+
+from rating.manager.configurations import ConfigurationTimeline
+
+
+def make_configuration(valid_from: int) -> dict:
+    """Build a minimal configuration valid from the given epoch."""
+    return {'valid_from': str(valid_from), 'valid_to': '4102448460'}
+
+
+class TestConfigurationTimeline(unittest.TestCase):
+    """Test the selection of configurations over time."""
+
+    starts = (0, 1576663550, 1576675754, 1576678772)
+
+    def setUp(self):
+        self.timeline = ConfigurationTimeline(make_configuration(start)
+                                              for start in reversed(self.starts))
+
+    def valid_from(self, configurations: list) -> list:
+        return [int(configuration['valid_from']) for configuration in configurations]
+
+    def test_active(self):
+        self.assertEqual('0', self.timeline.active(0)['valid_from'])
+        self.assertEqual('1576663550', self.timeline.active(1576672457)['valid_from'])
+        self.assertEqual('1576675754', self.timeline.active(1576675754)['valid_from'])
+        self.assertEqual('1576678772', self.timeline.active(19231123123)['valid_from'])
+
+    def test_epochs_of_different_lengths(self):
+        timeline = ConfigurationTimeline([make_configuration(999999999),
+                                          make_configuration(1000000000)])
+        self.assertEqual('1000000000', timeline.active(1500000000)['valid_from'])
+
+    def test_before_first_configuration(self):
+        timeline = ConfigurationTimeline([make_configuration(100)])
+        self.assertEqual('100', timeline.active(10)['valid_from'])
+        self.assertIsNone(ConfigurationTimeline().active(10))
+
+    def test_overlapping(self):
+        self.assertEqual([0, 1576663550, 1576675754],
+                         self.valid_from(self.timeline.overlapping(10, 1576675800)))
+        self.assertEqual([1576663550],
+                         self.valid_from(self.timeline.overlapping(1576663550, 1576675754)))
+        self.assertEqual([1576678772],
+                         self.valid_from(self.timeline.overlapping(1576678800, 1576679000)))
+        self.assertEqual([], ConfigurationTimeline().overlapping(0, 10))
+
+    def test_incremental_update(self):
+        kept = self.timeline.active(0)
+        unchanged = self.timeline.active(1576663550)
+        replaced = dict(make_configuration(1576675754), valid_to='1600000000')
+        self.timeline.update([kept,
+                              make_configuration(1576663550),
+                              replaced,
+                              make_configuration(1600000000)])
+        self.assertEqual([0, 1576663550, 1576675754, 1600000000],
+                         self.valid_from(self.timeline.overlapping(0, 1700000000)))
+        self.assertIs(kept, self.timeline.active(0))
+        # An equal configuration fetched again leaves the timeline untouched
+        self.assertIs(unchanged, self.timeline.active(1576663550))
+        self.assertIs(replaced, self.timeline.active(1576675754))
+        self.timeline.discard(1576663550)
+        self.assertEqual(3, len(self.timeline))
+        self.assertEqual('0', self.timeline.active(1576663550)['valid_from'])
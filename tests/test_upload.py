@@ -0,0 +1,92 @@
+import logging
+import os
+import unittest
+from datetime import datetime as dt
+from unittest import mock
+
+import kopf
+
+from rating.manager import checkpoints
+from rating.manager import rated_metrics
+
+
+class TestBatchedUpload(unittest.TestCase):
+    """Test that rated frames are sent in batches, retried one by one."""
+
+    window_config = {
+        'metric': 'usage_cpu',
+        'report_name': 'pod-cpu-usage-hourly',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 2)
+    }
+    rated_frames = [('start', 'end', f'ns-{idx % 3}', 'node', 'usage_cpu', 'pod', 1, 1, '{}')
+                    for idx in range(10)]
+
+    def setUp(self):
+        checkpoints.CHECKPOINTS.discard()
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_BATCH_SIZE': '4'})
+    def test_row_bounded_batches(self):
+        with mock.patch.object(rated_metrics, 'update_rated_data') as update:
+            rated_metrics.send_rated_frames(self.rated_frames,
+                                            self.window_config,
+                                            logging.getLogger())
+        sizes = [len(call.args[0]) for call in update.call_args_list]
+        self.assertEqual([4, 4, 2], sizes)
+        last_inserts = [call.args[3] for call in update.call_args_list]
+        self.assertEqual(['2020-01-01 00:00:00.000',
+                          '2020-01-01 00:00:00.000',
+                          '2020-01-02 00:00:00.000'], last_inserts)
+        # Frames are sent sorted, by period then namespace
+        self.assertEqual([['ns-0'], ['ns-1', 'ns-2'], ['ns-2']],
+                         [call.args[1] for call in update.call_args_list])
+        self.assertEqual(0, len(checkpoints.CHECKPOINTS))
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_BATCH_SIZE': '4',
+                                  'RATING_UPLOAD_RETRIES': '2'})
+    def test_batch_retried_on_its_own(self):
+        failure = kopf.TemporaryError('failed', delay=5)
+        with mock.patch.object(rated_metrics, 'update_rated_data',
+                               side_effect=[{}, failure, failure, {}, {}]) as update, \
+             mock.patch.object(rated_metrics.time, 'sleep'):
+            rated_metrics.send_rated_frames(self.rated_frames,
+                                            self.window_config,
+                                            logging.getLogger())
+        self.assertEqual(5, update.call_count)
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_BATCH_SIZE': '4',
+                                  'RATING_UPLOAD_RETRIES': '0'})
+    def test_resume_after_committed_batches(self):
+        failure = kopf.TemporaryError('failed', delay=5)
+        with mock.patch.object(rated_metrics, 'update_rated_data',
+                               side_effect=[{}, failure]):
+            with self.assertRaises(kopf.TemporaryError):
+                rated_metrics.send_rated_frames(self.rated_frames,
+                                                self.window_config,
+                                                logging.getLogger())
+        key = rated_metrics.progress_key(self.window_config, dt(2020, 1, 1))
+        progress = checkpoints.CHECKPOINTS.get(key)
+        self.assertEqual(dt(2020, 1, 2), progress['end'])
+        self.assertEqual('ns-0', progress['last_row'][2])
+
+        # Frames come back in another order, which does not change the ones sent again
+        with mock.patch.object(rated_metrics, 'update_rated_data') as update:
+            rated_metrics.send_rated_frames(list(reversed(self.rated_frames)),
+                                            self.window_config,
+                                            logging.getLogger())
+        self.assertEqual([4, 2], [len(call.args[0]) for call in update.call_args_list])
+        namespaces = [frame[2] for call in update.call_args_list for frame in call.args[0]]
+        self.assertEqual(['ns-1'] * 3 + ['ns-2'] * 3, namespaces)
+
+    @mock.patch.dict(os.environ, {'RATING_FRAMES_WINDOW': '3600'})
+    def test_retried_window_keeps_its_end(self):
+        key = rated_metrics.progress_key(self.window_config, dt(2020, 1, 1))
+        checkpoints.CHECKPOINTS.start(key, 'pod-cpu-usage-hourly', dt(2020, 1, 1, 6))
+        checkpoints.CHECKPOINTS.commit(key, ('start',))
+        metric_config = dict(self.window_config, end=dt(2020, 1, 1, 7))
+        frame = {'period_start': 'start', 'period_end': 'end', 'namespace': 'ns',
+                 'node': 'node', 'pod': 'pod', 'pod_usage_cpu_core_seconds': 1}
+        metric_config['presto_column'] = 'pod_usage_cpu_core_seconds'
+        with mock.patch.object(rated_metrics, 'get_frames', return_value=[frame]):
+            windows = [cfg['end'] for cfg, _ in rated_metrics.iter_frames(metric_config, [])]
+        self.assertEqual([dt(2020, 1, 1, 6), dt(2020, 1, 1, 7)], windows)
@@ -0,0 +1,118 @@
+import logging
+import os
+import tempfile
+import unittest
+from datetime import datetime as dt
+from unittest import mock
+
+import kopf
+
+from rating.manager import checkpoints
+from rating.manager import rated_metrics
+from rating.manager import reports
+from rating.manager import watermarks
+from rating.manager.watermarks import WatermarkStore
+
+
+class TestWatermarkStore(unittest.TestCase):
+    """Test the watermarks kept in memory and in a file."""
+
+    def test_unverified_watermark_not_used(self):
+        store = WatermarkStore()
+        store.set('report', dt(2020, 1, 1))
+        self.assertIsNone(store.get('report'))
+        self.assertEqual(dt(2020, 1, 1), store.verify('report', dt(2020, 1, 1)))
+        self.assertEqual(dt(2020, 1, 1), store.get('report'))
+        store.invalidate('report')
+        self.assertIsNone(store.get('report'))
+
+    def test_exact_watermark_kept_when_matching(self):
+        store = WatermarkStore()
+        store.set('report', dt(2020, 1, 1, 0, 0, 0, 123000))
+        self.assertEqual(dt(2020, 1, 1, 0, 0, 0, 123000),
+                         store.verify('report', dt(2020, 1, 1)))
+
+    def test_mismatch_replaced_by_reference(self):
+        store = WatermarkStore()
+        store.set('report', dt(2020, 1, 2))
+        self.assertEqual(dt(2020, 1, 1), store.verify('report', dt(2020, 1, 1)))
+        self.assertEqual(dt(2020, 1, 1), store.get('report'))
+
+    def test_saved_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'watermarks.json')
+            store = WatermarkStore(path)
+            store.set('report', dt(2020, 1, 1, 12, 30, 0, 500))
+            store.set('other', dt(2020, 1, 1))
+            store.discard('other')
+            loaded = WatermarkStore(path)
+            self.assertIsNone(loaded.get('report'))
+            self.assertEqual(dt(2020, 1, 1, 12, 30, 0, 500),
+                             loaded.verify('report', dt(2020, 1, 1, 12, 30)))
+            self.assertIsNone(loaded.get('other'))
+
+    def test_invalid_file_ignored(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as invalid:
+            invalid.write('{')
+            invalid.flush()
+            with self.assertLogs(level='WARNING'):
+                store = WatermarkStore(invalid.name)
+        self.assertIsNone(store.get('report'))
+
+
+class TestRatedOrNot(unittest.IsolatedAsyncioTestCase):
+    """Test that the rating-api is only asked for the last rated time when needed."""
+
+    async def test_api_asked_once(self):
+        with mock.patch.object(watermarks, 'WATERMARKS', WatermarkStore()), \
+             mock.patch.object(reports, 'retrieve_last_rated_report',
+                               return_value='Wed, 01 Jan 2020 00:00:00 GMT') as last_rated:
+            self.assertEqual(dt(2020, 1, 1), await reports.rated_or_not('report'))
+            watermarks.WATERMARKS.set('report', dt(2020, 1, 2))
+            self.assertEqual(dt(2020, 1, 2), await reports.rated_or_not('report'))
+            watermarks.WATERMARKS.invalidate('report')
+            self.assertEqual(dt(2020, 1, 1), await reports.rated_or_not('report'))
+        self.assertEqual(2, last_rated.call_count)
+
+    async def test_never_rated(self):
+        with mock.patch.object(watermarks, 'WATERMARKS', WatermarkStore()), \
+             mock.patch.object(reports, 'retrieve_last_rated_report', return_value=None):
+            self.assertEqual(dt(1970, 1, 1), await reports.rated_or_not('report'))
+
+
+class TestUploadWatermarks(unittest.TestCase):
+    """Test that uploads move the watermark, and that failures invalidate it."""
+
+    window_config = {
+        'metric': 'usage_cpu',
+        'report_name': 'report',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 2)
+    }
+    rated_frames = [('start', 'end', 'ns', 'node', 'usage_cpu', 'pod', 1, 1, '{}')] * 3
+
+    def setUp(self):
+        checkpoints.CHECKPOINTS.discard()
+        patcher = mock.patch.object(watermarks, 'WATERMARKS', WatermarkStore())
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store.verify('report', dt(2020, 1, 1))
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_BATCH_SIZE': '2'})
+    def test_moved_by_final_batch(self):
+        with mock.patch.object(rated_metrics, 'update_rated_data'):
+            rated_metrics.send_rated_frames(self.rated_frames,
+                                            self.window_config,
+                                            logging.getLogger())
+        self.assertEqual(dt(2020, 1, 2), self.store.get('report'))
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_BATCH_SIZE': '2',
+                                  'RATING_UPLOAD_RETRIES': '0'})
+    def test_invalidated_by_failure(self):
+        with mock.patch.object(rated_metrics, 'update_rated_data',
+                               side_effect=kopf.TemporaryError('failed')):
+            with self.assertRaises(kopf.TemporaryError):
+                rated_metrics.send_rated_frames(self.rated_frames,
+                                                self.window_config,
+                                                logging.getLogger())
+        self.assertIsNone(self.store.get('report'))
@@ -0,0 +1,131 @@
+import gzip
+import json
+import os
+import unittest
+from datetime import datetime as dt
+from unittest import mock
+
+from rating.manager import rated_metrics
+from rating.manager.frames import encode_columns
+
+from rating_api_stub import start_rating_api_stub
+
+
+def decode_columns(rated_frames: dict) -> list:
+    """Rebuild the rated frames tuples from the columnar format."""
+    strings = rated_frames['strings']
+    columns = []
+    for name in ('frame_begin', 'frame_end', 'namespace', 'node', 'metric',
+                 'pod', 'quantity', 'rating', 'labels'):
+        column = rated_frames['columns'][name]
+        if name not in ('quantity', 'rating'):
+            column = [strings[code] for code in column]
+        columns.append(column)
+    return [list(row) for row in zip(*columns)]
+
+
+class TestColumnarEncoding(unittest.TestCase):
+    """Test the columnar encoding of rated frames."""
+
+    rated_frames = [('start', 'end', f'ns-{idx % 2}', 'node', 'usage_cpu', f'pod-{idx}',
+                     float(idx), None if idx == 1 else idx / 2, '{}') for idx in range(4)]
+
+    def test_round_trip(self):
+        encoded = encode_columns(self.rated_frames)
+        self.assertEqual('columnar', encoded['format'])
+        self.assertEqual(len(set(encoded['strings'])), len(encoded['strings']))
+        self.assertEqual([list(row) for row in self.rated_frames], decode_columns(encoded))
+
+    def test_empty(self):
+        self.assertEqual([], encode_columns([])['columns']['pod'])
+
+
+class TestUploadEncodings(unittest.TestCase):
+    """Test the uploads encodings, against a stand-in rating-api."""
+
+    window_config = {
+        'metric': 'usage_cpu',
+        'report_name': 'report',
+        'begin': dt(2020, 1, 1),
+        'end': dt(2020, 1, 2)
+    }
+    rated_frames = [('2020-01-01 00:00:00', '2020-01-01 01:00:00', f'ns-{idx % 10}',
+                     'node-1', 'usage_cpu', f'pod-{idx // 4}', 1.5, 0.25,
+                     "{'instance_type': 'small'}") for idx in range(2000)]
+
+    def setUp(self):
+        self.stub = start_rating_api_stub(self)
+        self.logger = mock.Mock()
+        self.stub.routes[('POST', '/rated/frames/add')] = self.add_frames
+        self.accepted = ('json', 'gzip', 'columnar')
+        self.received = []
+        rated_metrics.ENCODINGS.invalidate()
+        rated_metrics.REFUSED_ENCODINGS.clear()
+        self.addCleanup(rated_metrics.REFUSED_ENCODINGS.clear)
+
+    def add_frames(self, request: dict) -> tuple:
+        raw = request['raw']
+        encoding = 'json'
+        if request['headers'].get('content-encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+            encoding = 'gzip'
+        payload = json.loads(raw)
+        if isinstance(payload['rated_frames'], dict):
+            encoding = payload['rated_frames']['format']
+            payload['rated_frames'] = decode_columns(payload['rated_frames'])
+        if encoding not in self.accepted:
+            return 415, {'message': f'{encoding} not supported'}
+        self.received.append((encoding, len(request['raw']), payload))
+        return 200, {'results': 'ok'}
+
+    def upload(self) -> dict:
+        return rated_metrics.update_rated_data(self.rated_frames, ['ns-0'], self.window_config,
+                                               '2020-01-02 00:00:00.000', self.logger)
+
+    def test_encodings_carry_the_same_frames(self):
+        sizes = {}
+        for encoding in ('json', 'gzip', 'columnar'):
+            with mock.patch.dict(os.environ, {'RATING_UPLOAD_ENCODING': encoding}):
+                self.upload()
+            received, sizes[encoding], payload = self.received[-1]
+            self.assertEqual(encoding, received)
+            self.assertEqual([list(row) for row in self.rated_frames], payload['rated_frames'])
+            self.assertEqual('secret', payload['token'])
+        self.assertLess(sizes['columnar'] * 10, sizes['json'])
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_ENCODING': 'columnar'})
+    def test_refused_encoding_falls_back(self):
+        self.accepted = ('json', 'gzip')
+        self.upload()
+        self.upload()
+        self.assertEqual(['gzip', 'gzip'], [received[0] for received in self.received])
+        self.assertEqual(3, len(self.stub.requests))
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_ENCODING': 'auto'})
+    def test_negotiated_encoding(self):
+        self.stub.routes[('GET', '/rated/frames/encodings')] = \
+            lambda _: (200, {'results': ['json', 'gzip']})
+        self.upload()
+        self.upload()
+        self.assertEqual(['gzip', 'gzip'], [received[0] for received in self.received])
+        self.assertEqual(1, len([request for request in self.stub.requests
+                                 if request['method'] == 'GET']))
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_ENCODING': 'auto'})
+    def test_older_api_gets_json(self):
+        self.upload()
+        self.upload()
+        self.assertEqual(['json', 'json'], [received[0] for received in self.received])
+        # Without the endpoint, the encodings are not asked again for each upload
+        self.assertEqual(1, len([request for request in self.stub.requests
+                                 if request['method'] == 'GET']))
+
+    @mock.patch.dict(os.environ, {'RATING_UPLOAD_ENCODING': 'auto'})
+    def test_failed_negotiation_not_kept(self):
+        self.stub.routes[('GET', '/rated/frames/encodings')] = lambda _: (400, {'message': 'failed'})
+        self.upload()
+        self.stub.routes[('GET', '/rated/frames/encodings')] = \
+            lambda _: (200, {'results': ['json', 'gzip', 'columnar']})
+        self.upload()
+        self.assertEqual(['json', 'columnar'], [received[0] for received in self.received])
+        self.logger.warning.assert_called_once()